@@ -0,0 +1,240 @@
+"""
+Admin dashboard counters and activity log
+Keeps the users/teams/players/matches/fans/venues counts shown on the admin
+dashboard in memory, moved by the write events instead of six COUNT(*) scans
+per page view, and reconciles them against the real counts every
+COUNTERS_RECONCILE_SECONDS on a background thread. Recent writes are kept in
+a fixed-size ring buffer for the activity log.
+"""
+
+import os
+import sys
+import logging
+import threading
+from itertools import islice
+from datetime import datetime
+from collections import OrderedDict, deque, namedtuple
+
+from flask import has_request_context, session
+
+import events
+from db_pool import get_pool
+from reference_cache import team_name
+from season_archive import get_archive
+
+logger = logging.getLogger('admin')
+
+COUNTERS_RECONCILE_SECONDS = float(os.environ.get('COUNTERS_RECONCILE_SECONDS', 600))
+ACTIVITY_LOG_SIZE = int(os.environ.get('ACTIVITY_LOG_SIZE', 50))
+ACTIVITY_SHOWN = 10
+
+# Dashboard counter -> the table it counts
+COUNTED_TABLES = OrderedDict([('users', 'USERS'), ('teams', 'TEAMS'), ('players', 'PLAYERS'),
+                              ('matches', 'MATCHES'), ('fans', 'FANS'), ('venues', 'VENUES')])
+
+Activity = namedtuple('Activity', 'action timestamp description username')
+
+
+class AdminCounters:
+    """Row counts kept current by the write events, corrected by periodic recounts"""
+
+    def __init__(self, reconcile_seconds=COUNTERS_RECONCILE_SECONDS):
+        self.reconcile_seconds = reconcile_seconds
+        self._lock = threading.RLock()
+        self._counts = {}
+        self._built = False
+        self._thread = None
+        self._wakeup = threading.Event()
+        self.reconciled_at = None
+        self.reconciles = 0
+        self.corrections = 0
+
+    def reconcile(self):
+        """Replace every counter with its table's COUNT(*); returns the corrections made"""
+        counts = {}
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            for name, table in COUNTED_TABLES.items():
+                cursor.execute(f'SELECT COUNT(*) FROM {table}')
+                counts[name] = cursor.fetchone()[0]
+            # Archived seasons are counted from their snapshots, whether or not MATCHES still holds them
+            boundary = get_archive().boundary()
+            if boundary is not None:
+                cursor.execute('SELECT COUNT(*) FROM MATCHES WHERE MatchDateTime >= ?', (boundary,))
+                counts['matches'] = cursor.fetchone()[0] + get_archive().match_count()
+
+        # A write that lands between the count and here is corrected by the next reconcile
+        with self._lock:
+            corrections = {name: count - self._counts[name] for name, count in counts.items()
+                           if self._built and self._counts[name] != count}
+            self._counts = counts
+            self._built = True
+            self.reconciled_at = datetime.now()
+            self.reconciles += 1
+            self.corrections += sum(abs(delta) for delta in corrections.values())
+        if corrections:
+            logger.info(f"Admin counters corrected by reconcile: {corrections}")
+        return corrections
+
+    def _ensure_built(self):
+        if not self._built:
+            with self._lock:
+                if not self._built:
+                    self.reconcile()
+                    self._start()
+
+    def _start(self):
+        if self._thread is None and self.reconcile_seconds > 0:
+            self._thread = threading.Thread(target=self._run, name='admin-counters', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.reconcile_seconds)
+            self._wakeup.clear()
+            try:
+                self.reconcile()
+            except Exception as e:
+                logger.error(f"Admin counters reconcile failed: {str(e)}")
+
+    def request_reconcile(self):
+        """Recount on the background thread now rather than at the next interval"""
+        self._wakeup.set()
+
+    def adjust(self, name, delta=1):
+        with self._lock:
+            # Only worth applying once built; the first build counts the tables anyway
+            if self._built:
+                self._counts[name] += delta
+
+    def counts(self):
+        """{'users_count': ..., 'teams_count': ..., ...} for the dashboard"""
+        self._ensure_built()
+        with self._lock:
+            return {f'{name}_count': count for name, count in self._counts.items()}
+
+    def stats(self):
+        with self._lock:
+            return {'built': self._built, 'reconciles': self.reconciles, 'corrections': self.corrections,
+                    'reconciled_at': self.reconciled_at.isoformat(' ', 'seconds') if self.reconciled_at else None}
+
+
+class ActivityLog:
+    """The last ACTIVITY_LOG_SIZE writes, newest first"""
+
+    def __init__(self, size=ACTIVITY_LOG_SIZE):
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.recorded = 0
+
+    def record(self, action, description, username=None):
+        entry = Activity(action, datetime.now(), description, username)
+        with self._lock:
+            self._entries.appendleft(entry)
+            self.recorded += 1
+
+    def recent(self, limit=ACTIVITY_SHOWN):
+        with self._lock:
+            return list(islice(self._entries, limit))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_counters = AdminCounters()
+_activity = ActivityLog()
+
+
+def get_admin_counters():
+    return _counters
+
+
+def get_activity_log():
+    return _activity
+
+
+def _actor():
+    # Handlers run on the request that made the write, when there is one
+    return session.get('username') if has_request_context() else None
+
+
+def _kickoff(value):
+    return value.strftime('%d %b %Y %H:%M') if isinstance(value, datetime) else str(value)
+
+
+def _on_user_registered(user_id, username, role, **payload):
+    _counters.adjust('users')
+    if role == 'fan':
+        _counters.adjust('fans')
+    _activity.record('User registered', f"{username} registered as {role}", username)
+
+
+def _on_player_written(player_id, team_id, full_name, position, created=False, **payload):
+    if created:
+        _counters.adjust('players')
+    _activity.record('Player profile created' if created else 'Player profile updated',
+                     f"{full_name} ({position}, {team_name(team_id)})", _actor())
+
+
+def _on_match_created(match_id, home_team_id, away_team_id, match_datetime, **payload):
+    _counters.adjust('matches')
+    _activity.record('Match scheduled', f"{team_name(home_team_id)} vs {team_name(away_team_id)}, "
+                                        f"{_kickoff(match_datetime)}", _actor())
+
+
+def _on_season_scheduled(matches, teams, first_kickoff, last_kickoff, **payload):
+    _counters.adjust('matches', matches)
+    _activity.record('Season scheduled', f"{matches} matches for {teams} teams, "
+                                         f"{_kickoff(first_kickoff)} to {_kickoff(last_kickoff)}", _actor())
+
+
+def _on_match_updated(match_id, home_team_id, away_team_id, home_score, away_score, status, **payload):
+    score = f" {home_score}-{away_score} " if home_score is not None and away_score is not None else ' vs '
+    _activity.record('Match updated', f"{team_name(home_team_id)}{score}{team_name(away_team_id)} ({status})",
+                     _actor())
+
+
+def _on_player_stats_written(match_ids=(), **payload):
+    _activity.record('Player stats imported', f"Stats for {len(match_ids)} matches", _actor())
+
+
+def _on_physio_record_written(record_id, player_id, injury_type, status, **payload):
+    _activity.record('Medical record', f"Player #{player_id}: {injury_type} ({status})", _actor())
+
+
+def _on_user_role_changed(user_id, username, role, **payload):
+    _activity.record('Role changed', f"{username} is now {role}", _actor())
+
+
+def _on_squad_selected(match_id, team_id, formation, starters, substitutes, **payload):
+    _activity.record('Squad selected', f"{team_name(team_id)} for match #{match_id}: {formation}, "
+                                       f"{len(starters)} starters and {len(substitutes)} substitutes", _actor())
+
+
+def _on_reference_written(**payload):
+    # Team and venue events do not say whether a row was added, so recount
+    _counters.request_reconcile()
+
+
+events.subscribe(events.USER_REGISTERED, _on_user_registered)
+events.subscribe(events.PLAYER_WRITTEN, _on_player_written)
+events.subscribe(events.MATCH_CREATED, _on_match_created)
+events.subscribe(events.USER_ROLE_CHANGED, _on_user_role_changed)
+events.subscribe(events.SEASON_SCHEDULED, _on_season_scheduled)
+events.subscribe(events.MATCH_UPDATED, _on_match_updated)
+events.subscribe(events.PLAYER_STATS_WRITTEN, _on_player_stats_written)
+events.subscribe(events.PHYSIO_RECORD_WRITTEN, _on_physio_record_written)
+events.subscribe(events.SQUAD_SELECTED, _on_squad_selected)
+events.subscribe(events.TEAM_WRITTEN, _on_reference_written)
+events.subscribe(events.VENUE_WRITTEN, _on_reference_written)
+
+
+if __name__ == "__main__":
+    # python admin_counters.py  - print the true counts
+    if len(sys.argv) > 1:
+        print("Usage: python admin_counters.py")
+        sys.exit(1)
+    _counters.reconcile()
+    for name, count in _counters.counts().items():
+        print(f"{name:<15} {count:>8}")
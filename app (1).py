@@ -1,21 +1,43 @@
 # app.py - Main Flask Application
 
-from flask import Flask, render_template, request, redirect, url_for, flash, session
-from flask_bcrypt import Bcrypt
-import pyodbc
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, g, Response, send_file, stream_with_context
+from db_pool import get_pool, pool_stats
+from reference_cache import get_teams, team_name, venue
+from records import Engagement, fetch_records, mapper, match_record
+from queries import get_registry
+from queries import (COACH_TEAM, FAN_BY_USER, FAN_ENGAGEMENT_HISTORY, FAN_INSERT, LAST_ID, MATCH_STATUS,
+                     MEDICAL_STAFF_BY_USER, MEDICAL_STAFF_INSERT, NEXT_MATCHES, PHYSIO_RECORD_BY_ID,
+                     PHYSIO_RECORD_INSERT, PHYSIO_RECORD_UPDATE, PLAYER_INSERT, TEAM_UPCOMING_MATCHES, USER_INSERT,
+                     USER_LOGIN, USER_NAME, USER_SET_PASSWORD, USER_SET_ROLE)
+from standings import get_standings
+from player_analytics import get_analytics
+from password_hashing import get_hasher, HashingBusy
+from dashboard_loader import load_player_dashboard
+from query_stats import begin_request, end_request, get_query_stats
+from live_scores import live_feed
+from fan_engagement import get_engagement_store, InvalidEngagement, MAX_PREDICTED_GOALS
+from availability import get_availability
+from season_archive import get_archive
+from admin_counters import get_admin_counters, get_activity_log
+from session_store import StoredSessionInterface, get_session_store
+from search_index import KINDS as SEARCH_KINDS, MAX_SEARCH_LIMIT, SEARCH_LIMIT, get_search_index
+from squad_selection import (FORMATIONS, MAX_SUBSTITUTES, MIN_STARTER_FITNESS, STARTER, SUBSTITUTE, SquadError,
+                             load_board, save_selection)
+from reports import REPORTS, FORMATS, InvalidReport, ReportsBusy, filename, get_report_engine, get_report_jobs, parse_params
 from functools import wraps
 import os
+import events
 from datetime import datetime
 
 app = Flask(__name__)
-app.secret_key = os.urandom(24)
-bcrypt = Bcrypt(app)
+app.secret_key = os.environ.get('SECRET_KEY') or os.urandom(24)
+# Sessions live in a store shared by every worker; the cookie holds only the session ID
+app.session_interface = StoredSessionInterface(get_session_store())
+hasher = get_hasher()
 
-# Database connection
+# Database connection (pooled - conn.close() returns it to the pool)
 def get_db_connection():
-    conn = pyodbc.connect(r'Driver={Microsoft Access Driver (*.mdb, *.accdb)};'
-                          r'DBQ=./sports_management_system.accdb;')
-    return conn
+    return get_pool().acquire()
 
 # User roles
 ROLES = {
@@ -48,6 +70,38 @@ def role_required(roles):
         return decorated_function
     return decorator
 
+# Count and time the SQL run by each request (also covers the match blueprint)
+@app.before_request
+def start_query_count():
+    g.query_token = begin_request(f"{request.method} {request.path}")
+
+@app.after_request
+def finish_query_count(response):
+    token = g.pop('query_token', None)
+    if token is not None:
+        queries = end_request(token)
+        response.headers['X-Query-Count'] = str(queries.count)
+        response.headers['X-Query-Time'] = f"{queries.time * 1000:.1f}ms"
+    return response
+
+@app.teardown_request
+def abandon_query_count(exc):
+    # after_request is skipped when a view raises
+    token = g.pop('query_token', None)
+    if token is not None:
+        end_request(token)
+
+# Load (or build) the search index in the background from the first request rather than on the first search.
+# Not at import: the report workers are spawned processes that import this module again
+@app.before_request
+def start_search_index():
+    get_search_index().start()
+
+# Password hashing queue is full - fail fast and ask the client to retry
+@app.errorhandler(HashingBusy)
+def hashing_busy(e):
+    return 'The server is busy, please try again in a moment.', 503, {'Retry-After': str(e.retry_after)}
+
 # Routes
 @app.route('/')
 def index():
@@ -70,33 +124,31 @@ def register():
         # Check if username already exists
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM USERS WHERE Username = ?', (username,))
+        cursor.execute(USER_LOGIN, (username,))
         if cursor.fetchone():
             flash('Username already exists!', 'danger')
             conn.close()
             return render_template('register.html', roles=ROLES)
         
-        # Hash password
-        hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
+        # Hash password (runs in the hashing worker pool)
+        try:
+            hashed_password = hasher.hash_password(password)
+        except HashingBusy:
+            conn.close()
+            raise
         
         # Insert new user
         try:
-            cursor.execute(
-                'INSERT INTO USERS (Username, Password, Email, Phone, RegistrationDate, Role) VALUES (?, ?, ?, ?, ?, ?)',
-                (username, hashed_password, email, phone, datetime.now(), role)
-            )
+            cursor.execute(USER_INSERT, (username, hashed_password, email, phone, datetime.now(), role))
             conn.commit()
             
             # Get the new user ID
-            cursor.execute('SELECT @@IDENTITY')
+            cursor.execute(LAST_ID)
             user_id = cursor.fetchone()[0]
             
             # If role is 'fan', create a fan record
             if role == 'fan':
-                cursor.execute(
-                    'INSERT INTO FANS (UserID, MembershipType, JoinDate, LoyaltyPoints) VALUES (?, ?, ?, ?)',
-                    (user_id, 'Basic', datetime.now(), 0)
-                )
+                cursor.execute(FAN_INSERT, (user_id, 'Basic', datetime.now(), 0))
             
             # If role is 'player', redirect to player profile creation
             if role == 'player':
@@ -105,18 +157,19 @@ def register():
                 session['username'] = username
                 conn.commit()
                 conn.close()
+                events.publish(events.USER_REGISTERED, user_id=user_id, username=username, role=role)
                 return redirect(url_for('create_player_profile'))
             
             # If role is 'medical', create medical staff record
             if role == 'medical':
-                cursor.execute(
-                    'INSERT INTO MEDICAL_STAFF (UserID, Specialization, Qualification) VALUES (?, ?, ?)',
-                    (user_id, 'General', 'Not specified')
-                )
+                cursor.execute(MEDICAL_STAFF_INSERT, (user_id, 'General', 'Not specified'))
             
             conn.commit()
             flash('Registration successful! You can now log in.', 'success')
             conn.close()
+            
+            # Moves the admin dashboard counters and activity log
+            events.publish(events.USER_REGISTERED, user_id=user_id, username=username, role=role)
             return redirect(url_for('login'))
         except Exception as e:
             conn.rollback()
@@ -134,20 +187,33 @@ def login():
         
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT UserID, Username, Password, Role FROM USERS WHERE Username = ?', (username,))
+        cursor.execute(USER_LOGIN, (username,))
         user = cursor.fetchone()
+        # Give the connection back before the (slow) password check
+        conn.close()
         
-        if user and bcrypt.check_password_hash(user[2], password):
+        if user and hasher.check_password(user[2], password):
+            # Transparently upgrade hashes made with a different cost factor
+            if hasher.needs_rehash(user[2]):
+                try:
+                    new_hash = hasher.hash_password(password)
+                    conn = get_db_connection()
+                    cursor = conn.cursor()
+                    cursor.execute(USER_SET_PASSWORD, (new_hash, user[0]))
+                    conn.commit()
+                    conn.close()
+                except HashingBusy:
+                    # Try again on the next login
+                    pass
+            
             session['user_id'] = user[0]
             session['username'] = user[1]
             session['role'] = user[3]
             
             flash(f'Welcome back, {username}!', 'success')
-            conn.close()
             return redirect(url_for('dashboard'))
         else:
             flash('Login failed. Please check your username and password.', 'danger')
-            conn.close()
             return render_template('login.html')
     
     return render_template('login.html')
@@ -177,81 +243,315 @@ def dashboard():
         flash('Unknown role!', 'danger')
         return redirect(url_for('logout'))
 
+# Typeahead search over teams, players, venues and matches (user accounts for admins)
+@app.route('/search')
+@login_required
+def search():
+    query = request.args.get('q', '')
+    allowed = [kind for kind in SEARCH_KINDS if kind != 'user' or session.get('role') == 'admin']
+    kinds = [kind for kind in request.args.get('kinds', '').split(',') if kind in allowed] or allowed
+    try:
+        limit = max(1, min(int(request.args.get('limit', SEARCH_LIMIT)), MAX_SEARCH_LIMIT))
+    except ValueError:
+        limit = SEARCH_LIMIT
+    
+    results = []
+    for entry in get_search_index().search(query, kinds=kinds, limit=limit):
+        if entry.kind == 'match':
+            url = url_for('match.match_details', match_id=entry.id)
+        elif entry.kind in ('team', 'venue'):
+            url = url_for('match.matches', **{f'{entry.kind}_id': entry.id})
+        else:
+            url = None
+        results.append({'kind': entry.kind, 'id': entry.id, 'label': entry.label,
+                        'detail': entry.detail, 'url': url})
+    return jsonify({'query': query, 'results': results})
+
+@app.route('/admin/search')
+@login_required
+@role_required(['admin'])
+def search_stats():
+    return jsonify(get_search_index().stats())
+
 # Specific dashboards for different roles
 @app.route('/admin/dashboard')
 @login_required
 @role_required(['admin'])
 def admin_dashboard():
-    return render_template('admin_dashboard.html')
+    # Counters and the activity log are kept in memory by the write events
+    conn = get_db_connection()
+    upcoming_matches = fetch_records(conn.cursor(), match_record, NEXT_MATCHES)
+    conn.close()
+    return render_template('admin_dashboard.html', upcoming_matches=upcoming_matches,
+                           activities=get_activity_log().recent(), **get_admin_counters().counts())
+
+@app.route('/admin/db_pool')
+@login_required
+@role_required(['admin'])
+def db_pool_stats():
+    return jsonify(pool_stats())
+
+@app.route('/admin/query_stats')
+@login_required
+@role_required(['admin'])
+def query_stats():
+    # Top statements by total time (or ?order=calls|max_time|rows); ?group=name for the named queries
+    if request.args.get('group') == 'name':
+        return jsonify({'summary': get_query_stats().stats(), 'queries': get_registry().timings()})
+    order = request.args.get('order', 'total_time')
+    if order not in ('total_time', 'calls', 'max_time', 'rows'):
+        order = 'total_time'
+    limit = request.args.get('limit', 20, type=int)
+    stats = get_query_stats()
+    return jsonify({'summary': stats.stats(), 'statements': stats.top(limit, order)})
+
+@app.route('/admin/standings/rebuild', methods=['POST'])
+@login_required
+@role_required(['admin'])
+def rebuild_standings():
+    get_standings().rebuild()
+    flash('League standings rebuilt.', 'success')
+    return redirect(url_for('admin_dashboard'))
+
+@app.route('/admin/sessions')
+@login_required
+@role_required(['admin'])
+def session_stats():
+    return jsonify(get_session_store().stats())
+
+@app.route('/admin/users/<int:user_id>/role', methods=['POST'])
+@login_required
+@role_required(['admin'])
+def change_user_role(user_id):
+    role = request.form.get('role')
+    if role not in ROLES:
+        flash('Invalid role selected.', 'danger')
+        return redirect(url_for('admin_dashboard'))
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(USER_NAME, (user_id,))
+    user = cursor.fetchone()
+    if not user:
+        conn.close()
+        flash('User not found.', 'danger')
+        return redirect(url_for('admin_dashboard'))
+    cursor.execute(USER_SET_ROLE, (role, user_id))
+    conn.commit()
+    conn.close()
+
+    # The session store moves the user's signed-in sessions to the new role
+    events.publish(events.USER_ROLE_CHANGED, user_id=user_id, username=user[0], role=role)
+    flash(f'{user[0]} is now {ROLES[role]}.', 'success')
+    return redirect(url_for('admin_dashboard'))
+
+@app.route('/admin/users/<int:user_id>/sessions/revoke', methods=['POST'])
+@login_required
+@role_required(['admin'])
+def revoke_user_sessions(user_id):
+    revoked = get_session_store().revoke_user(user_id)
+    flash(f'Signed user #{user_id} out of {revoked} sessions.', 'info')
+    return redirect(url_for('admin_dashboard'))
+
+@app.route('/admin/reports')
+@login_required
+@role_required(['admin'])
+def generate_reports():
+    return render_template('generate_reports.html', reports=REPORTS.values(), formats=FORMATS,
+                           teams=get_teams(), jobs=get_report_jobs().jobs())
+
+def _report_request(values):
+    # (report, params, format) from the report form or query string
+    report = values.get('report', 'season')
+    fmt = values.get('format', 'csv')
+    if fmt not in FORMATS:
+        raise InvalidReport(f"Format must be one of {', '.join(FORMATS)}")
+    params = parse_params(report, values.get('seasons'), values.get('team_id'), values.get('player_id'))
+    return report, params, fmt
+
+@app.route('/admin/reports/export')
+@login_required
+@role_required(['admin'])
+def export_report():
+    # Streamed straight to the client; the full report is never built in memory
+    try:
+        report, params, fmt = _report_request(request.args)
+    except InvalidReport as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('generate_reports'))
+    
+    chunks = get_report_engine().render(report, params, fmt)
+    return Response(stream_with_context(chunks), mimetype=FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename="{filename(report, params, fmt)}"'})
+
+@app.route('/admin/reports/jobs', methods=['POST'])
+@login_required
+@role_required(['admin'])
+def queue_report():
+    # Long reports are written to a file by the job queue instead of this worker
+    try:
+        report, params, fmt = _report_request(request.form)
+        job = get_report_jobs().submit(report, params, fmt, requested_by=session.get('username'))
+    except InvalidReport as e:
+        flash(str(e), 'danger')
+    except ReportsBusy as e:
+        flash(str(e), 'warning')
+    else:
+        flash(f'{job.filename} has been queued.', 'success')
+    return redirect(url_for('generate_reports'))
+
+@app.route('/admin/reports/jobs/<job_id>')
+@login_required
+@role_required(['admin'])
+def report_job(job_id):
+    job = get_report_jobs().get(job_id)
+    if not job:
+        return jsonify({'error': 'Report job not found'}), 404
+    return jsonify(job.as_dict())
+
+@app.route('/admin/reports/jobs/<job_id>/download')
+@login_required
+@role_required(['admin'])
+def download_report(job_id):
+    job = get_report_jobs().get(job_id)
+    if not job or job.status != 'done':
+        flash('That report is not ready.', 'warning')
+        return redirect(url_for('generate_reports'))
+    return send_file(os.path.abspath(job.path), mimetype=FORMATS[job.fmt],
+                     as_attachment=True, download_name=job.filename)
+
+# Coach dashboard: the team's next fixtures
+COACH_UPCOMING_SHOWN = 5
+
+def _coach_match(match, team_id):
+    # Team and venue names come from the reference cache
+    venue_row = venue(match[4])
+    return {
+        'id': match[0],
+        'date_time': match[3].strftime('%d-%m-%Y %H:%M'),
+        'is_home': match[1] == team_id,
+        'home_team': team_name(match[1]),
+        'away_team': team_name(match[2]),
+        'venue': venue_row[1] if venue_row else None,
+        'status': match[5],
+    }
 
 @app.route('/coach/dashboard')
 @login_required
 @role_required(['coach'])
 def coach_dashboard():
-    return render_template('coach_dashboard.html')
+    # Get the coach's team
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(COACH_TEAM, (session['user_id'],))
+    row = cursor.fetchone()
+    
+    team = None
+    team_stats = {}
+    players = []
+    upcoming_matches = []
+    if row:
+        # Same statement as the player dashboard; only the first few rows are read
+        cursor.execute(TEAM_UPCOMING_MATCHES, (row[0], row[0]))
+        upcoming_matches = [_coach_match(match, row[0]) for match in cursor.fetchmany(COACH_UPCOMING_SHOWN)]
+        
+        # Squad, injuries and fitness come from the availability index
+        players = get_availability().squad(row[0])
+        
+        # Season record comes from the materialized standings
+        record = get_standings().team(row[0])
+        team = dict(record, team_id=row[0], team_name=row[1], league=row[2])
+        team_stats = {
+            'player_count': len(players),
+            'avg_goals': record['avg_goals'],
+            'avg_conceded': record['avg_conceded'],
+        }
+    
+    conn.close()
+    
+    return render_template('coach_dashboard.html', 
+                           team=team, 
+                           team_stats=team_stats, 
+                           upcoming_matches=upcoming_matches, 
+                           players=players, 
+                           active_players=[p for p in players if p.available], 
+                           injured_players=[p for p in players if p.reason == 'injured'], 
+                           suspended_players=[p for p in players if p.reason == 'suspended'])
+
+# Squad for one of the coach's matches: roster, injuries and form in one batch (see squad_selection.py)
+@app.route('/coach/matches/<int:match_id>/squad', methods=['GET', 'POST'])
+@login_required
+@role_required(['coach'])
+def squad_selection(match_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(COACH_TEAM, (session['user_id'],))
+    team = cursor.fetchone()
+    conn.close()
+    
+    if not team:
+        flash('You need a team before you can pick a squad.', 'warning')
+        return redirect(url_for('coach_dashboard'))
+    
+    try:
+        board = load_board(match_id, team[0])
+    except SquadError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('coach_dashboard'))
+    
+    action = request.form.get('action')
+    if request.method == 'GET':
+        # The saved squad, or a suggestion for a match without one
+        lineup = board.saved or board.suggest()
+    elif action == 'suggest':
+        lineup = board.suggest(request.form.get('formation'))
+    else:
+        # Lineups are checked in memory; only a valid one is saved
+        roles = {player_id: request.form.get(f'role_{player_id}') for player_id in board.candidates}
+        lineup = board.validate(request.form.get('formation', ''),
+                                [player_id for player_id, role in roles.items() if role == STARTER],
+                                [player_id for player_id, role in roles.items() if role == SUBSTITUTE])
+        if action == 'save' and lineup.valid:
+            try:
+                save_selection(board, lineup, session['user_id'])
+                flash(f'Squad saved for {board.team_name} vs {board.opponent}.', 'success')
+                return redirect(url_for('coach_dashboard'))
+            except SquadError as e:
+                flash(str(e), 'danger')
+            except Exception as e:
+                flash(f'Error saving squad: {str(e)}', 'danger')
+    
+    roles = dict([(player_id, SUBSTITUTE) for player_id in lineup.player_ids(SUBSTITUTE)] +
+                 [(player_id, STARTER) for player_id in lineup.player_ids(STARTER)])
+    return render_template('squad_selection.html', 
+                           board=board, 
+                           lineup=lineup, 
+                           roles=roles, 
+                           formations=list(FORMATIONS), 
+                           max_substitutes=MAX_SUBSTITUTES, 
+                           min_fitness=MIN_STARTER_FITNESS)
 
 @app.route('/player/dashboard')
 @login_required
 @role_required(['player'])
 def player_dashboard():
-    # Get player details
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM PLAYERS WHERE UserID = ?', (session['user_id'],))
-    player = cursor.fetchone()
+    # Player, team, upcoming matches, physio records and stats in one loader call
+    dashboard = load_player_dashboard(session['user_id'])
     
-    if not player:
-        conn.close()
+    if not dashboard:
         flash('Player profile not found. Please create your profile.', 'warning')
         return redirect(url_for('create_player_profile'))
     
-    # Get team details
-    cursor.execute('SELECT * FROM TEAMS WHERE TeamID = ?', (player[5],))
-    team = cursor.fetchone()
-    
-    # Get upcoming matches
-    cursor.execute('''
-        SELECT M.*, HT.TeamName as HomeTeam, AT.TeamName as AwayTeam, V.VenueName 
-        FROM MATCHES M
-        JOIN TEAMS HT ON M.HomeTeamID = HT.TeamID
-        JOIN TEAMS AT ON M.AwayTeamID = AT.TeamID
-        JOIN VENUES V ON M.VenueID = V.VenueID
-        WHERE (M.HomeTeamID = ? OR M.AwayTeamID = ?) AND M.MatchDateTime > NOW()
-        ORDER BY M.MatchDateTime
-    ''', (player[5], player[5]))
-    upcoming_matches = cursor.fetchall()
-    
-    # Get physio records
-    cursor.execute('''
-        SELECT PR.*, MS.Specialization, U.Username as StaffName
-        FROM PHYSIO_RECORDS PR
-        JOIN MEDICAL_STAFF MS ON PR.StaffID = MS.StaffID
-        JOIN USERS U ON MS.UserID = U.UserID
-        WHERE PR.PlayerID = ?
-        ORDER BY PR.RecordDate DESC
-    ''', (player[0],))
-    physio_records = cursor.fetchall()
-    
-    # Get player stats
-    cursor.execute('''
-        SELECT PS.*, M.MatchDateTime, HT.TeamName as HomeTeam, AT.TeamName as AwayTeam
-        FROM PLAYER_STATS PS
-        JOIN MATCHES M ON PS.MatchID = M.MatchID
-        JOIN TEAMS HT ON M.HomeTeamID = HT.TeamID
-        JOIN TEAMS AT ON M.AwayTeamID = AT.TeamID
-        WHERE PS.PlayerID = ?
-        ORDER BY M.MatchDateTime DESC
-    ''', (player[0],))
-    stats = cursor.fetchall()
-    
-    conn.close()
+    # Season totals, per-90 rates and percentiles from the analytics store
+    analytics = get_analytics().player_summary(dashboard.player.player_id)
     
     return render_template('player_dashboard.html', 
-                           player=player, 
-                           team=team, 
-                           upcoming_matches=upcoming_matches, 
-                           physio_records=physio_records, 
-                           stats=stats)
+                           player=dashboard.player, 
+                           team=dashboard.team, 
+                           upcoming_matches=dashboard.upcoming_matches, 
+                           physio_records=dashboard.physio_records, 
+                           stats=dashboard.stats, 
+                           analytics=analytics)
 
 @app.route('/medical/dashboard')
 @login_required
@@ -260,7 +560,7 @@ def medical_dashboard():
     # Get medical staff details
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM MEDICAL_STAFF WHERE UserID = ?', (session['user_id'],))
+    cursor.execute(MEDICAL_STAFF_BY_USER, (session['user_id'],))
     staff = cursor.fetchone()
     
     if not staff:
@@ -268,36 +568,139 @@ def medical_dashboard():
         flash('Medical staff profile not found.', 'warning')
         return redirect(url_for('index'))
     
-    # Get assigned players with injuries
-    cursor.execute('''
-        SELECT PR.*, P.FullName, P.Position, T.TeamName
-        FROM PHYSIO_RECORDS PR
-        JOIN PLAYERS P ON PR.PlayerID = P.PlayerID
-        JOIN TEAMS T ON P.TeamID = T.TeamID
-        WHERE PR.StaffID = ? AND PR.Status <> 'Recovered'
-        ORDER BY PR.ExpectedRecovery
-    ''', (staff[0],))
-    active_cases = cursor.fetchall()
-    
-    # Get recent records
-    cursor.execute('''
-        SELECT PR.*, P.FullName, P.Position, T.TeamName
-        FROM PHYSIO_RECORDS PR
-        JOIN PLAYERS P ON PR.PlayerID = P.PlayerID
-        JOIN TEAMS T ON P.TeamID = T.TeamID
-        WHERE PR.StaffID = ?
-        ORDER BY PR.RecordDate DESC
-        LIMIT 10
-    ''', (staff[0],))
-    recent_records = cursor.fetchall()
-    
     conn.close()
     
+    # Open cases come from the availability index; recent records are read without joins
+    availability = get_availability()
+    active_cases = availability.active_cases(staff[0])
+    recent_records = availability.recent_records(staff[0])
+    
     return render_template('medical_dashboard.html',
                           staff=staff,
+                          players=availability.players(),
                           active_cases=active_cases,
                           recent_records=recent_records)
 
+# Physio record writes publish PHYSIO_RECORD_WRITTEN, which keeps the availability index current
+PHYSIO_STATUSES = ('Ongoing', 'Monitoring', 'Recovered')
+
+def _medical_staff_id():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(MEDICAL_STAFF_BY_USER, (session['user_id'],))
+    row = cursor.fetchone()
+    conn.close()
+    return row[0] if row else None
+
+def _physio_fields(form):
+    # (diagnosis, treatment, expected_recovery, status) from a record form, or None (with a flash)
+    diagnosis = form.get('diagnosis', '').strip()
+    treatment = form.get('treatment', '').strip()
+    status = form.get('status')
+    try:
+        expected_recovery = datetime.strptime(form.get('expected_recovery', ''), '%Y-%m-%d').date()
+    except ValueError:
+        expected_recovery = None
+    
+    if not diagnosis or not treatment or expected_recovery is None or status not in PHYSIO_STATUSES:
+        flash('Please enter a diagnosis, treatment plan, expected recovery date and status.', 'danger')
+        return None
+    return diagnosis, treatment, expected_recovery, status
+
+@app.route('/medical/records', methods=['POST'])
+@login_required
+@role_required(['medical'])
+def add_medical_record():
+    staff_id = _medical_staff_id()
+    if staff_id is None:
+        flash('Medical staff profile not found.', 'warning')
+        return redirect(url_for('index'))
+    
+    player_id = request.form.get('player_id', type=int)
+    injury_type = request.form.get('injury_type', '').strip()
+    fields = _physio_fields(request.form)
+    if fields is None:
+        return redirect(url_for('medical_dashboard'))
+    if not injury_type or player_id is None or get_availability().player(player_id) is None:
+        flash('Please choose a player and enter the injury type.', 'danger')
+        return redirect(url_for('medical_dashboard'))
+    
+    diagnosis, treatment, expected_recovery, status = fields
+    record_date = datetime.now()
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(PHYSIO_RECORD_INSERT,
+                       (player_id, record_date, injury_type, diagnosis, treatment, expected_recovery, status, staff_id))
+        cursor.execute(LAST_ID)
+        record_id = cursor.fetchone()[0]
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        flash(f'Error adding medical record: {str(e)}', 'danger')
+        conn.close()
+        return redirect(url_for('medical_dashboard'))
+    conn.close()
+    
+    events.publish(events.PHYSIO_RECORD_WRITTEN, record_id=record_id, player_id=player_id,
+                   record_date=record_date, injury_type=injury_type, diagnosis=diagnosis,
+                   treatment=treatment, expected_recovery=expected_recovery, status=status,
+                   staff_id=staff_id)
+    
+    flash('Medical record added.', 'success')
+    return redirect(url_for('medical_dashboard'))
+
+@app.route('/medical/records/update', methods=['POST'])
+@login_required
+@role_required(['medical'])
+def update_medical_record():
+    record_id = request.form.get('record_id', type=int)
+    fields = _physio_fields(request.form)
+    if fields is None:
+        return redirect(url_for('medical_dashboard'))
+    
+    diagnosis, treatment, expected_recovery, status = fields
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(PHYSIO_RECORD_BY_ID, (record_id,))
+        record = cursor.fetchone()
+        if not record:
+            conn.close()
+            flash('Medical record not found!', 'danger')
+            return redirect(url_for('medical_dashboard'))
+        
+        cursor.execute(PHYSIO_RECORD_UPDATE, (diagnosis, treatment, expected_recovery, status, record_id))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        flash(f'Error updating medical record: {str(e)}', 'danger')
+        conn.close()
+        return redirect(url_for('medical_dashboard'))
+    conn.close()
+    
+    events.publish(events.PHYSIO_RECORD_WRITTEN, record_id=record_id, player_id=record[0],
+                   record_date=record[1], injury_type=record[2], diagnosis=diagnosis,
+                   treatment=treatment, expected_recovery=expected_recovery, status=status,
+                   staff_id=record[3])
+    
+    flash('Medical record updated.', 'success')
+    return redirect(url_for('medical_dashboard'))
+
+# Fan dashboard rows (FAN_ENGAGEMENT_HISTORY)
+history_record = mapper(Engagement, 'engagement_date engagement_type comment match_datetime home_team_id away_team_id '
+                                    'match_id')
+
+def _archived_history(engagement_history):
+    # Engagements on matches pruned from MATCHES take the match from the season archive
+    for item in engagement_history:
+        if item.match_datetime is None:
+            match = get_archive().match(item.match_id)
+            if match is not None:
+                item.home_team_id, item.away_team_id, item.match_datetime = match[1], match[2], match[3]
+                item.resolve()
+    return [item for item in engagement_history if item.match_datetime is not None]
+
 @app.route('/fan/dashboard')
 @login_required
 @role_required(['fan'])
@@ -305,7 +708,7 @@ def fan_dashboard():
     # Get fan details
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM FANS WHERE UserID = ?', (session['user_id'],))
+    cursor.execute(FAN_BY_USER, (session['user_id'],))
     fan = cursor.fetchone()
     
     if not fan:
@@ -313,37 +716,94 @@ def fan_dashboard():
         flash('Fan profile not found.', 'warning')
         return redirect(url_for('index'))
     
-    # Get upcoming matches
-    cursor.execute('''
-        SELECT M.*, HT.TeamName as HomeTeam, AT.TeamName as AwayTeam, V.VenueName 
-        FROM MATCHES M
-        JOIN TEAMS HT ON M.HomeTeamID = HT.TeamID
-        JOIN TEAMS AT ON M.AwayTeamID = AT.TeamID
-        JOIN VENUES V ON M.VenueID = V.VenueID
-        WHERE M.MatchDateTime > NOW()
-        ORDER BY M.MatchDateTime
-        LIMIT 5
-    ''')
-    upcoming_matches = cursor.fetchall()
+    # Get upcoming matches (team and venue names come from the reference cache)
+    upcoming_matches = fetch_records(cursor, match_record, NEXT_MATCHES)
     
     # Get fan's engagement history
-    cursor.execute('''
-        SELECT FE.*, M.MatchDateTime, HT.TeamName as HomeTeam, AT.TeamName as AwayTeam
-        FROM FAN_ENGAGEMENT FE
-        JOIN MATCHES M ON FE.MatchID = M.MatchID
-        JOIN TEAMS HT ON M.HomeTeamID = HT.TeamID
-        JOIN TEAMS AT ON M.AwayTeamID = AT.TeamID
-        WHERE FE.FanID = ?
-        ORDER BY FE.EngagementDate DESC
-    ''', (fan[0],))
-    engagement_history = cursor.fetchall()
+    engagement_history = _archived_history(fetch_records(cursor, history_record, FAN_ENGAGEMENT_HISTORY, (fan[0],)))
     
     conn.close()
     
+    # Engagement counters are kept up to date by the engagement store
+    stats = get_engagement_store().fan_stats(fan[0])
+    
     return render_template('fan_dashboard.html',
                           fan=fan,
+                          stats=stats,
                           upcoming_matches=upcoming_matches,
-                          engagement_history=engagement_history)
+                          engagement_history=engagement_history,
+                          live=live_feed(url_for('match.live_poll')))
+
+# Fan engagement writes go to the engagement store, which batches them into FAN_ENGAGEMENT
+def _engagement_match(match_id, statuses):
+    # Status of match_id if fans may engage with it now, otherwise None (with a flash)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(MATCH_STATUS, (match_id,))
+    match = cursor.fetchone()
+    conn.close()
+    
+    if not match:
+        flash('Match not found!', 'danger')
+        return None
+    if match[0] not in statuses:
+        flash(f'This is not possible for a {match[0].lower()} match.', 'warning')
+        return None
+    return match[0]
+
+def _record_engagement(match_id, engagement_type, statuses, **fields):
+    store = get_engagement_store()
+    fan_id = store.fan_id(session['user_id'])
+    if fan_id is None:
+        flash('Fan profile not found.', 'warning')
+        return False
+    if not _engagement_match(match_id, statuses):
+        return False
+    try:
+        store.record(fan_id, match_id, engagement_type, **fields)
+    except InvalidEngagement as e:
+        flash(str(e), 'danger')
+        return False
+    return True
+
+@app.route('/fan/engagement', methods=['POST'])
+@login_required
+@role_required(['fan'])
+def add_fan_engagement():
+    match_id = request.form.get('match_id', type=int)
+    if _record_engagement(match_id, request.form.get('engagement_type'), ('Scheduled', 'Ongoing'),
+                          comment=request.form.get('comments')):
+        flash('Thanks! Your comment will appear on the match page shortly.', 'success')
+    if match_id is None:
+        return redirect(url_for('fan_dashboard'))
+    return redirect(url_for('match.match_details', match_id=match_id))
+
+@app.route('/fan/predict', methods=['POST'])
+@login_required
+@role_required(['fan'])
+def predict_score():
+    home_score = request.form.get('home_score', type=int)
+    away_score = request.form.get('away_score', type=int)
+    if home_score is None or away_score is None or home_score < 0 or away_score < 0:
+        flash('Please enter a score for both teams.', 'danger')
+        return redirect(url_for('fan_dashboard'))
+    if home_score > MAX_PREDICTED_GOALS or away_score > MAX_PREDICTED_GOALS:
+        flash(f'Predicted scores go up to {MAX_PREDICTED_GOALS}.', 'danger')
+        return redirect(url_for('fan_dashboard'))
+    
+    # Predictions close at kick-off
+    if _record_engagement(request.form.get('match_id', type=int), 'Prediction', ('Scheduled',),
+                          prediction=f'{home_score}-{away_score}', comment=request.form.get('comment')):
+        flash('Your prediction has been saved.', 'success')
+    return redirect(url_for('fan_dashboard'))
+
+@app.route('/fan/matches/<int:match_id>/check_in', methods=['POST'])
+@login_required
+@role_required(['fan'])
+def check_in(match_id):
+    if _record_engagement(match_id, 'Attendance', ('Scheduled', 'Ongoing')):
+        flash('You are checked in. Enjoy the match!', 'success')
+    return redirect(url_for('match.match_details', match_id=match_id))
 
 @app.route('/create_player_profile', methods=['GET', 'POST'])
 @login_required
@@ -359,46 +819,36 @@ def create_player_profile():
         if not full_name or not date_of_birth or not position or not team_id:
             flash('All fields are required!', 'danger')
             
-            # Get teams for dropdown
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT TeamID, TeamName FROM TEAMS')
-            teams = cursor.fetchall()
-            conn.close()
-            
-            return render_template('create_player_profile.html', teams=teams)
+            # Teams for the dropdown come from the reference cache
+            return render_template('create_player_profile.html', teams=get_teams())
         
         conn = get_db_connection()
         cursor = conn.cursor()
         
         try:
-            cursor.execute(
-                'INSERT INTO PLAYERS (UserID, FullName, DateOfBirth, Position, TeamID, Status) VALUES (?, ?, ?, ?, ?, ?)',
-                (session['user_id'], full_name, date_of_birth, position, team_id, 'Active')
-            )
+            cursor.execute(PLAYER_INSERT, (session['user_id'], full_name, date_of_birth, position, team_id, 'Active'))
+            cursor.execute(LAST_ID)
+            player_id = cursor.fetchone()[0]
             conn.commit()
-            flash('Player profile created successfully!', 'success')
             conn.close()
+            
+            # Add the player to their team's squad in the availability index
+            events.publish(events.PLAYER_WRITTEN, player_id=player_id, team_id=int(team_id),
+                           full_name=full_name, position=position, status='Active', created=True)
+            
+            flash('Player profile created successfully!', 'success')
             return redirect(url_for('player_dashboard'))
         except Exception as e:
             conn.rollback()
             flash(f'Error creating player profile: {str(e)}', 'danger')
             
-            # Get teams for dropdown
-            cursor.execute('SELECT TeamID, TeamName FROM TEAMS')
-            teams = cursor.fetchall()
             conn.close()
             
-            return render_template('create_player_profile.html', teams=teams)
+            # Teams for the dropdown come from the reference cache
+            return render_template('create_player_profile.html', teams=get_teams())
     
     # GET request - show form
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT TeamID, TeamName FROM TEAMS')
-    teams = cursor.fetchall()
-    conn.close()
-    
-    return render_template('create_player_profile.html', teams=teams)
+    return render_template('create_player_profile.html', teams=get_teams())
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
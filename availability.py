@@ -0,0 +1,342 @@
+"""
+Player availability index for Sports Management System
+Keeps every player's open injuries (physio records not yet Recovered) and
+their ExpectedRecovery dates in memory, grouped by player, team and medical
+staff member. The physio record write paths publish PHYSIO_RECORD_WRITTEN and
+the index applies the change, so the medical dashboard and squad selection
+read from memory instead of re-running the PHYSIO_RECORDS joins.
+
+A player is unavailable on a given day while their PLAYERS.Status is one of
+UNAVAILABLE_STATUSES, or while any open case has an ExpectedRecovery after
+that day (an open case without a date rules them out until it is closed).
+
+Usage:
+    python availability.py team <team_id> [YYYY-MM-DD]   - print a squad's availability
+    python availability.py match <match_id>              - print both squads for a match
+"""
+
+import os
+import sys
+import logging
+import threading
+from datetime import date, datetime
+from collections import namedtuple
+
+import events
+from db_pool import get_pool
+from reference_cache import team_name
+from records import PhysioRecord, fetch_records, mapper
+from queries import MATCH_TEAMS, register
+
+logger = logging.getLogger('availability')
+
+# Fitness reported for a player whose recovery date has passed but whose case is still open
+MONITORING_FITNESS = int(os.environ.get('AVAILABILITY_MONITORING_FITNESS', 90))
+UNAVAILABLE_STATUSES = ('Suspended', 'Inactive')
+RECOVERED = 'Recovered'
+
+PLAYERS_SQL = register('availability.players',
+                       'SELECT PlayerID, TeamID, FullName, Position, Status FROM PLAYERS')
+OPEN_CASES_SQL = register('availability.open_cases', '''
+    SELECT RecordID, PlayerID, RecordDate, InjuryType, Diagnosis, Treatment,
+           ExpectedRecovery, Status, StaffID
+    FROM PHYSIO_RECORDS
+    WHERE Status <> 'Recovered'
+''')
+# No joins: names, positions and teams come from the index
+RECENT_RECORDS_SQL = register('availability.recent_records', '''
+    SELECT RecordID, PlayerID, RecordDate, InjuryType, Diagnosis, Treatment,
+           ExpectedRecovery, Status
+    FROM PHYSIO_RECORDS
+    WHERE StaffID = ?
+    ORDER BY RecordDate DESC
+    LIMIT 10
+''')
+recent_record = mapper(PhysioRecord, 'record_id player_id record_date injury_type diagnosis treatment '
+                                     'expected_recovery status')
+
+# One player's availability on a given day; reason is None, 'injured' or 'suspended'
+SquadMember = namedtuple('SquadMember', 'id name position team_id status available fitness '
+                                        'reason injury expected_return')
+
+
+def _day(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10]) if value else None
+    return value
+
+
+class Case:
+    """One open physio record"""
+
+    __slots__ = ('record_id', 'player_id', 'record_date', 'injury_type', 'diagnosis',
+                 'treatment', 'expected_recovery', 'status', 'staff_id')
+
+    def __init__(self, record_id, player_id, record_date, injury_type, diagnosis,
+                 treatment, expected_recovery, status, staff_id):
+        self.record_id = record_id
+        self.player_id = player_id
+        self.record_date = record_date
+        self.injury_type = injury_type
+        self.diagnosis = diagnosis
+        self.treatment = treatment
+        self.expected_recovery = _day(expected_recovery)
+        self.status = status
+        self.staff_id = staff_id
+
+    def rules_out(self, day):
+        return self.expected_recovery is None or self.expected_recovery > day
+
+    def fitness(self, day):
+        """0 on the day of the record, rising to MONITORING_FITNESS at ExpectedRecovery"""
+        if self.expected_recovery is None:
+            return 0
+        if day >= self.expected_recovery:
+            return MONITORING_FITNESS
+        start = _day(self.record_date) or day
+        total = (self.expected_recovery - start).days
+        if total <= 0:
+            return 0
+        return max(0, min(MONITORING_FITNESS, MONITORING_FITNESS * (day - start).days // total))
+
+
+class PlayerEntry:
+    """A player and their open cases"""
+
+    __slots__ = ('player_id', 'team_id', 'name', 'position', 'status', 'cases')
+
+    def __init__(self, player_id, team_id, name, position, status):
+        self.player_id = player_id
+        self.team_id = team_id
+        self.name = name
+        self.position = position
+        self.status = status
+        self.cases = {}  # RecordID -> Case
+
+    def member(self, day):
+        blocking = [case for case in self.cases.values() if case.rules_out(day)]
+        fitness = min((case.fitness(day) for case in self.cases.values()), default=100)
+        if self.status in UNAVAILABLE_STATUSES:
+            reason = 'suspended'
+        elif blocking:
+            reason = 'injured'
+        else:
+            reason = None
+        # The case that keeps the player out longest (undated cases first)
+        worst = max(blocking or self.cases.values(),
+                    key=lambda case: (case.expected_recovery is None, case.expected_recovery or day),
+                    default=None)
+        return SquadMember(self.player_id, self.name, self.position, self.team_id, self.status,
+                           reason is None, fitness, reason,
+                           worst.injury_type if worst else None,
+                           worst.expected_recovery if worst else None)
+
+    def physio_record(self, case):
+        return PhysioRecord(record_id=case.record_id, player_id=case.player_id, record_date=case.record_date,
+                            injury_type=case.injury_type, diagnosis=case.diagnosis, treatment=case.treatment,
+                            expected_recovery=case.expected_recovery, status=case.status,
+                            staff_id=case.staff_id, full_name=self.name, position=self.position,
+                            team_id=self.team_id)
+
+
+class AvailabilityIndex:
+    """Open injuries by player, team and staff member, updated one record at a time"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._players = {}  # PlayerID -> PlayerEntry
+        self._teams = {}    # TeamID -> set of PlayerIDs
+        self._cases = {}    # RecordID -> Case (open cases only)
+        self._staff = {}    # StaffID -> set of open RecordIDs
+        self._directory = None
+        self._built = False
+
+    def rebuild(self):
+        """Reload every player and open case from the database"""
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(PLAYERS_SQL)
+            players = cursor.fetchall()
+            cursor.execute(OPEN_CASES_SQL)
+            cases = cursor.fetchall()
+
+        with self._lock:
+            self._players = {}
+            self._teams = {}
+            self._cases = {}
+            self._staff = {}
+            self._directory = None
+            for row in players:
+                self.apply_player(*row)
+            for row in cases:
+                self.apply_record(*row)
+            self._built = True
+        logger.info(f"Availability index built from {len(players)} players and {len(cases)} open cases")
+
+    def _ensure_built(self):
+        if not self._built:
+            with self._lock:
+                if not self._built:
+                    self.rebuild()
+
+    def apply_player(self, player_id, team_id, full_name, position, status):
+        """Add a player or bring their team, name, position and status up to date"""
+        with self._lock:
+            entry = self._players.get(player_id)
+            if entry is None:
+                entry = self._players[player_id] = PlayerEntry(player_id, team_id, full_name, position, status)
+            else:
+                self._teams.get(entry.team_id, set()).discard(player_id)
+                entry.team_id, entry.name, entry.position, entry.status = team_id, full_name, position, status
+            self._teams.setdefault(team_id, set()).add(player_id)
+            self._directory = None
+
+    def apply_record(self, record_id, player_id, record_date, injury_type, diagnosis,
+                     treatment, expected_recovery, status, staff_id):
+        """Bring the index in line with the current state of one physio record"""
+        with self._lock:
+            previous = self._cases.pop(record_id, None)
+            if previous is not None:
+                self._staff.get(previous.staff_id, set()).discard(record_id)
+                entry = self._players.get(previous.player_id)
+                if entry is not None:
+                    entry.cases.pop(record_id, None)
+
+            if status == RECOVERED:
+                return
+            entry = self._players.get(player_id)
+            if entry is None:
+                logger.warning(f"Physio record {record_id} is for unknown player {player_id}")
+                return
+            case = Case(record_id, player_id, record_date, injury_type, diagnosis,
+                        treatment, expected_recovery, status, staff_id)
+            self._cases[record_id] = case
+            self._staff.setdefault(staff_id, set()).add(record_id)
+            entry.cases[record_id] = case
+
+    def player(self, player_id, on_date=None):
+        """Availability of one player, or None if the player is unknown"""
+        self._ensure_built()
+        day = _day(on_date) or date.today()
+        with self._lock:
+            entry = self._players.get(player_id)
+            return entry.member(day) if entry is not None else None
+
+    def squad(self, team_id, on_date=None):
+        """Availability of every player in a team on on_date (default today), by name"""
+        self._ensure_built()
+        day = _day(on_date) or date.today()
+        with self._lock:
+            members = [self._players[player_id].member(day)
+                       for player_id in self._teams.get(team_id, ())]
+        return sorted(members, key=lambda member: member.name or '')
+
+    def match_squads(self, match_id):
+        """
+        Both squads for a match, judged on the match day:
+        {'match_id', 'date', 'teams': {TeamID: [SquadMember, ...]}}, or None if there is no such match
+        """
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(MATCH_TEAMS, (match_id,))
+            match = cursor.fetchone()
+        if not match:
+            return None
+        day = _day(match[2])
+        return {'match_id': match_id, 'date': day,
+                'teams': {team_id: self.squad(team_id, day) for team_id in match[:2]}}
+
+    def active_cases(self, staff_id):
+        """Open cases of one staff member, soonest expected recovery first"""
+        self._ensure_built()
+        with self._lock:
+            cases = [self._cases[record_id] for record_id in self._staff.get(staff_id, ())]
+            records = [self._players[case.player_id].physio_record(case) for case in cases]
+        return sorted(records, key=lambda record: (record.expected_recovery is None,
+                                                   record.expected_recovery or date.min))
+
+    def recent_records(self, staff_id):
+        """Latest records of one staff member, open or recovered, with player names from the index"""
+        self._ensure_built()
+        with get_pool().connection() as conn:
+            records = fetch_records(conn.cursor(), recent_record, RECENT_RECORDS_SQL, (staff_id,))
+        with self._lock:
+            for record in records:
+                entry = self._players.get(record.player_id)
+                if entry is not None:
+                    record.full_name, record.position, record.team_id = entry.name, entry.position, entry.team_id
+                    record.resolve()
+        return records
+
+    def players(self):
+        """(PlayerID, 'Name (Position, Team)') for every player, by name - for pick lists"""
+        self._ensure_built()
+        with self._lock:
+            if self._directory is None:
+                entries = sorted(self._players.values(), key=lambda entry: entry.name or '')
+                self._directory = [(entry.player_id, f"{entry.name} ({entry.position}, {team_name(entry.team_id)})")
+                                   for entry in entries]
+            return self._directory
+
+    def stats(self):
+        with self._lock:
+            return {'built': self._built, 'players': len(self._players), 'teams': len(self._teams),
+                    'open_cases': len(self._cases), 'staff': len(self._staff)}
+
+
+_index = AvailabilityIndex()
+
+
+def get_availability():
+    return _index
+
+
+# Only worth applying once the index has been built; a later build reads the DB anyway
+def _on_physio_record_written(record_id, player_id, record_date, injury_type, diagnosis,
+                              treatment, expected_recovery, status, staff_id, **payload):
+    if _index._built:
+        _index.apply_record(record_id, player_id, record_date, injury_type, diagnosis,
+                            treatment, expected_recovery, status, staff_id)
+
+
+def _on_player_written(player_id, team_id, full_name, position, status, **payload):
+    if _index._built:
+        _index.apply_player(player_id, team_id, full_name, position, status)
+
+
+def _on_team_written(**payload):
+    # Team names are part of the player pick list
+    with _index._lock:
+        _index._directory = None
+
+
+events.subscribe(events.PHYSIO_RECORD_WRITTEN, _on_physio_record_written)
+events.subscribe(events.PLAYER_WRITTEN, _on_player_written)
+events.subscribe(events.TEAM_WRITTEN, _on_team_written)
+
+
+def _print_squad(team_id, members):
+    print(f"{team_name(team_id) or team_id}")
+    for member in members:
+        note = 'available' if member.available else \
+            f"{member.reason}: {member.injury or member.status}, back {member.expected_return or '?'}"
+        print(f"  {member.name:<30} {member.position or '':<12} {member.fitness:>3}%  {note}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in ('team', 'match'):
+        print("Usage: python availability.py team <team_id> [YYYY-MM-DD] | match <match_id>")
+        sys.exit(1)
+    if sys.argv[1] == 'team':
+        team_id = int(sys.argv[2])
+        _print_squad(team_id, _index.squad(team_id, sys.argv[3] if len(sys.argv) > 3 else None))
+    else:
+        squads = _index.match_squads(int(sys.argv[2]))
+        if squads is None:
+            print("Match not found")
+            sys.exit(1)
+        print(f"Match {squads['match_id']} on {squads['date']}")
+        for team_id, members in squads['teams'].items():
+            _print_squad(team_id, members)
@@ -0,0 +1,576 @@
+"""
+Benchmark harness for Sports Management System
+Generates (or reuses) a synthetic league in SQLite, then drives every route in
+app.py and match_management.py through the Flask test client at a set of
+concurrency levels. Reports throughput, latency percentiles, SQL statements
+per request and the time of each named query (queries.py) the route ran, and
+saves the results as JSON so runs can be compared.
+
+Usage:
+    python benchmark.py [--teams 20 --seasons 3] [--concurrency 1,4,16] [--requests 200]
+                        [--memory]
+                        [--output benchmark_results.json] [--baseline previous.json]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import threading
+import tracemalloc
+import importlib.util
+from itertools import count
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+logger = logging.getLogger('benchmark')
+
+# The real templates extend a base layout that is not in the repository
+BASE_TEMPLATE = '''<!DOCTYPE html>
+<html><head><title>{% block title %}{% endblock %}</title></head>
+<body>{% block content %}{% endblock %}{% block extra_js %}{% endblock %}</body></html>
+'''
+
+
+class Route:
+    """One request shape: method, path template, role to log in as and form data"""
+
+    def __init__(self, name, method, path, role=None, data=None, files=None, write=False, user=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.role = role
+        self.user = user
+        self.data = data
+        self.files = files
+        self.write = write
+
+    def build(self, ctx):
+        path = self.path(ctx) if callable(self.path) else self.path
+        data = self.data(ctx) if self.data else None
+        if self.files:
+            data = dict(data or {}, **self.files(ctx))
+        return path, data
+
+
+class BenchContext:
+    """IDs sampled from the generated league, shared by every route"""
+
+    def __init__(self, password):
+        self.password = password
+        self.users = {}
+        self.match_ids = []
+        self.completed = []
+        self.scheduled = []
+        self.teams = []
+        self.venues = []
+        self.players = []
+        self.open_cases = []
+        self.squad_coach = None
+        self.squad_matches = []
+        self.run_id = int(time.time())
+        self._serial = count(1)
+        self._rng = random.Random(7)
+        self._lock = threading.Lock()
+
+    def load(self, pool):
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT UserID, Username, Role FROM USERS')
+            for user_id, username, role in cursor.fetchall():
+                self.users.setdefault(role, []).append((user_id, username))
+            cursor.execute('SELECT MatchID, HomeTeamID, AwayTeamID, Status, HomeScore, AwayScore FROM MATCHES')
+            rows = cursor.fetchall()
+            for row in rows:
+                self.match_ids.append(row[0])
+                if row[3] == 'Completed':
+                    self.completed.append(row)
+                elif row[3] == 'Scheduled':
+                    self.scheduled.append(row[0])
+            cursor.execute('SELECT TeamID FROM TEAMS')
+            self.teams = [row[0] for row in cursor.fetchall()]
+            cursor.execute('SELECT VenueID FROM VENUES')
+            self.venues = [row[0] for row in cursor.fetchall()]
+            cursor.execute('SELECT PlayerID FROM PLAYERS')
+            self.players = [row[0] for row in cursor.fetchall()]
+            cursor.execute('''SELECT RecordID, Diagnosis, Treatment, ExpectedRecovery, Status
+                              FROM PHYSIO_RECORDS WHERE Status <> 'Recovered' ''')
+            self.open_cases = cursor.fetchall()
+            # The coach with the most scheduled fixtures, for the routes that only serve a coach's own team
+            cursor.execute('SELECT TeamID, CoachID FROM TEAMS WHERE CoachID IS NOT NULL')
+            coaches = dict(cursor.fetchall())
+        fixtures = {}
+        for match_id, home, away, status, _, _ in rows:
+            if status == 'Scheduled':
+                for team_id in (home, away):
+                    if team_id in coaches:
+                        fixtures.setdefault(coaches[team_id], []).append(match_id)
+        if fixtures:
+            coach_id = max(fixtures, key=lambda user_id: len(fixtures[user_id]))
+            self.squad_coach = next(user for user in self.users.get('coach', ()) if user[0] == coach_id)
+            self.squad_matches = fixtures[coach_id]
+        return self
+
+    def choice(self, items):
+        with self._lock:
+            return self._rng.choice(items)
+
+    def serial(self):
+        return next(self._serial)
+
+    def user(self, role):
+        return self.choice(self.users[role])
+
+
+def _update_form(ctx):
+    # Re-save a completed result unchanged, so repeated runs leave the data as it was
+    match_id, _, _, status, home_score, away_score = ctx.choice(ctx.completed)
+    return {'home_score': home_score, 'away_score': away_score, 'status': status}
+
+
+def _create_form(ctx):
+    home, away = ctx.choice(ctx.teams), ctx.choice(ctx.teams)
+    while away == home:
+        away = ctx.choice(ctx.teams)
+    # A week apart and past any generated season, so the conflict checks let them through
+    kickoff = datetime.now() + timedelta(days=3000 + 7 * ctx.serial())
+    return {'home_team_id': home, 'away_team_id': away, 'venue_id': ctx.choice(ctx.venues),
+            'match_date': kickoff.strftime('%Y-%m-%d'), 'match_time': kickoff.strftime('%H:%M')}
+
+
+def _comment_form(ctx):
+    return {'match_id': ctx.choice(ctx.scheduled), 'engagement_type': 'Comment',
+            'comments': f"Benchmark comment {ctx.serial()}"}
+
+
+def _prediction_form(ctx):
+    return {'match_id': ctx.choice(ctx.scheduled), 'home_score': ctx.serial() % 4, 'away_score': 1}
+
+
+def _schedule_form(ctx):
+    # A preview only: the whole season is placed but nothing is written
+    start = datetime.now() + timedelta(days=800)
+    return {'start_date': start.strftime('%Y-%m-%d'), 'format': 'double', 'match_days': ['sat', 'sun', 'wed'],
+            'kickoffs': '15:00,19:45', 'min_rest_days': '2', 'preview': 'on'}
+
+
+def _medical_record_form(ctx):
+    # Already recovered, so repeated runs never change anyone's availability
+    return {'player_id': ctx.choice(ctx.players), 'injury_type': 'Benchmark knock',
+            'diagnosis': 'Bruising', 'treatment': 'Rest', 'status': 'Recovered',
+            'expected_recovery': (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')}
+
+
+def _update_record_form(ctx):
+    # Re-save an open case unchanged
+    record_id, diagnosis, treatment, expected_recovery, status = ctx.choice(ctx.open_cases)
+    return {'record_id': record_id, 'diagnosis': diagnosis, 'treatment': treatment,
+            'expected_recovery': expected_recovery.strftime('%Y-%m-%d'), 'status': status}
+
+
+def _report_form(ctx):
+    # Written to REPORT_DIR by the job queue rather than the database
+    return {'report': 'team', 'team_id': ctx.choice(ctx.teams), 'format': 'json'}
+
+
+def _import_file(ctx):
+    match_id = ctx.choice(ctx.completed)[0]
+    body = f"player_id,match_id,goals\n999999999,{match_id},1\n"
+    return {'file': (io.BytesIO(body.encode()), 'stats.csv')}
+
+
+def _live_poll_path(ctx):
+    # What a fan dashboard polls: its upcoming matches
+    return f"/matches/live/poll?match_ids={','.join(str(ctx.choice(ctx.scheduled)) for _ in range(6))}&since=0"
+
+
+def _search_path(ctx):
+    # What a typeahead sends: a word as typed so far, a full name, two words, a typo and a date
+    return f"/search?q={ctx.choice(['u', 'unit', 'united', 'leo+k', 'forwrd', 'fairveiw', 'aug+2025'])}"
+
+
+ROUTES = [
+    Route('index', 'GET', '/'),
+    Route('register_form', 'GET', '/register'),
+    Route('register', 'POST', '/register', write=True,
+          data=lambda ctx: {'username': f"bench{ctx.run_id}_{ctx.serial()}",
+                            'password': ctx.password, 'email': 'bench@example.com',
+                            'phone': '0700000000', 'role': 'fan'}),
+    Route('login_form', 'GET', '/login'),
+    Route('login', 'POST', '/login',
+          data=lambda ctx: {'username': ctx.user('fan')[1], 'password': ctx.password}),
+    Route('logout', 'GET', '/logout', role='fan'),
+    Route('dashboard', 'GET', '/dashboard', role='fan'),
+    Route('admin_dashboard', 'GET', '/admin/dashboard', role='admin'),
+    Route('db_pool_stats', 'GET', '/admin/db_pool', role='admin'),
+    Route('query_stats', 'GET', '/admin/query_stats', role='admin'),
+    Route('rebuild_standings', 'POST', '/admin/standings/rebuild', role='admin', write=True),
+    Route('session_stats', 'GET', '/admin/sessions', role='admin'),
+    # Sets a fan's role to fan, so the data is left as it was
+    Route('change_user_role', 'POST', lambda ctx: f"/admin/users/{ctx.user('fan')[0]}/role", role='admin',
+          data=lambda ctx: {'role': 'fan'}, write=True),
+    Route('revoke_user_sessions', 'POST', lambda ctx: f"/admin/users/{ctx.user('fan')[0]}/sessions/revoke",
+          role='admin', write=True),
+    Route('generate_reports', 'GET', '/admin/reports', role='admin'),
+    Route('export_report', 'GET', '/admin/reports/export', role='admin'),
+    Route('queue_report', 'POST', '/admin/reports/jobs', role='admin', data=_report_form, write=True),
+    Route('coach_dashboard', 'GET', '/coach/dashboard', role='coach'),
+    Route('player_dashboard', 'GET', '/player/dashboard', role='player'),
+    Route('medical_dashboard', 'GET', '/medical/dashboard', role='medical'),
+    Route('add_medical_record', 'POST', '/medical/records', role='medical', data=_medical_record_form,
+          write=True),
+    Route('update_medical_record', 'POST', '/medical/records/update', role='medical',
+          data=_update_record_form, write=True),
+    Route('fan_dashboard', 'GET', '/fan/dashboard', role='fan'),
+    Route('create_player_profile', 'GET', '/create_player_profile', role='player'),
+    # Incomplete form: exercises the POST path without adding duplicate profiles
+    Route('create_player_profile_invalid', 'POST', '/create_player_profile', role='player',
+          data=lambda ctx: {'full_name': '', 'date_of_birth': '', 'position': '', 'team_id': ''}),
+    Route('add_fan_engagement', 'POST', '/fan/engagement', role='fan', data=_comment_form, write=True),
+    Route('predict_score', 'POST', '/fan/predict', role='fan', data=_prediction_form, write=True),
+    Route('check_in', 'POST', lambda ctx: f"/fan/matches/{ctx.choice(ctx.scheduled)}/check_in",
+          role='fan', write=True),
+    Route('matches', 'GET', '/matches', role='fan'),
+    Route('matches_large', 'GET', '/matches?page_size=100', role='fan'),
+    Route('upcoming_matches', 'GET', '/matches/upcoming', role='fan'),
+    Route('past_matches', 'GET', '/matches/past', role='fan'),
+    Route('match_details', 'GET', lambda ctx: f"/matches/{ctx.choice(ctx.match_ids)}", role='fan'),
+    Route('live_poll', 'GET', _live_poll_path, role='fan'),
+    Route('search', 'GET', '/search?q=united', role='fan'),
+    Route('search_typeahead', 'GET', _search_path, role='fan'),
+    Route('search_stats', 'GET', '/admin/search', role='admin'),
+    Route('match_availability', 'GET', lambda ctx: f"/matches/{ctx.choice(ctx.scheduled)}/availability",
+          role='coach'),
+    Route('squad_selection', 'GET', lambda ctx: f"/coach/matches/{ctx.choice(ctx.squad_matches)}/squad",
+          role='coach', user=lambda ctx: ctx.squad_coach),
+    Route('squad_suggest', 'POST', lambda ctx: f"/coach/matches/{ctx.choice(ctx.squad_matches)}/squad",
+          role='coach', user=lambda ctx: ctx.squad_coach, data=lambda ctx: {'action': 'suggest'}),
+    Route('create_match_form', 'GET', '/matches/create', role='admin'),
+    Route('create_match', 'POST', '/matches/create', role='admin', data=_create_form, write=True),
+    Route('schedule_fixtures_form', 'GET', '/matches/schedule', role='admin'),
+    Route('schedule_fixtures', 'POST', '/matches/schedule', role='admin', data=_schedule_form),
+    Route('update_match_form', 'GET', lambda ctx: f"/matches/update/{ctx.choice(ctx.completed)[0]}",
+          role='admin'),
+    Route('update_match', 'POST', lambda ctx: f"/matches/update/{ctx.choice(ctx.completed)[0]}",
+          role='admin', data=_update_form, write=True),
+    Route('import_stats', 'POST', '/matches/stats/import', role='admin', files=_import_file, write=True),
+]
+
+
+def _load_module(name, filename):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, filename))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def _template_source(name):
+    if name == 'base.html':
+        return BASE_TEMPLATE, None, lambda: True
+    stem, extension = os.path.splitext(name)
+    for candidate in (name, f"{stem} (1){extension}"):
+        path = os.path.join(ROOT, candidate)
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                source = f.read()
+            mtime = os.path.getmtime(path)
+            return source, path, lambda: os.path.getmtime(path) == mtime
+    return None
+
+
+class _ErrorCollector(logging.Handler):
+    """Counts the exceptions raised by views so failures show up in the report"""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.errors = {}
+
+    def emit(self, record):
+        if record.exc_info and record.exc_info[1] is not None:
+            error = record.exc_info[1]
+            key = f"{type(error).__name__}: {error}"
+            entry = self.errors.setdefault(key, {'count': 0, 'example': record.getMessage()})
+            entry['count'] += 1
+
+
+def build_app():
+    """Import the Flask app and the match blueprint the way the server would see them"""
+    import jinja2
+
+    app_module = _load_module('app', 'app (1).py')
+    match_module = _load_module('match_management', 'match_management (1).py')
+    app = app_module.app
+    if 'match' not in app.blueprints:
+        app.register_blueprint(match_module.match_bp)
+    app.jinja_loader = jinja2.FunctionLoader(_template_source)
+    # Templates link to pages that do not exist yet; render those links as '#'
+    app.url_build_error_handlers.append(lambda error, endpoint, values: '#')
+
+    collector = _ErrorCollector()
+    app.logger.handlers[:] = [collector]
+    app.logger.propagate = False
+    return app, collector
+
+
+def check_coverage(app):
+    """Return URL rules that no benchmark route exercises"""
+    # A query string does not change the rule a path is routed to
+    covered = {(route.method, route.path.split('?')[0] if isinstance(route.path, str) else None)
+               for route in ROUTES}
+    dynamic = {route.name for route in ROUTES if not isinstance(route.path, str)}
+    missing = []
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint == 'static':
+            continue
+        if rule.arguments:
+            endpoint = rule.endpoint.split('.')[-1]
+            if not any(name.startswith(endpoint) for name in dynamic):
+                missing.append(rule.rule)
+            continue
+        for method in sorted(rule.methods - {'HEAD', 'OPTIONS'}):
+            if (method, rule.rule) not in covered:
+                missing.append(f"{method} {rule.rule}")
+    return missing
+
+
+def _client(app, ctx, role, user=None):
+    client = app.test_client()
+    if role:
+        user_id, username = user(ctx) if user else ctx.user(role)
+        with client.session_transaction() as session:
+            session['user_id'] = user_id
+            session['username'] = username
+            session['role'] = role
+    return client
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def _named_query_times(before, after):
+    # Calls and time per named query between two QueryStats.by_name() snapshots
+    times = {}
+    for name, total in after.items():
+        earlier = before.get(name, {'calls': 0, 'total_ms': 0.0})
+        calls = total['calls'] - earlier['calls']
+        if calls > 0:
+            total_ms = total['total_ms'] - earlier['total_ms']
+            times[name] = {'calls': calls, 'total_ms': round(total_ms, 2), 'mean_ms': round(total_ms / calls, 3)}
+    return times
+
+
+def run_route(app, ctx, route, concurrency, requests, warmup=5):
+    """Send requests to one route from concurrency threads; returns the result dict"""
+    from query_stats import get_query_stats
+    warm = _client(app, ctx, route.role, route.user)
+    for _ in range(warmup):
+        path, data = route.build(ctx)
+        warm.open(path, method=route.method, data=data)
+
+    share = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+
+    def worker(n):
+        client = _client(app, ctx, route.role, route.user)
+        samples = []
+        for _ in range(n):
+            path, data = route.build(ctx)
+            start = time.perf_counter()
+            response = client.open(path, method=route.method, data=data)
+            elapsed = time.perf_counter() - start
+            samples.append((elapsed, response.status_code, int(response.headers.get('X-Query-Count', 0))))
+        return samples
+
+    named_before = get_query_stats().by_name()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = [sample for batch in executor.map(worker, [n for n in share if n]) for sample in batch]
+    wall = time.perf_counter() - started
+    named_queries = _named_query_times(named_before, get_query_stats().by_name())
+
+    latencies = sorted(sample[0] * 1000 for sample in samples)
+    queries = [sample[2] for sample in samples]
+    statuses = {}
+    for _, status, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        'route': route.name,
+        'method': route.method,
+        'path': route.path if isinstance(route.path, str) else route.name,
+        'role': route.role,
+        'concurrency': concurrency,
+        'requests': len(samples),
+        'errors': sum(1 for _, status, _ in samples if status >= 500),
+        'status_codes': statuses,
+        'throughput_rps': round(len(samples) / wall, 1) if wall else 0.0,
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+            'p50': round(_percentile(latencies, 50), 3),
+            'p95': round(_percentile(latencies, 95), 3),
+            'p99': round(_percentile(latencies, 99), 3),
+            'max': round(latencies[-1], 3) if latencies else 0.0,
+        },
+        'queries_per_request': {
+            'mean': round(sum(queries) / len(queries), 2) if queries else 0.0,
+            'max': max(queries) if queries else 0,
+        },
+        'named_queries': named_queries,
+    }
+
+
+def measure_memory(app, ctx, route, requests):
+    """Peak Python heap allocated while serving each request, in KiB (one thread, under tracemalloc)"""
+    client = _client(app, ctx, route.role, route.user)
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(requests):
+            path, data = route.build(ctx)
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            client.open(path, method=route.method, data=data)
+            peaks.append((tracemalloc.get_traced_memory()[1] - before) / 1024)
+    finally:
+        tracemalloc.stop()
+    peaks.sort()
+    return {
+        'mean': round(sum(peaks) / len(peaks), 1),
+        'p50': round(_percentile(peaks, 50), 1),
+        'max': round(peaks[-1], 1),
+    }
+
+
+def compare(results, baseline_path):
+    """Print p50/p99/throughput changes against an earlier results file"""
+    with open(baseline_path, encoding='utf-8') as f:
+        # Results of the removed async mode are left out
+        baseline = {(r['route'], r['concurrency']): r for r in json.load(f)['results']
+                    if r.get('mode', 'sync') == 'sync'}
+    print(f"\n{'route':<30}{'conc':>5}{'p50 ms':>18}{'p99 ms':>18}{'req/s':>18}")
+    for result in results:
+        before = baseline.get((result['route'], result['concurrency']))
+        if not before:
+            continue
+
+        def delta(old, new):
+            change = (new - old) / old * 100 if old else 0.0
+            return f"{new:>9.2f} ({change:+5.0f}%)"
+
+        memory = ''
+        if 'peak_kib' in before and 'peak_kib' in result:
+            memory = f"{delta(before['peak_kib']['mean'], result['peak_kib']['mean']):>18} KiB"
+        print(f"{result['route']:<30}{result['concurrency']:>5}"
+              f"{delta(before['latency_ms']['p50'], result['latency_ms']['p50']):>18}"
+              f"{delta(before['latency_ms']['p99'], result['latency_ms']['p99']):>18}"
+              f"{delta(before['throughput_rps'], result['throughput_rps']):>18}{memory}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark every route against a synthetic league')
+    parser.add_argument('--db', default=os.path.join(ROOT, 'benchmark.db'))
+    parser.add_argument('--reuse', action='store_true', help='use the existing --db instead of regenerating it')
+    parser.add_argument('--teams', type=int, default=20)
+    parser.add_argument('--seasons', type=int, default=3)
+    parser.add_argument('--players-per-team', type=int, default=25)
+    parser.add_argument('--fans', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--concurrency', default='1,4,16', help='comma separated thread counts')
+    parser.add_argument('--requests', type=int, default=200, help='requests per route and concurrency level')
+    parser.add_argument('--routes', help='comma separated route names (default: all)')
+    parser.add_argument('--read-only', action='store_true', help='skip routes that write')
+    parser.add_argument('--pool-size', type=int, help='DB_POOL_SIZE for the run')
+    parser.add_argument('--memory', action='store_true',
+                        help='also measure peak heap per request (a separate single-threaded pass)')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    # The repo modules read their settings at import time, so configure first
+    os.environ['DB_BACKEND'] = 'sqlite'
+    os.environ['DB_PATH'] = args.db
+    if args.pool_size:
+        os.environ['DB_POOL_SIZE'] = str(args.pool_size)
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s %(name)s: %(message)s')
+    sys.path.insert(0, ROOT)
+
+    from synthetic_league import LeagueSpec, generate
+    spec = LeagueSpec(teams=args.teams, seasons=args.seasons, players_per_team=args.players_per_team,
+                      fans=args.fans, seed=args.seed)
+    if args.reuse and os.path.exists(args.db):
+        league = {'db_path': args.db, 'spec': None, 'rows': None}
+    else:
+        print(f"Generating {spec.matches} matches into {args.db} ...")
+        league = generate(args.db, spec)
+
+    app, collector = build_app()
+    from db_pool import get_pool, pool_stats
+    ctx = BenchContext(spec.password).load(get_pool())
+
+    missing = check_coverage(app)
+    if missing:
+        print(f"Routes without a benchmark entry: {', '.join(missing)}")
+
+    selected = set(args.routes.split(',')) if args.routes else None
+    routes = [route for route in ROUTES
+              if (selected is None or route.name in selected) and not (args.read_only and route.write)]
+    levels = [int(level) for level in args.concurrency.split(',')]
+
+    results = []
+    for route in routes:
+        measured = []
+        for concurrency in levels:
+            result = run_route(app, ctx, route, concurrency, args.requests)
+            measured.append(result)
+            print(f"{route.name:<30} c={concurrency:<3} {result['throughput_rps']:>8.1f} req/s  "
+                  f"p50 {result['latency_ms']['p50']:>8.2f}  p95 {result['latency_ms']['p95']:>8.2f}  "
+                  f"p99 {result['latency_ms']['p99']:>8.2f} ms  "
+                  f"{result['queries_per_request']['mean']:>6.1f} q/req  errors {result['errors']}")
+        if args.memory:
+            # tracemalloc slows every allocation, so memory is measured after the timed runs
+            peak = measure_memory(app, ctx, route, min(args.requests, 50))
+            for result in measured:
+                result['peak_kib'] = peak
+            print(f"{route.name:<30} peak heap {peak['mean']:>8.1f} KiB/request (max {peak['max']:.1f})")
+        results.extend(measured)
+
+    report = {
+        'meta': {
+            'started': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'db_path': args.db,
+            'league': league,
+            'requests_per_level': args.requests,
+            'concurrency': levels,
+            'pool': pool_stats(),
+            'uncovered_routes': missing,
+            'errors': collector.errors,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"\nResults written to {args.output}")
+    if collector.errors:
+        print("Server errors:")
+        for error, entry in collector.errors.items():
+            print(f"  {entry['count']:>6} x {error} ({entry['example']})")
+
+    if args.baseline:
+        compare(results, args.baseline)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+Dashboard data loaders for Sports Management System
+Fetches everything a dashboard needs with explicit column lists, runs the
+independent queries side by side on pooled connections and returns records
+(see records.py), so templates can use record.injury_type instead of record[3]
+"""
+
+import os
+import atexit
+import contextvars
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from db_pool import get_pool
+from reference_cache import team_name
+from records import PhysioRecord, PlayerStat, fetch_records, mapper, match_record
+from queries import PLAYER_BY_USER, PLAYER_MATCH_STATS, PLAYER_PHYSIO_RECORDS, TEAM_UPCOMING_MATCHES
+
+# Threads used for the side queries (each one checks out its own connection)
+DASHBOARD_WORKERS = int(os.environ.get('DASHBOARD_WORKERS', 8))
+
+# Named rows; still tuples, so positional access keeps working
+PlayerRow = namedtuple('PlayerRow', 'player_id user_id full_name date_of_birth position team_id status')
+TeamRow = namedtuple('TeamRow', 'team_id team_name')
+
+# Rows of the player dashboard queries (queries.py)
+physio_record = mapper(PhysioRecord, 'record_id record_date injury_type diagnosis treatment '
+                                     'expected_recovery status specialization staff_name')
+stat_record = mapper(PlayerStat, 'stat_id match_id goals assists yellow_cards red_cards minutes_played '
+                                 'performance_rating match_datetime home_team_id away_team_id')
+
+
+class PlayerDashboard:
+    """Everything player_dashboard.html renders, apart from the analytics card"""
+
+    __slots__ = ('player', 'team', 'upcoming_matches', 'physio_records', 'stats')
+
+    def __init__(self, player, team, upcoming_matches, physio_records, stats):
+        self.player = player
+        self.team = team
+        self.upcoming_matches = upcoming_matches
+        self.physio_records = physio_records
+        self.stats = stats
+
+
+_executor = ThreadPoolExecutor(max_workers=DASHBOARD_WORKERS, thread_name_prefix='dashboard')
+atexit.register(_executor.shutdown, wait=False)
+
+
+def _fetch(conn, sql, params, build):
+    return fetch_records(conn.cursor(), build, sql, params)
+
+
+def _fetch_pooled(sql, params, build):
+    with get_pool().connection() as conn:
+        return _fetch(conn, sql, params, build)
+
+
+def _spare_connections(pool):
+    stats = pool.stats()
+    return stats['idle'] + (stats['max_size'] - stats['size']) - stats['waiting']
+
+
+def _run_queries(conn, queries):
+    """
+    Run [(sql, params, build), ...] and return their records in the same order.
+    The first query runs on conn in this thread; the rest go to the worker
+    threads when the pool has connections to spare, otherwise they run on
+    conn one after another so a busy pool never makes a request wait on itself.
+    """
+    first, rest = queries[0], queries[1:]
+    pool = get_pool()
+    if rest and _spare_connections(pool) >= len(rest):
+        # Each worker runs in a copy of this context so its queries count towards the request
+        futures = [_executor.submit(contextvars.copy_context().run, _fetch_pooled, *query)
+                   for query in rest]
+        results = [_fetch(conn, *first)]
+        results.extend(future.result() for future in futures)
+        return results
+    return [_fetch(conn, *query) for query in queries]
+
+
+def load_player_dashboard(user_id):
+    """PlayerDashboard for the player linked to user_id, or None if there is no profile"""
+    with get_pool().connection() as conn:
+        rows = _fetch(conn, PLAYER_BY_USER, (user_id,), PlayerRow._make)
+        if not rows:
+            return None
+        player = rows[0]
+
+        upcoming, physio, stats = _run_queries(conn, [
+            (TEAM_UPCOMING_MATCHES, (player.team_id, player.team_id), match_record),
+            (PLAYER_PHYSIO_RECORDS, (player.player_id,), physio_record),
+            (PLAYER_MATCH_STATS, (player.player_id,), stat_record),
+        ])
+    return _player_dashboard(player, upcoming, physio, stats)
+
+
+def _player_dashboard(player, upcoming, physio, stats):
+    # Team, opponent and venue names come from the reference cache, not joins
+    name = team_name(player.team_id) if player.team_id is not None else None
+    team = TeamRow(player.team_id, name) if name is not None else None
+    return PlayerDashboard(
+        player=player,
+        team=team,
+        upcoming_matches=upcoming,
+        physio_records=physio,
+        stats=stats,
+    )
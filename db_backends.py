@@ -0,0 +1,361 @@
+"""
+Storage backends for Sports Management System
+Wraps Microsoft Access (pyodbc) and embedded SQLite behind one interface so
+the routes can keep writing the same SQL on either engine
+"""
+
+import os
+import re
+import sqlite3
+import logging
+import threading
+from datetime import date, datetime
+from functools import lru_cache
+
+logger = logging.getLogger('database')
+
+# Backend settings (can be overridden from the environment)
+DB_BACKEND = os.environ.get('DB_BACKEND', 'access')
+DB_PATH = os.environ.get('DB_PATH')
+SQLITE_CACHE_KB = int(os.environ.get('DB_SQLITE_CACHE_KB', 64000))
+SQLITE_MMAP_BYTES = int(os.environ.get('DB_SQLITE_MMAP_BYTES', 256 * 1024 * 1024))
+# Prepared statements kept per connection
+STATEMENT_CACHE_SIZE = int(os.environ.get('DB_STATEMENT_CACHE_SIZE', 128))
+
+# Schema used when the data lives in SQLite (mirrors the Access tables)
+SQLITE_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS USERS (
+        UserID INTEGER PRIMARY KEY AUTOINCREMENT,
+        Username TEXT NOT NULL UNIQUE,
+        Password TEXT NOT NULL,
+        Email TEXT,
+        Phone TEXT,
+        RegistrationDate TIMESTAMP,
+        Role TEXT NOT NULL
+    )''',
+    '''CREATE TABLE IF NOT EXISTS TEAMS (
+        TeamID INTEGER PRIMARY KEY AUTOINCREMENT,
+        TeamName TEXT NOT NULL,
+        League TEXT,
+        CoachID INTEGER
+    )''',
+    '''CREATE TABLE IF NOT EXISTS VENUES (
+        VenueID INTEGER PRIMARY KEY AUTOINCREMENT,
+        VenueName TEXT NOT NULL,
+        Location TEXT,
+        Capacity INTEGER
+    )''',
+    '''CREATE TABLE IF NOT EXISTS PLAYERS (
+        PlayerID INTEGER PRIMARY KEY AUTOINCREMENT,
+        UserID INTEGER,
+        FullName TEXT NOT NULL,
+        DateOfBirth DATE,
+        Position TEXT,
+        TeamID INTEGER,
+        Status TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS FANS (
+        FanID INTEGER PRIMARY KEY AUTOINCREMENT,
+        UserID INTEGER NOT NULL,
+        MembershipType TEXT,
+        JoinDate TIMESTAMP,
+        LoyaltyPoints INTEGER DEFAULT 0
+    )''',
+    '''CREATE TABLE IF NOT EXISTS MEDICAL_STAFF (
+        StaffID INTEGER PRIMARY KEY AUTOINCREMENT,
+        UserID INTEGER NOT NULL,
+        Specialization TEXT,
+        Qualification TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS MATCHES (
+        MatchID INTEGER PRIMARY KEY AUTOINCREMENT,
+        HomeTeamID INTEGER NOT NULL,
+        AwayTeamID INTEGER NOT NULL,
+        MatchDateTime TIMESTAMP NOT NULL,
+        VenueID INTEGER NOT NULL,
+        Status TEXT,
+        HomeScore INTEGER,
+        AwayScore INTEGER
+    )''',
+    '''CREATE TABLE IF NOT EXISTS PLAYER_STATS (
+        StatID INTEGER PRIMARY KEY AUTOINCREMENT,
+        PlayerID INTEGER NOT NULL,
+        MatchID INTEGER NOT NULL,
+        TeamID INTEGER,
+        Goals INTEGER DEFAULT 0,
+        Assists INTEGER DEFAULT 0,
+        YellowCards INTEGER DEFAULT 0,
+        RedCards INTEGER DEFAULT 0,
+        MinutesPlayed INTEGER DEFAULT 0,
+        PerformanceRating REAL,
+        Notes TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS PHYSIO_RECORDS (
+        RecordID INTEGER PRIMARY KEY AUTOINCREMENT,
+        PlayerID INTEGER NOT NULL,
+        RecordDate TIMESTAMP,
+        InjuryType TEXT,
+        Diagnosis TEXT,
+        Treatment TEXT,
+        ExpectedRecovery DATE,
+        Status TEXT,
+        StaffID INTEGER
+    )''',
+    '''CREATE TABLE IF NOT EXISTS FAN_ENGAGEMENT (
+        EngagementID INTEGER PRIMARY KEY AUTOINCREMENT,
+        FanID INTEGER NOT NULL,
+        MatchID INTEGER NOT NULL,
+        Prediction TEXT,
+        EngagementDate TIMESTAMP,
+        EngagementType TEXT,
+        Comment TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS MATCH_SQUADS (
+        SelectionID INTEGER PRIMARY KEY AUTOINCREMENT,
+        MatchID INTEGER NOT NULL,
+        TeamID INTEGER NOT NULL,
+        PlayerID INTEGER NOT NULL,
+        Role TEXT,
+        Position TEXT,
+        Formation TEXT,
+        SelectedBy INTEGER,
+        SelectedAt TIMESTAMP
+    )''',
+]
+
+# Indexes on the join and sort keys used by the routes
+SQLITE_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS IX_MATCHES_HomeTeamID ON MATCHES (HomeTeamID)',
+    'CREATE INDEX IF NOT EXISTS IX_MATCHES_AwayTeamID ON MATCHES (AwayTeamID)',
+    'CREATE INDEX IF NOT EXISTS IX_MATCHES_VenueID ON MATCHES (VenueID)',
+    'CREATE INDEX IF NOT EXISTS IX_MATCHES_MatchDateTime ON MATCHES (MatchDateTime, MatchID)',
+    'CREATE INDEX IF NOT EXISTS IX_PLAYER_STATS_MatchID ON PLAYER_STATS (MatchID)',
+    'CREATE INDEX IF NOT EXISTS IX_PLAYER_STATS_PlayerID ON PLAYER_STATS (PlayerID)',
+    'CREATE INDEX IF NOT EXISTS IX_PHYSIO_RECORDS_PlayerID ON PHYSIO_RECORDS (PlayerID)',
+    'CREATE INDEX IF NOT EXISTS IX_PHYSIO_RECORDS_StaffID ON PHYSIO_RECORDS (StaffID)',
+    'CREATE INDEX IF NOT EXISTS IX_FAN_ENGAGEMENT_MatchID ON FAN_ENGAGEMENT (MatchID)',
+    'CREATE INDEX IF NOT EXISTS IX_FAN_ENGAGEMENT_FanID ON FAN_ENGAGEMENT (FanID)',
+    'CREATE INDEX IF NOT EXISTS IX_PLAYERS_UserID ON PLAYERS (UserID)',
+    'CREATE INDEX IF NOT EXISTS IX_PLAYERS_TeamID ON PLAYERS (TeamID)',
+    'CREATE INDEX IF NOT EXISTS IX_FANS_UserID ON FANS (UserID)',
+    'CREATE INDEX IF NOT EXISTS IX_MEDICAL_STAFF_UserID ON MEDICAL_STAFF (UserID)',
+    'CREATE INDEX IF NOT EXISTS IX_MATCH_SQUADS_MatchID ON MATCH_SQUADS (MatchID, TeamID)',
+]
+
+_LIMIT_RE = re.compile(r'\s+LIMIT\s+(\d+)\s*;?\s*$', re.IGNORECASE)
+_TOP_RE = re.compile(r'^(\s*SELECT\s+(?:DISTINCT\s+)?)TOP\s+(\d+)\s+', re.IGNORECASE)
+_SELECT_RE = re.compile(r'^(\s*SELECT\s+(?:DISTINCT\s+)?)', re.IGNORECASE)
+_NOW_RE = re.compile(r'\bNOW\(\)', re.IGNORECASE)
+_IDENTITY_RE = re.compile(r'@@IDENTITY', re.IGNORECASE)
+
+
+class DialectCursor:
+    """Cursor wrapper that rewrites SQL into the backend's dialect"""
+
+    def __init__(self, backend, raw):
+        self._backend = backend
+        self._raw = raw
+
+    def _text(self, sql):
+        # Named queries (queries.py) keep their text for each backend
+        text_for = getattr(sql, 'text_for', None)
+        return text_for(self._backend) if text_for else self._backend.translate(sql)
+
+    def execute(self, sql, params=()):
+        self._raw.execute(self._text(sql), params)
+        return self
+
+    def executemany(self, sql, params_list):
+        self._raw.executemany(self._text(sql), params_list)
+        return self
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __iter__(self):
+        return iter(self._raw)
+
+
+class DialectConnection:
+    """Connection wrapper whose cursors translate SQL for the backend"""
+
+    def __init__(self, backend, raw):
+        self.backend = backend
+        self._raw = raw
+
+    def cursor(self):
+        return DialectCursor(self.backend, self._raw.cursor())
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def close(self):
+        self._raw.close()
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+class AccessBackend:
+    """Microsoft Access database reached through the ODBC driver"""
+
+    name = 'access'
+    ping_query = 'SELECT 1'
+    # pyodbc keeps the prepared statement on the cursor, so the pool keeps a cursor per statement
+    statement_cursors = True
+
+    def __init__(self, db_path='./sports_management_system.accdb', driver=None):
+        self.db_path = db_path
+        self.driver = driver
+
+    def _find_driver(self):
+        import pyodbc
+        drivers = [x for x in pyodbc.drivers() if x.startswith('Microsoft Access')]
+        if not drivers:
+            logger.error("No Microsoft Access ODBC drivers found")
+            raise Exception("No Microsoft Access ODBC drivers found. Please install the Microsoft Access Database Engine.")
+        return drivers[0]
+
+    def connection_string(self):
+        driver = self.driver or 'Microsoft Access Driver (*.mdb, *.accdb)'
+        return f"DRIVER={{{driver}}};DBQ={self.db_path};"
+
+    def connect(self):
+        import pyodbc
+        if self.driver is None:
+            self.driver = self._find_driver()
+        return DialectConnection(self, pyodbc.connect(self.connection_string()))
+
+    def translate(self, sql):
+        return _translate_access(sql)
+
+    def list_tables(self, conn):
+        cursor = conn.cursor()
+        return [row.table_name for row in cursor.tables() if row.table_type == 'TABLE']
+
+
+class SQLiteBackend:
+    """Embedded SQLite database tuned for concurrent readers"""
+
+    name = 'sqlite'
+    ping_query = 'SELECT 1'
+    # sqlite3 keeps prepared statements on the connection (cached_statements)
+    statement_cursors = False
+
+    def __init__(self, db_path='./sports_management_system.db',
+                 cache_kb=SQLITE_CACHE_KB, mmap_bytes=SQLITE_MMAP_BYTES):
+        self.db_path = db_path
+        self.cache_kb = cache_kb
+        self.mmap_bytes = mmap_bytes
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    def connect(self):
+        raw = sqlite3.connect(self.db_path,
+                              detect_types=sqlite3.PARSE_DECLTYPES,
+                              check_same_thread=False,
+                              timeout=30,
+                              cached_statements=STATEMENT_CACHE_SIZE)
+        # WAL lets readers run alongside a writer; NORMAL sync is safe in WAL mode
+        raw.execute('PRAGMA journal_mode=WAL')
+        raw.execute('PRAGMA synchronous=NORMAL')
+        raw.execute(f'PRAGMA cache_size=-{int(self.cache_kb)}')
+        raw.execute(f'PRAGMA mmap_size={int(self.mmap_bytes)}')
+        raw.execute('PRAGMA temp_store=MEMORY')
+        raw.execute('PRAGMA busy_timeout=30000')
+
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    self.initialize(raw)
+                    self._initialized = True
+
+        return DialectConnection(self, raw)
+
+    def initialize(self, raw):
+        """Create the tables and join-key indexes if they are missing"""
+        for statement in SQLITE_SCHEMA + SQLITE_INDEXES:
+            raw.execute(statement)
+        raw.commit()
+        logger.info(f"SQLite schema ready at {self.db_path}")
+
+    def translate(self, sql):
+        return _translate_sqlite(sql)
+
+    def list_tables(self, conn):
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")
+        return [row[0] for row in cursor.fetchall()]
+
+
+@lru_cache(maxsize=512)
+def _translate_access(sql):
+    # LIMIT n -> SELECT TOP n
+    match = _LIMIT_RE.search(sql)
+    if match:
+        sql = _SELECT_RE.sub(lambda m: f'{m.group(1)}TOP {match.group(1)} ', sql[:match.start()], count=1)
+    return sql
+
+
+@lru_cache(maxsize=512)
+def _translate_sqlite(sql):
+    sql = _NOW_RE.sub("datetime('now', 'localtime')", sql)
+    sql = _IDENTITY_RE.sub('last_insert_rowid()', sql)
+    # SELECT TOP n -> LIMIT n
+    match = _TOP_RE.search(sql)
+    if match:
+        sql = _TOP_RE.sub(r'\1', sql, count=1).rstrip().rstrip(';') + f' LIMIT {match.group(2)}'
+    return sql
+
+
+def _convert_datetime(value):
+    return datetime.fromisoformat(value.decode())
+
+
+def _convert_date(value):
+    text = value.decode()
+    return date.fromisoformat(text[:10])
+
+
+# Store dates the way NOW() is rendered so comparisons stay lexicographic
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_converter('TIMESTAMP', _convert_datetime)
+sqlite3.register_converter('DATETIME', _convert_datetime)
+sqlite3.register_converter('DATE', _convert_date)
+
+
+def create_backend(name=DB_BACKEND, db_path=DB_PATH):
+    """Build a backend by name ('access' or 'sqlite')"""
+    if name == 'sqlite':
+        return SQLiteBackend(db_path or './sports_management_system.db')
+    if name == 'access':
+        return AccessBackend(db_path or './sports_management_system.accdb')
+    raise ValueError(f"Unknown database backend: {name}")
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Return the backend configured through DB_BACKEND / DB_PATH"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend()
+                logger.info(f"Using {_backend.name} database backend at {_backend.db_path}")
+    return _backend
+
+
+if __name__ == "__main__":
+    # Create (or check) the configured database when run directly
+    backend = get_backend()
+    conn = backend.connect()
+    print(f"Backend: {backend.name} ({backend.db_path})")
+    print(f"Tables: {backend.list_tables(conn)}")
+    conn.close()
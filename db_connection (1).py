@@ -1,13 +1,15 @@
 """
 Database connection module for Sports Management System
-Provides robust connection handling for Microsoft Access database via pyodbc
+Provides robust connection handling for the Microsoft Access (pyodbc) or SQLite backend
 """
 
 import os
-import pyodbc
 import logging
 from pathlib import Path
 
+from db_backends import DB_BACKEND, create_backend, get_backend
+from db_pool import ConnectionPool, get_pool
+
 # Configure logging
 logging.basicConfig(
     filename='database.log',
@@ -17,58 +19,93 @@ logging.basicConfig(
 logger = logging.getLogger('database')
 
 class DatabaseConnection:
-    """Class to handle database connections to Microsoft Access"""
+    """Class to handle database connections to Microsoft Access or SQLite"""
     
-    def __init__(self, db_path=None):
-        """Initialize with database path or use default"""
+    def __init__(self, db_path=None, backend=DB_BACKEND):
+        """Initialize with database path, or share the routes' pool (DB_BACKEND / DB_PATH)"""
+        if not db_path and backend == DB_BACKEND:
+            # The configured database: same backend and connections as get_pool()
+            self.backend = get_backend()
+            self.db_path = self.backend.db_path
+            self.pool = get_pool()
+            logger.info(f"Using the shared connection pool for {self.db_path}")
+            return
+        
         if db_path:
             self.db_path = db_path
         else:
             # Use the default path relative to the project root
             root_dir = Path(__file__).parent  # Assumes this file is in the project root
-            self.db_path = os.path.join(root_dir, 'sports_management_system.accdb')
+            filename = 'sports_management_system.db' if backend == 'sqlite' else 'sports_management_system.accdb'
+            self.db_path = os.path.join(root_dir, filename)
         
         # Normalize path for Windows
         self.db_path = os.path.normpath(self.db_path)
         logger.info(f"Database path set to: {self.db_path}")
         
-        # Verify database file exists
-        if not os.path.exists(self.db_path):
+        # Verify database file exists (SQLite creates its file on first use)
+        if backend == 'access' and not os.path.exists(self.db_path):
             logger.error(f"Database file not found at {self.db_path}")
             raise FileNotFoundError(f"Database file not found at {self.db_path}")
+        
+        # The backend owns the connection string and SQL dialect
+        self.backend = create_backend(backend, self.db_path)
+        
+        # Another database gets a private pool of the same implementation
+        self.pool = ConnectionPool(self._connect, ping_query=self.backend.ping_query)
+    
+    def _connect(self):
+        """Open a new raw connection to the database"""
+        conn = self.backend.connect()
+        logger.info(f"Database connection established successfully ({self.backend.name})")
+        return conn
     
     def get_connection(self):
-        """Get a connection to the database"""
+        """Get a pooled connection to the database (close() returns it to the pool)"""
         try:
-            # List available drivers for debugging
-            drivers = [x for x in pyodbc.drivers() if x.startswith('Microsoft Access')]
-            if not drivers:
-                logger.error("No Microsoft Access ODBC drivers found")
-                raise Exception("No Microsoft Access ODBC drivers found. Please install the Microsoft Access Database Engine.")
-            
-            logger.info(f"Available drivers: {drivers}")
-            driver = drivers[0]  # Use the first available driver
+            return self.pool.acquire()
+        except Exception as e:
+            logger.error(f"Connection error: {str(e)}")
+            raise
+    
+    def execute_query(self, query, params=None, fetchall=True):
+        """Execute a query and return the results"""
+        with self.pool.connection() as conn:
+            try:
+                cursor = conn.cursor()
+                
+                if params:
+                    cursor.execute(query, params)
+                else:
+                    cursor.execute(query)
+                
+                if fetchall:
+                    results = cursor.fetchall()
+                    return results
+                else:
+                    conn.commit()
+                    return cursor.rowcount
             
-            # Create connection string
-            conn_str = (
-                f"DRIVER={{{driver}}};"
-                f"DBQ={self.db_path};"
-            )
+            except Exception as e:
+                logger.error(f"Query execution error: {str(e)}")
+                raise
+    
+    def execute_many(self, query, params_list):
+        """Execute multiple queries with different parameters"""
+        with self.pool.connection() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.executemany(query, params_list)
+                conn.commit()
+                return cursor.rowcount
             
-            # Connect to the database
-            conn = pyodbc.connect(conn_str)
-            logger.info("Database connection established successfully")
-            return conn
-        
-        except pyodbc.Error as e:
-            logger.error(f"Execute many error: {str(e)}")
-            if conn:
-                conn.rollback()
-            raise
-        
-        finally:
-            if conn:
-                conn.close()
+            except Exception as e:
+                logger.error(f"Execute many error: {str(e)}")
+                raise
+    
+    def pool_stats(self):
+        """Return connection pool statistics"""
+        return self.pool.stats()
 
 
 # Global database connection instance
@@ -84,61 +121,16 @@ if __name__ == "__main__":
     # Test the connection if this file is run directly
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
         
         # Get table names for verification
-        tables = []
-        for row in cursor.tables():
-            if row.table_type == 'TABLE':
-                tables.append(row.table_name)
+        tables = db.backend.list_tables(conn)
         
         print("Connection successful!")
         print(f"Available tables: {tables}")
         
         conn.close()
+        print(f"Pool stats: {db.pool_stats()}")
     except Exception as e:
         print(f"Connection failed: {str(e)}")
         logger.error(f"Unexpected error: {str(e)}")
         raise
-    
-    def execute_query(self, query, params=None, fetchall=True):
-        """Execute a query and return the results"""
-        conn = None
-        try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            if params:
-                cursor.execute(query, params)
-            else:
-                cursor.execute(query)
-            
-            if fetchall:
-                results = cursor.fetchall()
-                return results
-            else:
-                conn.commit()
-                return cursor.rowcount
-        
-        except pyodbc.Error as e:
-            logger.error(f"Query execution error: {str(e)}")
-            if conn:
-                conn.rollback()
-            raise
-        
-        finally:
-            if conn:
-                conn.close()
-    
-    def execute_many(self, query, params_list):
-        """Execute multiple queries with different parameters"""
-        conn = None
-        try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.executemany(query, params_list)
-            conn.commit()
-            return cursor.rowcount
-        
-        except pyodbc.Error as e:
-            logger.error("An error occurred while executing multiple queries.")
\ No newline at end of file
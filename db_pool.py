@@ -0,0 +1,375 @@
+"""
+Connection pool module for Sports Management System
+Keeps a bounded set of reusable database connections shared by every route.
+On drivers that prepare statements per cursor (pyodbc), each connection also
+keeps a cursor per statement, so a query is prepared once per connection.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from db_backends import STATEMENT_CACHE_SIZE, get_backend
+from query_stats import instrument
+
+logger = logging.getLogger('database')
+
+# Pool settings (can be overridden from the environment)
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+POOL_IDLE_TIMEOUT = float(os.environ.get('DB_POOL_IDLE_TIMEOUT', 300))
+POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', 5))
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes free within the checkout timeout"""
+
+
+class StatementCache:
+    """
+    Idle cursors of one connection, keyed by their last statement. pyodbc skips
+    the prepare when a cursor runs the same text again, so handing a statement
+    the cursor that last ran it reuses the prepared statement.
+    """
+
+    def __init__(self, size=STATEMENT_CACHE_SIZE):
+        self.size = size
+        self._idle = OrderedDict()  # SQL text -> cursor, least recently used first
+        self.hits = 0
+        self.misses = 0
+
+    def take(self, sql):
+        cursor = self._idle.pop(sql, None)
+        if cursor is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return cursor
+
+    def give(self, sql, cursor):
+        # A statement run twice at once leaves a spare cursor; only one is kept
+        if sql in self._idle:
+            _close_cursor(cursor)
+            return
+        self._idle[sql] = cursor
+        while len(self._idle) > self.size:
+            _close_cursor(self._idle.popitem(last=False)[1])
+
+
+def _close_cursor(cursor):
+    try:
+        cursor.close()
+    except Exception:
+        pass
+
+
+class StatementCursor:
+    """Cursor of a pooled connection that runs each statement on the connection's cursor for it"""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._sql = None
+        self._cursor = None
+
+    def _bind(self, sql):
+        self.close()
+        self._cursor = self._conn.statement_cursor(sql)
+        self._sql = sql
+        return self._cursor
+
+    def execute(self, sql, params=()):
+        self._bind(sql).execute(sql, params)
+        return self
+
+    def executemany(self, sql, params_list):
+        self._bind(sql).executemany(sql, params_list)
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size=None):
+        return self._cursor.fetchmany(size) if size is not None else self._cursor.fetchmany()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def close(self):
+        """Hand the current statement's cursor back to the connection"""
+        if self._cursor is not None:
+            self._conn.release_cursor(self._sql, self._cursor)
+            self._cursor = self._sql = None
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class PooledConnection:
+    """Connection handed out by the pool; close() returns it to the pool"""
+
+    def __init__(self, pool, raw, statements=None):
+        self._pool = pool
+        self._raw = raw
+        self._closed = False
+        self._statements = statements
+        self._cursors = []
+
+    @property
+    def raw(self):
+        return self._raw
+
+    def cursor(self):
+        if self._statements is None:
+            return instrument(self._raw.cursor())
+        cursor = StatementCursor(self)
+        self._cursors.append(cursor)
+        return cursor
+
+    def statement_cursor(self, sql):
+        """The idle cursor that last ran sql on this connection, or a new one"""
+        return self._statements.take(sql) or instrument(self._raw.cursor())
+
+    def release_cursor(self, sql, cursor):
+        self._statements.give(sql, cursor)
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def close(self):
+        """Give the connection back to the pool instead of closing it"""
+        if not self._closed:
+            self._closed = True
+            for cursor in self._cursors:
+                cursor.close()
+            self._pool.release(self._raw)
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ConnectionPool:
+    """Thread-safe pool of database connections"""
+
+    def __init__(self, connect, max_size=POOL_SIZE, timeout=POOL_TIMEOUT,
+                 idle_timeout=POOL_IDLE_TIMEOUT, ping_after=POOL_PING_AFTER,
+                 ping_query='SELECT 1', statement_cache=0):
+        """
+        connect is a callable returning a new DB-API connection.
+        Idle connections older than idle_timeout seconds are closed, and
+        connections idle longer than ping_after seconds are checked with
+        ping_query before being handed out. With statement_cache > 0 each
+        connection keeps up to that many cursors, one per statement.
+        """
+        self._connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.ping_after = ping_after
+        self.ping_query = ping_query
+        self.statement_cache = statement_cache
+
+        self._lock = threading.Condition(threading.Lock())
+        self._idle = deque()  # (connection, time returned to the pool)
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._created = 0
+        self._recycled = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._statements = {}  # id(connection) -> StatementCache
+
+    def acquire(self, timeout=None):
+        """Check out a connection, waiting up to timeout seconds for one"""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        while True:
+            raw, returned_at = None, None
+            with self._lock:
+                self._evict_idle()
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        logger.warning(f"Connection pool checkout timed out after {timeout}s")
+                        raise PoolTimeout(f"No database connection available after {timeout} seconds")
+                    self._waiting += 1
+                    try:
+                        self._lock.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+                    self._evict_idle()
+
+                if self._idle:
+                    raw, returned_at = self._idle.pop()
+                else:
+                    # Reserve the slot before connecting outside the lock
+                    self._size += 1
+                self._in_use += 1
+
+            if raw is None:
+                try:
+                    raw = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._size -= 1
+                        self._in_use -= 1
+                        self._lock.notify()
+                    raise
+                with self._lock:
+                    self._created += 1
+                    self._checkouts += 1
+                return PooledConnection(self, raw, self._statement_cache(raw))
+
+            if time.monotonic() - returned_at < self.ping_after or self._ping(raw):
+                with self._lock:
+                    self._checkouts += 1
+                return PooledConnection(self, raw, self._statement_cache(raw))
+
+            # Stale connection: throw it away and try again
+            logger.info("Discarding pooled connection that failed its health check")
+            self._discard(raw, in_use=True)
+
+    def _statement_cache(self, raw):
+        if self.statement_cache <= 0:
+            return None
+        with self._lock:
+            statements = self._statements.get(id(raw))
+            if statements is None:
+                statements = self._statements[id(raw)] = StatementCache(self.statement_cache)
+            return statements
+
+    def release(self, raw):
+        """Return a connection to the pool"""
+        try:
+            # Drop any uncommitted work so the next user gets a clean connection
+            raw.rollback()
+        except Exception:
+            self._discard(raw, in_use=True)
+            return
+
+        with self._lock:
+            self._in_use -= 1
+            self._idle.append((raw, time.monotonic()))
+            self._lock.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Context manager that checks out a connection and always returns it"""
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            raise
+        finally:
+            conn.close()
+
+    def stats(self):
+        """Return a snapshot of pool usage counters"""
+        with self._lock:
+            return {
+                'max_size': self.max_size,
+                'size': self._size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                'created': self._created,
+                'recycled': self._recycled,
+                'checkouts': self._checkouts,
+                'timeouts': self._timeouts,
+                'statements_prepared': sum(s.misses for s in self._statements.values()),
+                'statements_reused': sum(s.hits for s in self._statements.values()),
+            }
+
+    def close_all(self):
+        """Close every idle connection (connections in use are closed on return)"""
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            for raw, _ in idle:
+                self._statements.pop(id(raw), None)
+        for raw, _ in idle:
+            self._close_quietly(raw)
+
+    def _ping(self, raw):
+        try:
+            cursor = raw.cursor()
+            cursor.execute(self.ping_query)
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception as e:
+            logger.warning(f"Pooled connection health check failed: {str(e)}")
+            return False
+
+    def _evict_idle(self):
+        # Caller must hold the lock. The oldest idle connections sit at the left.
+        now = time.monotonic()
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            raw, _ = self._idle.popleft()
+            self._size -= 1
+            self._recycled += 1
+            self._statements.pop(id(raw), None)
+            self._close_quietly(raw)
+            self._lock.notify()
+
+    def _discard(self, raw, in_use=False):
+        with self._lock:
+            self._statements.pop(id(raw), None)
+        self._close_quietly(raw)
+        with self._lock:
+            self._size -= 1
+            if in_use:
+                self._in_use -= 1
+            self._recycled += 1
+            self._lock.notify()
+
+    def _close_quietly(self, raw):
+        # Callers drop the connection's cached cursors from _statements under the lock first
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the shared pool used by the web routes"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                backend = get_backend()
+                # sqlite3 caches prepared statements itself; pyodbc needs a cursor per statement
+                _pool = ConnectionPool(backend.connect, ping_query=backend.ping_query,
+                                       statement_cache=STATEMENT_CACHE_SIZE if backend.statement_cursors else 0)
+    return _pool
+
+
+def pool_stats():
+    """Statistics of the shared pool, for sizing POOL_SIZE"""
+    return get_pool().stats()
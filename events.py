@@ -0,0 +1,59 @@
+"""
+In-process event hooks for Sports Management System
+Write paths publish an event after they commit; caches and aggregates
+subscribe to it to stay in sync without polling the database
+"""
+
+import logging
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger('events')
+
+# Event names published by the routes
+TEAM_WRITTEN = 'team.written'
+VENUE_WRITTEN = 'venue.written'
+MATCH_UPDATED = 'match.updated'
+PLAYER_STATS_WRITTEN = 'player_stats.written'
+FAN_ENGAGEMENT_WRITTEN = 'fan_engagement.written'
+PHYSIO_RECORD_WRITTEN = 'physio_record.written'
+PLAYER_WRITTEN = 'player.written'
+USER_REGISTERED = 'user.registered'
+MATCH_CREATED = 'match.created'
+SEASON_SCHEDULED = 'season.scheduled'
+USER_ROLE_CHANGED = 'user.role_changed'
+SEASON_ARCHIVED = 'season.archived'
+SQUAD_SELECTED = 'squad.selected'
+
+_handlers = defaultdict(list)
+_lock = threading.Lock()
+
+
+def subscribe(event, handler=None):
+    """Register handler(**payload) for event; also usable as a decorator"""
+    def register(fn):
+        with _lock:
+            if fn not in _handlers[event]:
+                _handlers[event].append(fn)
+        return fn
+    if handler is not None:
+        return register(handler)
+    return register
+
+
+def unsubscribe(event, handler):
+    with _lock:
+        if handler in _handlers[event]:
+            _handlers[event].remove(handler)
+
+
+def publish(event, **payload):
+    """Call every handler for event. A failing handler is logged, not raised,
+    so a stale cache never turns a committed write into an error page."""
+    with _lock:
+        handlers = list(_handlers[event])
+    for handler in handlers:
+        try:
+            handler(**payload)
+        except Exception as e:
+            logger.error(f"Handler {handler.__name__} failed for {event}: {str(e)}")
@@ -0,0 +1,599 @@
+"""
+Fan engagement event store for Sports Management System
+Predictions, comments and check-ins are appended to a local write-ahead spool
+and buffered in memory, then written to FAN_ENGAGEMENT in batches (by size or
+by time) on a background thread. Events in the spool that never reached the
+database are replayed on start-up, so a crash loses nothing.
+
+Each process locks a spool of its own (engagement_spool.jsonl,
+engagement_spool.1.jsonl, ...), so processes never truncate or replay each
+other's events. A starting process also replays the spools of processes that
+have exited. A batch the database rejects is split until the rows that fail
+are found; the rest is written and those rows go to a quarantine file.
+
+Per-fan and per-match counters (comments, predictions, matches attended) are
+kept in memory and updated as events are recorded, instead of being counted
+on every request.
+
+Usage:
+    python fan_engagement.py flush     - replay the spool and write everything pending
+    python fan_engagement.py stats     - print buffer, spool and rollup counters
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import atexit
+import logging
+import threading
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import events
+from db_pool import get_pool
+from reference_cache import TTLCache
+from queries import register
+
+logger = logging.getLogger('fan_engagement')
+
+# Engagement settings (can be overridden from the environment)
+ENGAGEMENT_BATCH_SIZE = int(os.environ.get('ENGAGEMENT_BATCH_SIZE', 200))
+ENGAGEMENT_FLUSH_INTERVAL = float(os.environ.get('ENGAGEMENT_FLUSH_INTERVAL', 2))
+ENGAGEMENT_SPOOL = os.environ.get('ENGAGEMENT_SPOOL', 'engagement_spool.jsonl')
+ENGAGEMENT_FSYNC = os.environ.get('ENGAGEMENT_FSYNC', '1') == '1'
+ENGAGEMENT_QUARANTINE = os.environ.get('ENGAGEMENT_QUARANTINE')
+QUARANTINE_DIR = os.environ.get('QUARANTINE_DIR', './quarantine')
+# Events held in memory before new ones are turned away (the database is not keeping up)
+ENGAGEMENT_MAX_BUFFERED = int(os.environ.get('ENGAGEMENT_MAX_BUFFERED', 10000))
+# Passes a row may fail on its own, while nothing else is written, before it is quarantined
+ENGAGEMENT_MAX_ATTEMPTS = int(os.environ.get('ENGAGEMENT_MAX_ATTEMPTS', 5))
+ENGAGEMENT_MAX_BACKOFF = 60
+SPOOL_SLOTS = 64
+
+ENGAGEMENT_TYPES = ('Comment', 'Question', 'Prediction', 'Attendance')
+MAX_COMMENT_LENGTH = 1000
+MAX_PREDICTED_GOALS = 99
+_PREDICTION_RE = re.compile(r'^(\d{1,2})-(\d{1,2})$')
+
+INSERT_ENGAGEMENT_SQL = register('fan_engagement.insert_engagement', '''
+    INSERT INTO FAN_ENGAGEMENT (FanID, MatchID, Prediction, EngagementDate, EngagementType, Comment)
+    VALUES (?, ?, ?, ?, ?, ?)
+''')
+ENGAGEMENT_EXISTS_SQL = register('fan_engagement.engagement_exists', '''
+    SELECT COUNT(*) FROM FAN_ENGAGEMENT
+    WHERE FanID = ? AND MatchID = ? AND EngagementType = ? AND EngagementDate = ?
+''')
+ROLLUP_SQL = register('fan_engagement.rollup', '''
+    SELECT FanID, MatchID, EngagementType, COUNT(*)
+    FROM FAN_ENGAGEMENT
+    GROUP BY FanID, MatchID, EngagementType
+''')
+
+
+class InvalidEngagement(ValueError):
+    """An engagement that fails validation; nothing is recorded"""
+
+
+class EngagementBacklog(InvalidEngagement):
+    """Too many events are waiting for the database; nothing is recorded"""
+
+
+class EngagementEvent:
+    """One FAN_ENGAGEMENT row waiting to be written"""
+
+    __slots__ = ('seq', 'fan_id', 'match_id', 'prediction', 'engagement_date', 'engagement_type', 'comment',
+                 'attempts')
+
+    def __init__(self, seq, fan_id, match_id, prediction, engagement_date, engagement_type, comment):
+        self.attempts = 0
+        self.seq = seq
+        self.fan_id = fan_id
+        self.match_id = match_id
+        self.prediction = prediction
+        self.engagement_date = engagement_date
+        self.engagement_type = engagement_type
+        self.comment = comment
+
+    def row(self):
+        return (self.fan_id, self.match_id, self.prediction, self.engagement_date,
+                self.engagement_type, self.comment)
+
+    def to_json(self):
+        return json.dumps({'seq': self.seq, 'fan_id': self.fan_id, 'match_id': self.match_id,
+                           'prediction': self.prediction, 'date': self.engagement_date.isoformat(),
+                           'type': self.engagement_type, 'comment': self.comment})
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data['seq'], data['fan_id'], data['match_id'], data['prediction'],
+                   datetime.fromisoformat(data['date']), data['type'], data['comment'])
+
+
+def _slot_path(path, slot):
+    # engagement_spool.jsonl, engagement_spool.1.jsonl, engagement_spool.2.jsonl, ...
+    if not slot:
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}.{slot}{extension}"
+
+
+def _try_lock(path):
+    """Open and lock path's lock file without waiting; None while another process holds it"""
+    lock_file = open(f"{path}.lock", 'a+')
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def _release(lock_file):
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+    finally:
+        lock_file.close()
+
+
+class Spool:
+    """
+    Append-only JSON-lines file of recorded events. After a batch is committed
+    a checkpoint line marks every event up to its sequence number as written;
+    the file is truncated whenever nothing is left pending. claim() picks the
+    first slot file no other live process has locked.
+    """
+
+    def __init__(self, path, fsync=ENGAGEMENT_FSYNC):
+        self.base_path = path
+        self.path = path
+        self.fsync = fsync
+        self._file = None
+        self._lock_file = None
+
+    def claim(self):
+        """Lock the first free slot for this process and spool to it"""
+        for slot in range(SPOOL_SLOTS):
+            path = _slot_path(self.base_path, slot)
+            lock_file = _try_lock(path)
+            if lock_file is not None:
+                self.path, self._lock_file = path, lock_file
+                return path
+        raise RuntimeError(f"All {SPOOL_SLOTS} engagement spool slots of {self.base_path} are in use")
+
+    def orphans(self):
+        """(path, lock file) of each other slot's spool whose process has exited; release() the lock when done"""
+        for slot in range(SPOOL_SLOTS):
+            path = _slot_path(self.base_path, slot)
+            if path == self.path or not os.path.exists(path):
+                continue
+            lock_file = _try_lock(path)
+            if lock_file is not None:
+                yield path, lock_file
+
+    def _open(self):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        return self._file
+
+    def _sync(self):
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def append(self, events_):
+        f = self._open()
+        for event in events_:
+            f.write(event.to_json() + '\n')
+        self._sync()
+
+    def checkpoint(self, seq, pending):
+        if not pending:
+            # Nothing left to replay: start an empty file
+            self._open().truncate(0)
+            self._sync()
+            return
+        self._open().write(json.dumps({'checkpoint': seq}) + '\n')
+        self._sync()
+
+    def recover(self, path=None):
+        """Events after the last checkpoint of this spool (or the spool at path), plus the highest sequence number"""
+        path = path or self.path
+        if not os.path.exists(path):
+            return [], 0
+        pending, checkpoint, last_seq = {}, 0, 0
+        with open(path, encoding='utf-8') as f:
+            for number, line in enumerate(f, 1):
+                try:
+                    data = json.loads(line)
+                except ValueError:
+                    # A torn last line from a crash mid-write; the event was never acknowledged
+                    logger.warning(f"Skipping unreadable spool line {number} in {path}")
+                    continue
+                if 'checkpoint' in data:
+                    checkpoint = max(checkpoint, data['checkpoint'])
+                    continue
+                event = EngagementEvent.from_json(data)
+                pending[event.seq] = event
+                last_seq = max(last_seq, event.seq)
+        return [pending[seq] for seq in sorted(pending) if seq > checkpoint], last_seq
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._lock_file is not None:
+            _release(self._lock_file)
+            self._lock_file = None
+
+
+class EngagementRollup:
+    """Counters for one fan or one match"""
+
+    __slots__ = ('comments', 'questions', 'predictions', 'attendance', 'matches_attended', 'total')
+
+    def __init__(self):
+        self.comments = 0
+        self.questions = 0
+        self.predictions = 0
+        self.attendance = 0
+        self.matches_attended = 0
+        self.total = 0
+
+    def add(self, engagement_type, count=1):
+        self.total += count
+        if engagement_type == 'Comment':
+            self.comments += count
+        elif engagement_type == 'Question':
+            self.questions += count
+        elif engagement_type == 'Prediction':
+            self.predictions += count
+        elif engagement_type == 'Attendance':
+            self.attendance += count
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class EngagementStore:
+    """Buffered, spooled writer for FAN_ENGAGEMENT with in-memory rollups"""
+
+    def __init__(self, spool_path=ENGAGEMENT_SPOOL, batch_size=ENGAGEMENT_BATCH_SIZE,
+                 flush_interval=ENGAGEMENT_FLUSH_INTERVAL, quarantine_path=ENGAGEMENT_QUARANTINE):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.quarantine_path = quarantine_path or os.path.join(
+            QUARANTINE_DIR, f"quarantine_engagement_{datetime.now():%Y%m%d_%H%M%S}_{os.getpid()}.jsonl")
+        self._quarantine = None
+        self._spool = Spool(spool_path)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._buffer = []
+        self._in_flight = []
+        self._replay_through = 0  # events up to this seq came from the spool and may be written already
+        self._seq = 0
+        self._fans = {}
+        self._matches = {}
+        self._attended = set()  # (FanID, MatchID) pairs with an Attendance event
+        self._built = False
+        self._fan_ids = TTLCache(maxsize=10000, ttl=300)
+        self._thread = None
+        self.written = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.quarantined = 0
+
+    def start(self):
+        """Claim a spool, replay it and any spools left by exited processes, and start the background flusher"""
+        with self._lock:
+            if self._thread is not None:
+                return self
+            self._spool.claim()
+            recovered, self._seq = self._spool.recover()
+            for path, lock_file in self._spool.orphans():
+                try:
+                    adopted, _ = self._spool.recover(path)
+                    # Renumbered into this spool before the orphan is removed, so a crash here loses nothing
+                    for event in adopted:
+                        self._seq += 1
+                        event.seq = self._seq
+                    if adopted:
+                        self._spool.append(adopted)
+                        recovered += adopted
+                        logger.info(f"Adopted {len(adopted)} engagement events from {path}")
+                    os.remove(path)
+                finally:
+                    _release(lock_file)
+            if recovered:
+                logger.info(f"Replaying {len(recovered)} engagement events from {self._spool.path}")
+                self._buffer = recovered + self._buffer
+                self._replay_through = recovered[-1].seq
+            self._thread = threading.Thread(target=self._run, name='engagement-flush', daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        delay = self.flush_interval
+        while True:
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                delay = self.flush_interval
+            except Exception as e:
+                # The batch stays buffered (and spooled) and is retried, less often while the database is down
+                delay = min(delay * 2, ENGAGEMENT_MAX_BACKOFF)
+                logger.error(f"Engagement flush failed, retrying in {delay:.0f}s: {str(e)}")
+
+    def close(self):
+        self.flush()
+        self._spool.close()
+        if self._quarantine is not None:
+            self._quarantine.close()
+            self._quarantine = None
+
+    def record(self, fan_id, match_id, engagement_type, prediction=None, comment=None, when=None):
+        """Validate and record one engagement; it reaches the database with the next batch"""
+        engagement_type = engagement_type if engagement_type in ENGAGEMENT_TYPES else None
+        if engagement_type is None:
+            raise InvalidEngagement(f"Engagement type must be one of {', '.join(ENGAGEMENT_TYPES)}")
+        comment = (comment or '').strip() or None
+        if comment and len(comment) > MAX_COMMENT_LENGTH:
+            raise InvalidEngagement(f"Comments are limited to {MAX_COMMENT_LENGTH} characters")
+        if engagement_type in ('Comment', 'Question') and not comment:
+            raise InvalidEngagement('Please enter a comment.')
+        if engagement_type == 'Prediction' and not prediction:
+            raise InvalidEngagement('Please enter a score prediction.')
+        if prediction is not None and not _PREDICTION_RE.match(str(prediction)):
+            raise InvalidEngagement(f"Predictions are a score like 2-1, at most {MAX_PREDICTED_GOALS} goals a side")
+
+        if engagement_type == 'Attendance':
+            self._ensure_built()
+
+        with self._lock:
+            if engagement_type == 'Attendance' and (fan_id, match_id) in self._attended:
+                raise InvalidEngagement('You have already checked in to this match.')
+            if len(self._buffer) >= ENGAGEMENT_MAX_BUFFERED:
+                raise EngagementBacklog('We cannot take more right now, please try again in a minute.')
+            self._seq += 1
+            event = EngagementEvent(self._seq, fan_id, match_id, prediction,
+                                    when or datetime.now(), engagement_type, comment)
+            # The spool write comes first: once record() returns, the event survives a crash
+            self._spool.append([event])
+            self._buffer.append(event)
+            if self._built:
+                self._count(fan_id, match_id, engagement_type)
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self._wakeup.set()
+        return event
+
+    def flush(self):
+        """Write everything buffered so far; returns the number of events written"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+                self._in_flight = batch
+            if not batch:
+                return 0
+            written, retry, error = self._write(batch)
+            if error is not None:
+                raise error
+            if retry:
+                raise RuntimeError(f"{len(retry)} engagement events were rejected and will be retried")
+            return written
+
+    def _write(self, batch):
+        written, failed, error = [], [], None
+        try:
+            pool = get_pool()
+            with pool.connection() as conn:
+                self._write_part(conn, conn.cursor(), batch, written, failed, pool.ping_query)
+        except Exception as e:
+            # The database went away: whatever was not committed goes back; the spool still has it
+            error = e
+
+        # A row that failed while the database answered is bad once others got through, or after a few passes
+        retry = []
+        for event, e in failed:
+            event.attempts += 1
+            if written or event.attempts >= ENGAGEMENT_MAX_ATTEMPTS:
+                self._quarantine_event(event, e)
+            else:
+                retry.append(event)
+        if error is not None:
+            done = {id(event) for event in written} | {id(event) for event, _ in failed}
+            retry += [event for event in batch if id(event) not in done]
+            retry.sort(key=lambda event: event.seq)
+
+        with self._lock:
+            self._in_flight = []
+            self._buffer[:0] = retry
+            if batch[-1].seq >= self._replay_through and \
+                    not any(event.seq <= self._replay_through for event in retry):
+                self._replay_through = 0
+            if written or len(retry) < len(batch):
+                self.batches += 1
+                try:
+                    # Everything before the oldest event still pending was written or quarantined
+                    pending = min((event.seq for event in self._buffer), default=None)
+                    self._spool.checkpoint(batch[-1].seq if pending is None else pending - 1,
+                                           pending=pending is not None)
+                except OSError as e:
+                    # The rows are committed; a replay after a crash skips them
+                    logger.warning(f"Could not checkpoint {self._spool.path}: {str(e)}")
+        if written:
+            events.publish(events.FAN_ENGAGEMENT_WRITTEN,
+                           match_ids=sorted({event.match_id for event in written}),
+                           fan_ids=sorted({event.fan_id for event in written}))
+        return len(written), retry, error
+
+    def _write_part(self, conn, cursor, part, written, failed, ping_query):
+        # Commit part, halving it while it fails, until the rows the database rejects are found
+        # A crash between commit and checkpoint leaves written events in the spool
+        rows = [event.row() for event in part
+                if event.seq > self._replay_through or not self._exists(cursor, event.row())]
+        try:
+            if rows:
+                cursor.executemany(INSERT_ENGAGEMENT_SQL, rows)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            with self._lock:
+                self.failed_batches += 1
+            if len(part) > 1:
+                middle = len(part) // 2
+                self._write_part(conn, cursor, part[:middle], written, failed, ping_query)
+                self._write_part(conn, cursor, part[middle:], written, failed, ping_query)
+                return
+            # Raises if the connection is gone rather than the row bad
+            cursor.execute(ping_query)
+            cursor.fetchall()
+            failed.append((part[0], e))
+            return
+        with self._lock:
+            self.written += len(rows)
+        written.extend(part)
+
+    def _quarantine_event(self, event, error):
+        logger.error(f"Engagement event {event.seq} was rejected and quarantined: {str(error)}")
+        if self._quarantine is None:
+            os.makedirs(os.path.dirname(self.quarantine_path) or '.', exist_ok=True)
+            self._quarantine = open(self.quarantine_path, 'a', encoding='utf-8')
+        self._quarantine.write(json.dumps({'reason': str(error), 'row': json.loads(event.to_json())}) + '\n')
+        self._quarantine.flush()
+        with self._lock:
+            self.quarantined += 1
+            if self._built:
+                self._uncount(event.fan_id, event.match_id, event.engagement_type)
+
+    @staticmethod
+    def _exists(cursor, row):
+        fan_id, match_id, _, engagement_date, engagement_type, _ = row
+        cursor.execute(ENGAGEMENT_EXISTS_SQL, (fan_id, match_id, engagement_type, engagement_date))
+        return cursor.fetchone()[0] > 0
+
+    def _count(self, fan_id, match_id, engagement_type, count=1):
+        fan = self._fans.get(fan_id)
+        if fan is None:
+            fan = self._fans[fan_id] = EngagementRollup()
+        match = self._matches.get(match_id)
+        if match is None:
+            match = self._matches[match_id] = EngagementRollup()
+        fan.add(engagement_type, count)
+        match.add(engagement_type, count)
+        if engagement_type == 'Attendance' and (fan_id, match_id) not in self._attended:
+            self._attended.add((fan_id, match_id))
+            fan.matches_attended += 1
+            match.matches_attended += 1
+
+    def _uncount(self, fan_id, match_id, engagement_type):
+        # Take back an event that will never be written
+        self._count(fan_id, match_id, engagement_type, -1)
+        if engagement_type == 'Attendance' and (fan_id, match_id) in self._attended:
+            self._attended.discard((fan_id, match_id))
+            self._fans[fan_id].matches_attended -= 1
+            self._matches[match_id].matches_attended -= 1
+
+    def rebuild(self):
+        """Recompute the rollups from FAN_ENGAGEMENT plus the events not yet written"""
+        # No batch may commit while counting, or its events would be counted twice
+        with self._flush_lock, get_pool().connection() as conn:
+            cursor = conn.cursor()
+            with self._lock:
+                cursor.execute(ROLLUP_SQL)
+                rows = cursor.fetchall()
+                self._fans, self._matches, self._attended = {}, {}, set()
+                for fan_id, match_id, engagement_type, count in rows:
+                    self._count(fan_id, match_id, engagement_type, count)
+                for event in self._buffer:
+                    self._count(event.fan_id, event.match_id, event.engagement_type)
+                self._built = True
+        logger.info(f"Engagement rollups rebuilt for {len(self._fans)} fans and {len(self._matches)} matches")
+
+    def _ensure_built(self):
+        if not self._built:
+            self.rebuild()
+
+    def fan_stats(self, fan_id):
+        """Counters for one fan (the stats card on the fan dashboard)"""
+        self._ensure_built()
+        with self._lock:
+            rollup = self._fans.get(fan_id)
+            return rollup.as_dict() if rollup else EngagementRollup().as_dict()
+
+    def match_stats(self, match_id):
+        """Counters for one match"""
+        self._ensure_built()
+        with self._lock:
+            rollup = self._matches.get(match_id)
+            return rollup.as_dict() if rollup else EngagementRollup().as_dict()
+
+    def fan_id(self, user_id):
+        """FanID for a logged-in user (cached), or None"""
+        fan_id = self._fan_ids.get(user_id)
+        if fan_id is None:
+            with get_pool().connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT FanID FROM FANS WHERE UserID = ?', (user_id,))
+                row = cursor.fetchone()
+            if row is None:
+                return None
+            fan_id = row[0]
+            self._fan_ids.set(user_id, fan_id)
+        return fan_id
+
+    def stats(self):
+        with self._lock:
+            return {'buffered': len(self._buffer), 'in_flight': len(self._in_flight),
+                    'written': self.written, 'batches': self.batches,
+                    'failed_batches': self.failed_batches, 'quarantined': self.quarantined,
+                    'quarantine': self.quarantine_path if self.quarantined else None, 'last_seq': self._seq,
+                    'spool': self._spool.path, 'rollups_built': self._built,
+                    'fans': len(self._fans), 'matches': len(self._matches)}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_engagement_store():
+    """The process-wide store, started (spool replayed, flusher running) on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = EngagementStore().start()
+                atexit.register(store.close)
+                _store = store
+    return _store
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if len(sys.argv) < 2 or sys.argv[1] not in ('flush', 'stats'):
+        print("Usage: python fan_engagement.py flush|stats")
+        sys.exit(1)
+    store = get_engagement_store()
+    if sys.argv[1] == 'flush':
+        started = time.perf_counter()
+        written = store.flush()
+        print(f"Wrote {written} buffered events in {time.perf_counter() - started:.2f}s")
+    else:
+        store.rebuild()
+        print(json.dumps(store.stats(), indent=2))
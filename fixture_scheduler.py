@@ -0,0 +1,387 @@
+"""
+Fixture scheduling for Sports Management System
+Generates a round-robin (or double round-robin) season and places each fixture
+on a match day, kick-off time and venue that respect venue availability,
+blackout dates and the minimum rest between a team's matches. Conflicts are
+checked against in-memory interval indexes per team and per venue, loaded from
+MATCHES with one query, and the season is written in one bulk insert.
+
+Usage:
+    python fixture_scheduler.py 2027-08-07 [--single] [--teams 1,2,3] [--rest-days 3]
+                                [--match-days sat,sun] [--kickoffs 15:00,19:45]
+                                [--blackout 2027-12-25,2028-01-01] [--dry-run]
+"""
+
+import os
+import sys
+import time
+import bisect
+import logging
+import argparse
+from datetime import datetime, date, time as dtime, timedelta
+
+import events
+from db_pool import get_pool
+from queries import MATCH_INSERT, register
+from season_archive import get_archive
+
+logger = logging.getLogger('scheduler')
+
+# Scheduling defaults (can be overridden from the environment)
+MIN_REST_DAYS = int(os.environ.get('SCHEDULE_MIN_REST_DAYS', 3))
+MATCH_DURATION = timedelta(minutes=int(os.environ.get('SCHEDULE_MATCH_MINUTES', 120)))
+VENUE_TURNAROUND = timedelta(minutes=int(os.environ.get('SCHEDULE_VENUE_TURNAROUND_MINUTES', 180)))
+HORIZON_DAYS = int(os.environ.get('SCHEDULE_HORIZON_DAYS', 366))
+
+WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+BOOKED_MATCHES_SQL = register('scheduler.booked_matches', '''
+    SELECT HomeTeamID, AwayTeamID, VenueID, MatchDateTime
+    FROM MATCHES
+    WHERE MatchDateTime >= ? AND MatchDateTime < ? AND Status <> 'Cancelled'
+''')
+HOME_VENUES_SQL = register('scheduler.home_venues', '''
+    SELECT HomeTeamID, VenueID, COUNT(*)
+    FROM MATCHES
+    GROUP BY HomeTeamID, VenueID
+''')
+
+
+class SchedulingError(Exception):
+    """Raised when the fixtures cannot all be placed within the horizon"""
+
+
+class ScheduleRules:
+    """When and how far apart matches may be played"""
+
+    def __init__(self, start, match_days=(5, 6), kickoffs=(dtime(15, 0), dtime(19, 45)),
+                 min_rest_days=MIN_REST_DAYS, blackout_dates=(), venue_blackouts=None,
+                 match_duration=MATCH_DURATION, venue_turnaround=VENUE_TURNAROUND,
+                 horizon_days=HORIZON_DAYS):
+        self.start = start
+        self.match_days = frozenset(match_days)
+        self.kickoffs = sorted(kickoffs)
+        self.min_rest = timedelta(days=min_rest_days)
+        self.blackout_dates = frozenset(blackout_dates)
+        self.venue_blackouts = {venue_id: frozenset(dates) for venue_id, dates in (venue_blackouts or {}).items()}
+        self.match_duration = match_duration
+        self.venue_turnaround = venue_turnaround
+        self.horizon = start + timedelta(days=horizon_days)
+
+    def playable(self, day):
+        return day.weekday() in self.match_days and day not in self.blackout_dates
+
+    def venue_open(self, venue_id, day):
+        return day not in self.venue_blackouts.get(venue_id, ())
+
+
+class IntervalIndex:
+    """
+    Sorted [start, end) intervals per key (a team or a venue). Intervals of one
+    key do not overlap, so the one starting last before a query's end is the
+    only candidate for a conflict: each check is a single bisect.
+    """
+
+    def __init__(self):
+        self._starts = {}
+        self._ends = {}
+
+    def add(self, key, start, end):
+        starts = self._starts.setdefault(key, [])
+        ends = self._ends.setdefault(key, [])
+        i = bisect.bisect_left(starts, start)
+        starts.insert(i, start)
+        ends.insert(i, end)
+
+    def overlaps(self, key, start, end):
+        starts = self._starts.get(key)
+        if not starts:
+            return False
+        i = bisect.bisect_left(starts, end)
+        return i > 0 and self._ends[key][i - 1] > start
+
+    def __len__(self):
+        return sum(len(starts) for starts in self._starts.values())
+
+
+class FixtureIndex:
+    """Booked matches by team and by venue, for conflict checks without queries"""
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.teams = IntervalIndex()
+        self.venues = IntervalIndex()
+
+    def load(self, cursor, since, until):
+        """Add the matches already in MATCHES between since and until"""
+        # Matches just outside the window still count towards rest days and venue turnaround
+        margin = self.rules.min_rest + self.rules.match_duration + self.rules.venue_turnaround
+        cursor.execute(BOOKED_MATCHES_SQL, (since - margin, until + margin))
+        rows = cursor.fetchall()
+        for home_team_id, away_team_id, venue_id, kickoff in rows:
+            self.add(home_team_id, away_team_id, venue_id, kickoff)
+        return len(rows)
+
+    def add(self, home_team_id, away_team_id, venue_id, kickoff):
+        end = kickoff + self.rules.match_duration
+        self.teams.add(home_team_id, kickoff, end)
+        self.teams.add(away_team_id, kickoff, end)
+        self.venues.add(venue_id, kickoff, end + self.rules.venue_turnaround)
+
+    def team_free(self, team_id, kickoff):
+        rest = self.rules.min_rest
+        return not self.teams.overlaps(team_id, kickoff - rest, kickoff + self.rules.match_duration + rest)
+
+    def venue_free(self, venue_id, kickoff):
+        rules = self.rules
+        if not rules.venue_open(venue_id, kickoff.date()):
+            return False
+        # Bookings include the turnaround, so the venue is cleared before the next kick-off
+        return not self.venues.overlaps(venue_id, kickoff, kickoff + rules.match_duration + rules.venue_turnaround)
+
+    def conflicts(self, home_team_id, away_team_id, venue_id, kickoff):
+        """Reasons the match cannot be played at kickoff (empty when it can)"""
+        rest_days = self.rules.min_rest.days
+        reasons = []
+        if kickoff.date() in self.rules.blackout_dates:
+            reasons.append(f"{kickoff.date()} is a blackout date")
+        for label, team_id in (('Home', home_team_id), ('Away', away_team_id)):
+            if not self.team_free(team_id, kickoff):
+                reasons.append(f"{label} team plays another match within {rest_days} days")
+        if not self.venue_free(venue_id, kickoff):
+            reasons.append('Venue is not available at that time')
+        return reasons
+
+
+class Fixture:
+    """One scheduled match"""
+
+    __slots__ = ('round', 'home_team_id', 'away_team_id', 'kickoff', 'venue_id')
+
+    def __init__(self, round_number, home_team_id, away_team_id, kickoff, venue_id):
+        self.round = round_number
+        self.home_team_id = home_team_id
+        self.away_team_id = away_team_id
+        self.kickoff = kickoff
+        self.venue_id = venue_id
+
+    def row(self):
+        return (self.home_team_id, self.away_team_id, self.kickoff, self.venue_id, 'Scheduled')
+
+
+def round_robin(team_ids, double=True):
+    """Rounds of (home, away) pairs by the circle method; home and away alternate"""
+    teams = list(team_ids)
+    if len(teams) % 2:
+        teams.append(None)  # bye
+    n = len(teams)
+    rounds = []
+    for r in range(n - 1):
+        pairs = []
+        for i in range(n // 2):
+            home, away = teams[i], teams[n - 1 - i]
+            if home is not None and away is not None:
+                pairs.append((home, away) if (r + i) % 2 else (away, home))
+        rounds.append(pairs)
+        teams.insert(1, teams.pop())
+    if double:
+        rounds += [[(away, home) for home, away in pairs] for pairs in rounds]
+    return rounds
+
+
+class FixtureScheduler:
+    """Places the fixtures of each round on the earliest slot that has no conflict"""
+
+    def __init__(self, rules, index, venue_ids, home_venues=None):
+        self.rules = rules
+        self.index = index
+        self.venue_ids = list(venue_ids)
+        self.home_venues = home_venues or {}
+        # Teams without a home ground borrow the venues nobody else calls home first
+        homes = set(self.home_venues.values())
+        self._neutral = [v for v in self.venue_ids if v not in homes] + [v for v in self.venue_ids if v in homes]
+
+    def _days(self, first):
+        day = first
+        while day <= self.rules.horizon:
+            if self.rules.playable(day):
+                yield day
+            day += timedelta(days=1)
+
+    def _place(self, home_team_id, away_team_id, day):
+        index = self.index
+        venues = [self.home_venues[home_team_id]] if home_team_id in self.home_venues else self._neutral
+        for kickoff_time in self.rules.kickoffs:
+            kickoff = datetime.combine(day, kickoff_time)
+            if not (index.team_free(home_team_id, kickoff) and index.team_free(away_team_id, kickoff)):
+                continue
+            for venue_id in venues:
+                if index.venue_free(venue_id, kickoff):
+                    return kickoff, venue_id
+        return None
+
+    def schedule(self, rounds):
+        """Fixtures for rounds of (home, away) pairs, in kick-off order"""
+        if not self.venue_ids:
+            raise SchedulingError('There are no venues to schedule matches at')
+        fixtures = []
+        round_start = self.rules.start
+        for number, pairs in enumerate(rounds, 1):
+            pending = list(pairs)
+            first_day = None
+            for day in self._days(round_start):
+                still_pending = []
+                for home_team_id, away_team_id in pending:
+                    slot = self._place(home_team_id, away_team_id, day)
+                    if slot is None:
+                        still_pending.append((home_team_id, away_team_id))
+                        continue
+                    kickoff, venue_id = slot
+                    self.index.add(home_team_id, away_team_id, venue_id, kickoff)
+                    fixtures.append(Fixture(number, home_team_id, away_team_id, kickoff, venue_id))
+                    first_day = first_day or day
+                pending = still_pending
+                if not pending:
+                    break
+            if pending:
+                raise SchedulingError(f"Round {number} does not fit before {self.rules.horizon}: "
+                                      f"{len(pending)} fixtures left; allow more match days or fewer rest days")
+            # The next round may begin while this one finishes; rest days keep teams apart
+            round_start = first_day or round_start
+        fixtures.sort(key=lambda fixture: (fixture.kickoff, fixture.venue_id))
+        return fixtures
+
+
+def home_venues(cursor):
+    """Each team's most used home venue, from the matches already played"""
+    cursor.execute(HOME_VENUES_SQL)
+    best = {}
+    for team_id, venue_id, count in cursor.fetchall():
+        if count > best.get(team_id, (None, 0))[1]:
+            best[team_id] = (venue_id, count)
+    return {team_id: venue_id for team_id, (venue_id, _) in best.items()}
+
+
+def write_fixtures(conn, fixtures):
+    """Insert every fixture in one transaction"""
+    cursor = conn.cursor()
+    try:
+        cursor.executemany(MATCH_INSERT, [fixture.row() for fixture in fixtures])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def schedule_season(team_ids, rules, double=True, dry_run=False):
+    """Generate, place and (unless dry_run) insert a season; returns (fixtures, summary)"""
+    team_ids = sorted(set(team_ids))
+    if len(team_ids) < 2:
+        raise SchedulingError('A season needs at least two teams')
+    # Matches before the boundary are read from the snapshots only, so new ones there would never show
+    boundary = get_archive().boundary()
+    if boundary is not None and datetime.combine(rules.start, dtime.min) < boundary:
+        raise SchedulingError(f"The season cannot start before {boundary:%d %b %Y}: "
+                              f"earlier seasons are archived")
+    started = time.perf_counter()
+    with get_pool().connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT VenueID FROM VENUES')
+        venue_ids = [row[0] for row in cursor.fetchall()]
+        known_homes = home_venues(cursor)
+        index = FixtureIndex(rules)
+        booked = index.load(cursor, datetime.combine(rules.start, dtime.min),
+                            datetime.combine(rules.horizon, dtime.max))
+
+        scheduler = FixtureScheduler(rules, index, venue_ids,
+                                     {team_id: known_homes[team_id] for team_id in team_ids if team_id in known_homes})
+        rounds = round_robin(team_ids, double)
+        fixtures = scheduler.schedule(rounds)
+        placed = time.perf_counter()
+
+        if not dry_run:
+            write_fixtures(conn, fixtures)
+
+    summary = {
+        'teams': len(team_ids),
+        'rounds': len(rounds),
+        'matches': len(fixtures),
+        'first_kickoff': fixtures[0].kickoff if fixtures else None,
+        'last_kickoff': fixtures[-1].kickoff if fixtures else None,
+        'already_booked': booked,
+        'schedule_seconds': round(placed - started, 3),
+        'total_seconds': round(time.perf_counter() - started, 3),
+        'written': not dry_run,
+    }
+    logger.info(f"Scheduled {len(fixtures)} matches for {len(team_ids)} teams in {summary['total_seconds']}s")
+    if fixtures and not dry_run:
+        events.publish(events.SEASON_SCHEDULED, matches=len(fixtures), teams=len(team_ids),
+                       first_kickoff=summary['first_kickoff'], last_kickoff=summary['last_kickoff'])
+    return fixtures, summary
+
+
+def match_conflicts(cursor, home_team_id, away_team_id, venue_id, kickoff, rules=None):
+    """Conflicts for one proposed match, checked against the matches booked around it"""
+    rules = rules or ScheduleRules(kickoff.date())
+    index = FixtureIndex(rules)
+    index.load(cursor, kickoff, kickoff)
+    return index.conflicts(home_team_id, away_team_id, venue_id, kickoff)
+
+
+def parse_match_days(value):
+    """'sat,sun' -> {5, 6}"""
+    days = set()
+    for name in value.split(','):
+        name = name.strip().lower()[:3]
+        if name not in WEEKDAYS:
+            raise ValueError(f"Unknown match day: {name!r}")
+        days.add(WEEKDAYS.index(name))
+    return days
+
+
+def parse_kickoffs(value):
+    """'15:00,19:45' -> [time(15, 0), time(19, 45)]"""
+    return [dtime.fromisoformat(part.strip()) for part in value.split(',') if part.strip()]
+
+
+def parse_dates(value):
+    """'2027-12-25, 2028-01-01' -> {date, date}"""
+    return {date.fromisoformat(part.strip()) for part in (value or '').replace('\n', ',').split(',') if part.strip()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a round-robin season')
+    parser.add_argument('start', type=date.fromisoformat, help='first possible match day (YYYY-MM-DD)')
+    parser.add_argument('--single', action='store_true', help='single round-robin (default: double)')
+    parser.add_argument('--teams', help='comma separated TeamIDs (default: every team)')
+    parser.add_argument('--rest-days', type=int, default=MIN_REST_DAYS)
+    parser.add_argument('--match-days', default='sat,sun')
+    parser.add_argument('--kickoffs', default='15:00,19:45')
+    parser.add_argument('--blackout', default='', help='comma separated dates without matches')
+    parser.add_argument('--dry-run', action='store_true', help='schedule without writing')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if args.teams:
+        team_ids = [int(team_id) for team_id in args.teams.split(',')]
+    else:
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT TeamID FROM TEAMS')
+            team_ids = [row[0] for row in cursor.fetchall()]
+
+    rules = ScheduleRules(args.start, match_days=parse_match_days(args.match_days),
+                          kickoffs=parse_kickoffs(args.kickoffs), min_rest_days=args.rest_days,
+                          blackout_dates=parse_dates(args.blackout))
+    try:
+        fixtures, summary = schedule_season(team_ids, rules, double=not args.single, dry_run=args.dry_run)
+    except SchedulingError as e:
+        print(f"Error: {e}")
+        return 1
+    for key, value in summary.items():
+        print(f"{key:>16}: {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""
+Rendered-fragment cache for match pages
+Keeps the rendered header, stats table and engagement feed of each match,
+keyed by match, viewer role and a per-fragment version. Write paths publish
+events that bump only the versions they affect, and the versions also give
+the page its ETag / Last-Modified so unchanged pages can be answered with 304.
+"""
+
+import os
+import uuid
+import threading
+from itertools import count
+from datetime import datetime, timezone
+
+import events
+from reference_cache import TTLCache
+
+FRAGMENT_CACHE_TTL = float(os.environ.get('FRAGMENT_CACHE_TTL', 600))
+FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE', 5000))
+
+FRAGMENTS = ('header', 'stats', 'engagement')
+
+# Versions come from one process-wide counter, and ETags carry a per-process
+# token, so a version is never reused - even after its state was evicted
+_versions = count(1)
+_BOOT = uuid.uuid4().hex[:8]
+
+
+class MatchState:
+    """Current fragment versions and last change time for one match"""
+
+    __slots__ = ('match_id', 'versions', 'last_modified')
+
+    def __init__(self, match_id):
+        self.match_id = match_id
+        self.versions = {name: next(_versions) for name in FRAGMENTS}
+        self.last_modified = _now()
+
+    def bump(self, names):
+        for name in names:
+            self.versions[name] = next(_versions)
+        self.last_modified = _now()
+
+    def etag(self, role, user_id):
+        # Role and user are part of the tag: the page shows per-viewer controls
+        versions = '.'.join(str(self.versions[name]) for name in FRAGMENTS)
+        return f"{_BOOT}-{self.match_id}-{versions}-{role}-{user_id}"
+
+    def not_modified(self, request, etag):
+        """True when the client's cached copy (If-None-Match / If-Modified-Since) is current"""
+        if request.if_none_match:
+            return request.if_none_match.contains_weak(etag)
+        if request.if_modified_since:
+            return self.last_modified <= request.if_modified_since
+        return False
+
+
+def _now():
+    # HTTP dates have one-second resolution
+    return datetime.now(timezone.utc).replace(microsecond=0)
+
+
+class FragmentCache:
+    """Rendered HTML fragments per (match, fragment, role, version)"""
+
+    def __init__(self, maxsize=FRAGMENT_CACHE_SIZE, ttl=FRAGMENT_CACHE_TTL):
+        self._fragments = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._states = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def state(self, match_id):
+        state = self._states.get(match_id)
+        if state is None:
+            with self._lock:
+                state = self._states.get(match_id)
+                if state is None:
+                    state = MatchState(match_id)
+                    self._states.set(match_id, state)
+        return state
+
+    def get(self, state, name, role):
+        return self._fragments.get((state.match_id, name, role, state.versions[name]))
+
+    def set(self, state, name, role, version, html):
+        """Store html rendered while state.versions[name] was version"""
+        self._fragments.set((state.match_id, name, role, version), html)
+
+    def invalidate(self, match_id, names=FRAGMENTS):
+        # No state means nothing was rendered (or it was evicted): a new state gets new versions
+        with self._lock:
+            state = self._states.get(match_id)
+            if state is not None:
+                state.bump(names)
+
+    def clear(self):
+        with self._lock:
+            self._states.clear()
+            self._fragments.clear()
+
+    def stats(self):
+        return {'states': self._states.stats(), 'fragments': self._fragments.stats()}
+
+
+_cache = FragmentCache()
+
+
+def get_fragment_cache():
+    return _cache
+
+
+def _on_match_updated(match_id, **payload):
+    # Score and status appear in every fragment (header, stats links, comment button)
+    _cache.invalidate(match_id)
+
+
+def _on_player_stats_written(match_ids=(), **payload):
+    for match_id in match_ids:
+        _cache.invalidate(match_id, ('stats',))
+
+
+def _on_fan_engagement_written(match_ids=(), **payload):
+    for match_id in match_ids:
+        _cache.invalidate(match_id, ('engagement',))
+
+
+def _on_reference_written(**payload):
+    # Team or venue names appear in every fragment
+    _cache.clear()
+
+
+events.subscribe(events.MATCH_UPDATED, _on_match_updated)
+events.subscribe(events.PLAYER_STATS_WRITTEN, _on_player_stats_written)
+events.subscribe(events.FAN_ENGAGEMENT_WRITTEN, _on_fan_engagement_written)
+events.subscribe(events.TEAM_WRITTEN, _on_reference_written)
+events.subscribe(events.VENUE_WRITTEN, _on_reference_written)
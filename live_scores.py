@@ -0,0 +1,430 @@
+"""
+Live score push for Sports Management System
+Score and status changes published by update_match (MATCH_UPDATED) are fanned
+out to connected browsers as Server-Sent Events. Each update becomes one small
+message built from the event payload, so pushing it never touches the database.
+
+Single process (the default, LIVE_SCORES_URL unset): pages poll
+/matches/live/poll every LIVE_POLL_SECONDS for the latest message of each
+Scheduled or Ongoing match they show. The ScoreHub keeps those messages, so a
+poll holds no thread and reads no table. The Flask SSE routes /matches/live
+and /matches/<id>/live remain for other clients. They close after
+LIVE_STREAM_SECONDS, or once a followed match is over, so an open tab does not
+hold a worker thread for long.
+
+Several processes: run a broker and an event-loop SSE server, and point the web
+workers at the broker with LIVE_BROKER_URL. The SSE server holds the idle
+browser connections (thousands per process) and LIVE_SCORES_URL tells the
+pages where to connect.
+
+Usage:
+    python live_scores.py broker [--host 127.0.0.1] [--port 8765]
+    python live_scores.py serve [--port 8001] [--broker tcp://127.0.0.1:8765]
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import socket
+import asyncio
+import logging
+import argparse
+import threading
+from collections import OrderedDict
+from itertools import count
+from urllib.parse import urlparse
+
+import events
+
+logger = logging.getLogger('live_scores')
+
+# Live update settings (can be overridden from the environment)
+LIVE_BROKER_URL = os.environ.get('LIVE_BROKER_URL', '')
+LIVE_SCORES_URL = os.environ.get('LIVE_SCORES_URL', '').rstrip('/')
+LIVE_HEARTBEAT = float(os.environ.get('LIVE_HEARTBEAT', 15))
+LIVE_QUEUE_SIZE = int(os.environ.get('LIVE_QUEUE_SIZE', 100))
+LIVE_ALLOW_ORIGIN = os.environ.get('LIVE_ALLOW_ORIGIN', '*')
+LIVE_POLL_SECONDS = float(os.environ.get('LIVE_POLL_SECONDS', 15))
+LIVE_STREAM_SECONDS = float(os.environ.get('LIVE_STREAM_SECONDS', 300))
+# Matches whose latest message is kept for polling pages
+LIVE_RECENT_MATCHES = int(os.environ.get('LIVE_RECENT_MATCHES', 1000))
+
+# Pages follow these matches; a match in FINISHED has nothing left to push
+LIVE_STATUSES = ('Scheduled', 'Ongoing')
+FINISHED = ('Completed', 'Cancelled')
+
+# Start from the clock, so IDs keep increasing across restarts and a poller's 'since' stays valid
+_message_ids = count(int(time.time() * 1000))
+
+
+def score_message(match_id, home_score, away_score, status, home_team_id=None, away_team_id=None, **payload):
+    """The delta sent to clients for one MATCH_UPDATED event"""
+    return {
+        'id': next(_message_ids),
+        'match_id': match_id,
+        'home_team_id': home_team_id,
+        'away_team_id': away_team_id,
+        'home_score': home_score,
+        'away_score': away_score,
+        'status': status,
+        'sent_at': time.time(),
+    }
+
+
+def format_sse(message, event='score'):
+    return f"id: {message['id']}\nevent: {event}\ndata: {json.dumps(message)}\n\n"
+
+
+HEARTBEAT = ': ping\n\n'
+
+
+class Subscription:
+    """One connected client of the ScoreHub; match_id None means every match"""
+
+    def __init__(self, match_id, maxsize=LIVE_QUEUE_SIZE):
+        self.match_id = match_id
+        self.queue = queue.Queue(maxsize)
+        self.dropped = 0
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class ScoreHub:
+    """Thread-safe in-process fan-out of score messages"""
+
+    def __init__(self, recent=LIVE_RECENT_MATCHES):
+        self._subscribers = {}  # match_id (or None) -> set of Subscription
+        self._latest = OrderedDict()  # match_id -> newest message, least recently updated first
+        self._recent = recent
+        self._lock = threading.Lock()
+        self.published = 0
+        self.last_id = 0
+        self.polls = 0
+
+    def subscribe(self, match_id=None):
+        subscription = Subscription(match_id)
+        with self._lock:
+            self._subscribers.setdefault(match_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.match_id)
+            if subscribers:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.match_id]
+
+    def publish(self, message):
+        with self._lock:
+            targets = list(self._subscribers.get(message['match_id'], ())) + list(self._subscribers.get(None, ()))
+            self.published += 1
+            self.last_id = max(self.last_id, message['id'])
+            self._latest[message['match_id']] = message
+            self._latest.move_to_end(message['match_id'])
+            while len(self._latest) > self._recent:
+                self._latest.popitem(last=False)
+        for subscription in targets:
+            try:
+                subscription.queue.put_nowait(message)
+            except queue.Full:
+                # A client that stopped reading loses updates rather than holding memory
+                subscription.dropped += 1
+
+    def updates(self, match_ids, since=0):
+        """Newest message of each of match_ids sent after message ID since, for a polling page"""
+        with self._lock:
+            self.polls += 1
+            messages = [self._latest.get(match_id) for match_id in match_ids]
+            return {'updates': [message for message in messages if message and message['id'] > since],
+                    'last_id': self.last_id}
+
+    def stats(self):
+        with self._lock:
+            return {'connections': sum(len(s) for s in self._subscribers.values()),
+                    'channels': len(self._subscribers), 'published': self.published,
+                    'polls': self.polls, 'recent_matches': len(self._latest)}
+
+
+def stream(hub, match_id=None, heartbeat=LIVE_HEARTBEAT, lifetime=LIVE_STREAM_SECONDS):
+    """
+    Generator of SSE text for a Flask streaming response. It ends after lifetime
+    seconds (the browser reconnects), or for one match once that match is over.
+    """
+    subscription = hub.subscribe(match_id)
+    deadline = time.monotonic() + lifetime
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            message = subscription.get(min(heartbeat, remaining))
+            if message is None:
+                yield HEARTBEAT
+                continue
+            yield format_sse(message)
+            if match_id is not None and message['status'] in FINISHED:
+                return
+    finally:
+        hub.unsubscribe(subscription)
+
+
+def _broker_address(url):
+    parsed = urlparse(url)
+    if parsed.scheme != 'tcp' or not parsed.hostname or not parsed.port:
+        raise ValueError(f"Broker URL must look like tcp://host:port, got {url!r}")
+    return parsed.hostname, parsed.port
+
+
+class BrokerPublisher:
+    """
+    Forwards messages to the broker from a background thread. publish() only
+    enqueues, so a slow or missing broker never delays a request; messages are
+    dropped while the broker is unreachable.
+    """
+
+    def __init__(self, url, maxsize=1000):
+        self.address = _broker_address(url)
+        self._queue = queue.Queue(maxsize)
+        self._thread = threading.Thread(target=self._run, name='live-broker', daemon=True)
+        self._thread.start()
+        self.dropped = 0
+
+    def publish(self, message):
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        sock = None
+        backoff = 0.5
+        while True:
+            message = self._queue.get()
+            line = (json.dumps(message) + '\n').encode('utf-8')
+            try:
+                if sock is None:
+                    sock = socket.create_connection(self.address, timeout=5)
+                    sock.sendall(b'PUB\n')
+                sock.sendall(line)
+                backoff = 0.5
+            except OSError as e:
+                logger.warning(f"Live score broker unavailable, dropping update: {str(e)}")
+                if sock is not None:
+                    sock.close()
+                    sock = None
+                self.dropped += 1
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 10)
+
+
+_hub = ScoreHub()
+_publisher = BrokerPublisher(LIVE_BROKER_URL) if LIVE_BROKER_URL else None
+
+
+def get_hub():
+    return _hub
+
+
+def stream_url(match_id=None):
+    """Where pages should open their EventSource; None when there is no live score server"""
+    if not LIVE_SCORES_URL:
+        return None
+    return f"{LIVE_SCORES_URL}/live/matches" + (f"/{match_id}" if match_id is not None else '')
+
+
+def live_feed(poll_url, match_id=None):
+    """How a page follows its live matches: the live score server's stream, or polling poll_url"""
+    url = stream_url(match_id)
+    if url:
+        return {'stream': url}
+    return {'poll': poll_url, 'interval': LIVE_POLL_SECONDS}
+
+
+def _on_match_updated(**payload):
+    message = score_message(**payload)
+    _hub.publish(message)
+    if _publisher is not None:
+        _publisher.publish(message)
+
+
+events.subscribe(events.MATCH_UPDATED, _on_match_updated)
+
+
+# ---------------------------------------------------------------------------
+# Broker and event-loop SSE server (separate processes)
+# ---------------------------------------------------------------------------
+
+class Broker:
+    """Line-based relay: PUB connections send JSON lines, SUB connections receive them"""
+
+    def __init__(self, max_buffer=1024 * 1024):
+        self.max_buffer = max_buffer
+        self.subscribers = set()
+
+    async def handle(self, reader, writer):
+        role = (await reader.readline()).strip()
+        if role == b'SUB':
+            self.subscribers.add(writer)
+            try:
+                await reader.read()  # wait until the subscriber disconnects
+            finally:
+                self.subscribers.discard(writer)
+                writer.close()
+            return
+        if role != b'PUB':
+            writer.close()
+            return
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            for subscriber in list(self.subscribers):
+                if subscriber.transport.get_write_buffer_size() > self.max_buffer:
+                    logger.warning("Dropping a live score subscriber that stopped reading")
+                    self.subscribers.discard(subscriber)
+                    subscriber.close()
+                    continue
+                subscriber.write(line)
+        writer.close()
+
+
+class SSEServer:
+    """Minimal HTTP server that keeps SSE clients as cheap coroutines on one event loop"""
+
+    def __init__(self, broker_url=None, heartbeat=LIVE_HEARTBEAT, queue_size=LIVE_QUEUE_SIZE):
+        self.broker_url = broker_url
+        self.heartbeat = heartbeat
+        self.queue_size = queue_size
+        self.channels = {}  # match_id (or None) -> set of asyncio.Queue
+        self.published = 0
+
+    def dispatch(self, message):
+        self.published += 1
+        targets = list(self.channels.get(message.get('match_id'), ())) + list(self.channels.get(None, ()))
+        for client in targets:
+            if client.full():
+                client.get_nowait()  # keep the newest updates for slow clients
+            client.put_nowait(message)
+
+    async def follow_broker(self):
+        host, port = _broker_address(self.broker_url)
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(host, port)
+                writer.write(b'SUB\n')
+                await writer.drain()
+                logger.info(f"Following live score broker at {self.broker_url}")
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    self.dispatch(json.loads(line))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Live score broker connection failed: {str(e)}")
+            await asyncio.sleep(2)
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass  # headers are not needed
+        except (ConnectionError, asyncio.IncompleteReadError):
+            writer.close()
+            return
+        path = request_line[1].split('?')[0].rstrip('/') if len(request_line) >= 2 else ''
+
+        if path == '/live/stats':
+            body = json.dumps(self.stats()).encode()
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                         b'Content-Length: ' + str(len(body)).encode() + b'\r\nConnection: close\r\n\r\n' + body)
+            await writer.drain()
+            writer.close()
+            return
+
+        parts = path.split('/')
+        if parts[:3] != ['', 'live', 'matches'] or len(parts) > 4 or (len(parts) == 4 and not parts[3].isdigit()):
+            writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            await writer.drain()
+            writer.close()
+            return
+        match_id = int(parts[3]) if len(parts) == 4 else None
+
+        client = asyncio.Queue(self.queue_size)
+        self.channels.setdefault(match_id, set()).add(client)
+        try:
+            writer.write(('HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n'
+                          'Cache-Control: no-cache\r\nConnection: keep-alive\r\n'
+                          f'Access-Control-Allow-Origin: {LIVE_ALLOW_ORIGIN}\r\n\r\n'
+                          'retry: 3000\n\n').encode())
+            await writer.drain()
+            while True:
+                try:
+                    message = await asyncio.wait_for(client.get(), self.heartbeat)
+                    writer.write(format_sse(message).encode())
+                except asyncio.TimeoutError:
+                    writer.write(HEARTBEAT.encode())
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            channel = self.channels.get(match_id)
+            if channel is not None:
+                channel.discard(client)
+                if not channel:
+                    del self.channels[match_id]
+            writer.close()
+
+    def stats(self):
+        return {'connections': sum(len(c) for c in self.channels.values()),
+                'channels': len(self.channels), 'published': self.published}
+
+
+async def _serve_broker(host, port):
+    broker = Broker()
+    server = await asyncio.start_server(broker.handle, host, port)
+    logger.info(f"Live score broker listening on {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+async def _serve_sse(host, port, broker_url):
+    sse = SSEServer(broker_url)
+    server = await asyncio.start_server(sse.handle, host, port, backlog=1024)
+    # Keep a reference: the loop only holds tasks weakly
+    follower = asyncio.create_task(sse.follow_broker()) if broker_url else None
+    logger.info(f"Live score SSE server listening on {host}:{port}")
+    async with server:
+        await server.serve_forever()
+    if follower is not None:
+        follower.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Live score broker and SSE server')
+    parser.add_argument('command', choices=['broker', 'serve'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--broker', default=LIVE_BROKER_URL or 'tcp://127.0.0.1:8765')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    try:
+        if args.command == 'broker':
+            asyncio.run(_serve_broker(args.host, args.port or 8765))
+        else:
+            asyncio.run(_serve_sse(args.host, args.port or 8001, args.broker))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
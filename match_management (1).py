@@ -1,17 +1,35 @@
 # match_management.py
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, make_response, Response
+from markupsafe import Markup
 from functools import wraps
-import pyodbc
+from db_pool import get_pool
+from pagination import page_args, fetch_match_page
+from reference_cache import get_teams, get_venues, with_match_names, team_name
+from records import Engagement, fetch_records, mapper, match_record
+from queries import (ENGAGEMENT_FEED, LAST_ID, MATCH_BY_ID, MATCH_INSERT, MATCH_LIST, MATCH_SET_SCORE, MATCH_STATUS,
+                     MATCH_TEAMS)
+from standings import get_standings
+from player_analytics import get_analytics
+from stats_ingest import ingest_upload, BATCH_SIZE
+from fragment_cache import get_fragment_cache, FRAGMENTS
+from live_scores import FINISHED, get_hub, live_feed, stream
+from fixture_scheduler import (ScheduleRules, SchedulingError, WEEKDAYS, MIN_REST_DAYS, match_conflicts,
+                               parse_dates, parse_kickoffs, parse_match_days, schedule_season)
+from availability import get_availability
+from season_archive import get_archive
+import events
 from datetime import datetime
 
 match_bp = Blueprint('match', __name__)
 
-# Database connection
+# The match queries live in queries.py; MATCH_LIST gets its WHERE, ORDER BY and
+# page limit per page. Fan engagement feed rows (ENGAGEMENT_FEED) of a match page:
+feed_record = mapper(Engagement, 'username engagement_date engagement_type prediction comment')
+
+# Database connection (pooled - conn.close() returns it to the pool)
 def get_db_connection():
-    conn = pyodbc.connect(r'Driver={Microsoft Access Driver (*.mdb, *.accdb)};'
-                          r'DBQ=./sports_management_system.accdb;')
-    return conn
+    return get_pool().acquire()
 
 # Login required decorator
 def login_required(f):
@@ -39,115 +57,194 @@ def role_required(roles):
 @match_bp.route('/matches')
 @login_required
 def matches():
+    args = page_args(request.args)
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    # Get all matches with team names and venue
-    cursor.execute('''
-        SELECT M.*, HT.TeamName as HomeTeam, AT.TeamName as AwayTeam, V.VenueName 
-        FROM MATCHES M
-        JOIN TEAMS HT ON M.HomeTeamID = HT.TeamID
-        JOIN TEAMS AT ON M.AwayTeamID = AT.TeamID
-        JOIN VENUES V ON M.VenueID = V.VenueID
-        ORDER BY M.MatchDateTime DESC
-    ''')
-    matches = cursor.fetchall()
+    # Get one page of matches with team names and venue (archived seasons from their snapshots)
+    try:
+        page = fetch_match_page(cursor, MATCH_LIST, descending=True, build=match_record,
+                                archive=get_archive(), **args)
+    except ValueError:
+        conn.close()
+        flash('Invalid page link.', 'warning')
+        return redirect(url_for('match.matches'))
     conn.close()
     
-    return render_template('matches.html', matches=matches)
+    return render_template('matches.html', matches=page.rows, page=page)
 
 @match_bp.route('/matches/upcoming')
 @login_required
 def upcoming_matches():
+    args = page_args(request.args)
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    # Get upcoming matches
-    cursor.execute('''
-        SELECT M.*, HT.TeamName as HomeTeam, AT.TeamName as AwayTeam, V.VenueName 
-        FROM MATCHES M
-        JOIN TEAMS HT ON M.HomeTeamID = HT.TeamID
-        JOIN TEAMS AT ON M.AwayTeamID = AT.TeamID
-        JOIN VENUES V ON M.VenueID = V.VenueID
-        WHERE M.MatchDateTime > NOW()
-        ORDER BY M.MatchDateTime
-    ''')
-    matches = cursor.fetchall()
+    # Get one page of upcoming matches
+    try:
+        page = fetch_match_page(cursor, MATCH_LIST, where='M.MatchDateTime > NOW()', descending=False,
+                                build=match_record, **args)
+    except ValueError:
+        conn.close()
+        flash('Invalid page link.', 'warning')
+        return redirect(url_for('match.upcoming_matches'))
     conn.close()
     
-    return render_template('upcoming_matches.html', matches=matches)
+    return render_template('upcoming_matches.html', matches=page.rows, page=page, teams=get_teams(), venues=get_venues())
 
 @match_bp.route('/matches/past')
 @login_required
 def past_matches():
+    args = page_args(request.args)
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    # Get past matches
-    cursor.execute('''
-        SELECT M.*, HT.TeamName as HomeTeam, AT.TeamName as AwayTeam, V.VenueName 
-        FROM MATCHES M
-        JOIN TEAMS HT ON M.HomeTeamID = HT.TeamID
-        JOIN TEAMS AT ON M.AwayTeamID = AT.TeamID
-        JOIN VENUES V ON M.VenueID = V.VenueID
-        WHERE M.MatchDateTime <= NOW()
-        ORDER BY M.MatchDateTime DESC
-    ''')
-    matches = cursor.fetchall()
+    # Get one page of past matches (archived seasons from their snapshots)
+    try:
+        page = fetch_match_page(cursor, MATCH_LIST, where='M.MatchDateTime <= NOW()', descending=True,
+                                build=match_record, archive=get_archive(), **args)
+    except ValueError:
+        conn.close()
+        flash('Invalid page link.', 'warning')
+        return redirect(url_for('match.past_matches'))
     conn.close()
     
-    return render_template('past_matches.html', matches=matches)
+    # Top of the table comes from the materialized standings
+    team_stats = get_standings().table(limit=6)
+    
+    return render_template('past_matches.html', matches=page.rows, page=page,
+                           teams=get_teams(), venues=get_venues(), team_stats=team_stats)
 
 @match_bp.route('/matches/<int:match_id>')
 @login_required
 def match_details(match_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    role = session.get('role')
+    fragments = get_fragment_cache()
+    state = fragments.state(match_id)
     
-    # Get match details
-    cursor.execute('''
-        SELECT M.*, HT.TeamName as HomeTeam, AT.TeamName as AwayTeam, V.VenueName, V.Location 
-        FROM MATCHES M
-        JOIN TEAMS HT ON M.HomeTeamID = HT.TeamID
-        JOIN TEAMS AT ON M.AwayTeamID = AT.TeamID
-        JOIN VENUES V ON M.VenueID = V.VenueID
-        WHERE M.MatchID = ?
-    ''', (match_id,))
-    match = cursor.fetchone()
+    # Unchanged page: answer 304 from the in-memory versions, without the database
+    etag = state.etag(role, session.get('user_id'))
+    if not session.get('_flashes') and state.not_modified(request, etag):
+        response = make_response('', 304)
+        return _conditional_headers(response, etag, state)
     
-    if not match:
-        conn.close()
-        flash('Match not found!', 'danger')
-        return redirect(url_for('match.matches'))
+    # Versions are read before the data so a concurrent update is never cached as current
+    versions = dict(state.versions)
+    html = {name: fragments.get(state, name, role) for name in FRAGMENTS}
     
-    # Get player stats for this match
-    cursor.execute('''
-        SELECT PS.*, P.FullName, P.Position, T.TeamName
-        FROM PLAYER_STATS PS
-        JOIN PLAYERS P ON PS.PlayerID = P.PlayerID
-        JOIN TEAMS T ON P.TeamID = T.TeamID
-        WHERE PS.MatchID = ?
-        ORDER BY PS.PerformanceRating DESC
-    ''', (match_id,))
-    stats = cursor.fetchall()
-    
-    # Get fan engagements for this match
-    cursor.execute('''
-        SELECT FE.*, U.Username
-        FROM FAN_ENGAGEMENT FE
-        JOIN FANS F ON FE.FanID = F.FanID
-        JOIN USERS U ON F.UserID = U.UserID
-        WHERE FE.MatchID = ?
-        ORDER BY FE.EngagementDate DESC
-    ''', (match_id,))
-    engagements = cursor.fetchall()
+    if None in html.values():
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        # Get match details (names resolved from the reference cache)
+        rows = fetch_records(cursor, match_record, MATCH_BY_ID, (match_id,))
+        if not rows:
+            # Pruned from MATCHES with its season; the archive still has it
+            archived = get_archive().match(match_id)
+            rows = [match_record(archived)] if archived else []
+        
+        if not rows:
+            conn.close()
+            flash('Match not found!', 'danger')
+            return redirect(url_for('match.matches'))
+        match = rows[0]
+        
+        # Get fan engagements for this match (only when that fragment is stale)
+        engagements = []
+        if html['engagement'] is None:
+            engagements = fetch_records(cursor, feed_record, ENGAGEMENT_FEED, (match_id,))
+        
+        conn.close()
+        
+        if html['header'] is None:
+            html['header'] = render_template('match_header.html', match=match)
+            fragments.set(state, 'header', role, versions['header'], html['header'])
+        
+        if html['stats'] is None:
+            # Player stats for this match come from the analytics store, split by team
+            stats = get_analytics().match_stats(match_id)
+            home_team_stats = [stat for stat in stats if stat['team_id'] == match.home_team_id]
+            away_team_stats = [stat for stat in stats if stat['team_id'] == match.away_team_id]
+            html['stats'] = render_template('match_stats.html',
+                                            match=match,
+                                            stats=stats,
+                                            home_team_stats=home_team_stats,
+                                            away_team_stats=away_team_stats)
+            fragments.set(state, 'stats', role, versions['stats'], html['stats'])
+        
+        if html['engagement'] is None:
+            html['engagement'] = render_template('match_engagement.html', match=match, engagements=engagements)
+            fragments.set(state, 'engagement', role, versions['engagement'], html['engagement'])
     
+    response = make_response(render_template('match_details.html',
+                                             match_id=match_id,
+                                             live=live_feed(url_for('match.live_poll'), match_id),
+                                             header_html=Markup(html['header']),
+                                             stats_html=Markup(html['stats']),
+                                             engagement_html=Markup(html['engagement'])))
+    return _conditional_headers(response, etag, state)
+
+def _conditional_headers(response, etag, state):
+    # Browsers must revalidate, and the page is per viewer, so keep it out of shared caches
+    response.set_etag(etag, weak=True)
+    response.last_modified = state.last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+@match_bp.route('/matches/live/poll')
+@login_required
+def live_poll():
+    # Latest score messages for the listed matches, from memory: what pages use without a live score server
+    try:
+        match_ids = [int(value) for value in request.args.get('match_ids', '').split(',') if value][:100]
+    except ValueError:
+        return jsonify({'error': 'match_ids must be a comma separated list of match IDs'}), 400
+    return jsonify(get_hub().updates(match_ids, request.args.get('since', 0, type=int)))
+
+@match_bp.route('/matches/live')
+@login_required
+def live_matches():
+    # Score and status changes for every match, as Server-Sent Events
+    return _event_stream(None)
+
+@match_bp.route('/matches/<int:match_id>/live')
+@login_required
+def live_match(match_id):
+    # Score and status changes for one match, as Server-Sent Events
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(MATCH_STATUS, (match_id,))
+    row = cursor.fetchone()
     conn.close()
+    if not row or row[0] in FINISHED:
+        # 204 tells the EventSource not to reconnect: nothing more will change
+        return '', 204
+    return _event_stream(match_id)
+
+def _event_stream(match_id):
+    # Each open stream holds a worker thread until it ends (LIVE_STREAM_SECONDS); use live_scores.py serve
+    # for large audiences
+    return Response(stream(get_hub(), match_id), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@match_bp.route('/matches/<int:match_id>/availability')
+@login_required
+@role_required(['admin', 'coach', 'medical'])
+def match_availability(match_id):
+    # Both squads as they stand on the match day, in one call to the availability index
+    squads = get_availability().match_squads(match_id)
+    if squads is None:
+        return jsonify({'error': 'Match not found'}), 404
     
-    return render_template('match_details.html', 
-                          match=match, 
-                          stats=stats, 
-                          engagements=engagements)
+    teams = []
+    for team_id, members in squads['teams'].items():
+        players = [dict(member._asdict(),
+                        expected_return=member.expected_return.isoformat() if member.expected_return else None)
+                   for member in members]
+        teams.append({'team_id': team_id, 'team_name': team_name(team_id),
+                      'available': sum(1 for member in members if member.available), 'players': players})
+    return jsonify({'match_id': match_id, 'date': squads['date'].isoformat(), 'teams': teams})
 
 @match_bp.route('/matches/create', methods=['GET', 'POST'])
 @login_required
@@ -164,71 +261,107 @@ def create_match():
         if not home_team_id or not away_team_id or not match_date or not match_time or not venue_id:
             flash('All fields are required!', 'danger')
             
-            # Get teams and venues for dropdowns
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT TeamID, TeamName FROM TEAMS')
-            teams = cursor.fetchall()
-            cursor.execute('SELECT VenueID, VenueName FROM VENUES')
-            venues = cursor.fetchall()
-            conn.close()
-            
-            return render_template('create_match.html', teams=teams, venues=venues)
+            # Teams and venues for dropdowns come from the reference cache
+            return render_template('create_match.html', teams=get_teams(), venues=get_venues())
         
         if home_team_id == away_team_id:
             flash('Home team and away team cannot be the same!', 'danger')
             
-            # Get teams and venues for dropdowns
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT TeamID, TeamName FROM TEAMS')
-            teams = cursor.fetchall()
-            cursor.execute('SELECT VenueID, VenueName FROM VENUES')
-            venues = cursor.fetchall()
-            conn.close()
-            
-            return render_template('create_match.html', teams=teams, venues=venues)
-        
-        # Combine date and time
-        match_datetime = f"{match_date} {match_time}"
+            # Teams and venues for dropdowns come from the reference cache
+            return render_template('create_match.html', teams=get_teams(), venues=get_venues())
         
         conn = get_db_connection()
         cursor = conn.cursor()
         
         try:
-            cursor.execute(
-                '''INSERT INTO MATCHES 
-                   (HomeTeamID, AwayTeamID, MatchDateTime, VenueID, Status) 
-                   VALUES (?, ?, ?, ?, ?)''',
-                (home_team_id, away_team_id, match_datetime, venue_id, 'Scheduled')
-            )
+            # Combine date and time
+            match_datetime = datetime.fromisoformat(f"{match_date} {match_time}")
+            
+            # Archived seasons are read from their snapshots, where a new match would never appear
+            if get_archive().covers(match_datetime):
+                conn.close()
+                flash('This match belongs to an archived season and can no longer be changed.', 'danger')
+                return render_template('create_match.html', teams=get_teams(), venues=get_venues())
+            
+            # Same rest-day and venue rules as the season scheduler, from one query
+            conflicts = match_conflicts(cursor, int(home_team_id), int(away_team_id), int(venue_id), match_datetime)
+            if conflicts:
+                conn.close()
+                for conflict in conflicts:
+                    flash(conflict, 'danger')
+                return render_template('create_match.html', teams=get_teams(), venues=get_venues())
+            
+            cursor.execute(MATCH_INSERT, (home_team_id, away_team_id, match_datetime, venue_id, 'Scheduled'))
+            cursor.execute(LAST_ID)
+            match_id = cursor.fetchone()[0]
             conn.commit()
             flash('Match scheduled successfully!', 'success')
             conn.close()
+            
+            events.publish(events.MATCH_CREATED, match_id=match_id, home_team_id=int(home_team_id),
+                           away_team_id=int(away_team_id), match_datetime=match_datetime, venue_id=int(venue_id))
             return redirect(url_for('match.matches'))
         except Exception as e:
             conn.rollback()
             flash(f'Error scheduling match: {str(e)}', 'danger')
             
-            # Get teams and venues for dropdowns
-            cursor.execute('SELECT TeamID, TeamName FROM TEAMS')
-            teams = cursor.fetchall()
-            cursor.execute('SELECT VenueID, VenueName FROM VENUES')
-            venues = cursor.fetchall()
             conn.close()
             
-            return render_template('create_match.html', teams=teams, venues=venues)
+            # Teams and venues for dropdowns come from the reference cache
+            return render_template('create_match.html', teams=get_teams(), venues=get_venues())
     
     # GET request - show form
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT TeamID, TeamName FROM TEAMS')
-    teams = cursor.fetchall()
-    cursor.execute('SELECT VenueID, VenueName FROM VENUES')
-    venues = cursor.fetchall()
-    conn.close()
+    return render_template('create_match.html', teams=get_teams(), venues=get_venues())
+
+@match_bp.route('/matches/schedule', methods=['GET', 'POST'])
+@login_required
+@role_required(['admin'])
+def schedule_fixtures():
+    teams = get_teams()
+    form = request.form
+    match_days = form.getlist('match_days') if form else ['sat', 'sun']
+    
+    def show(fixtures=None, summary=None):
+        return render_template('schedule_season.html', teams=teams, form=form, weekdays=WEEKDAYS,
+                               match_days=match_days, min_rest_days=MIN_REST_DAYS,
+                               fixtures=fixtures, summary=summary)
+    
+    if request.method == 'GET':
+        return show()
+    
+    try:
+        rules = ScheduleRules(datetime.strptime(form['start_date'], '%Y-%m-%d').date(),
+                              match_days=parse_match_days(','.join(match_days)),
+                              kickoffs=parse_kickoffs(form.get('kickoffs', '')),
+                              min_rest_days=int(form.get('min_rest_days') or MIN_REST_DAYS),
+                              blackout_dates=parse_dates(form.get('blackout_dates')))
+    except (KeyError, ValueError):
+        flash('Please check the start date, match days, kick-off times and blackout dates.', 'danger')
+        return show()
+    if not rules.match_days or not rules.kickoffs:
+        flash('Choose at least one match day and one kick-off time.', 'danger')
+        return show()
     
-    return render_template('create_match.html', teams=teams, venues=venues)
+    team_ids = [int(team_id) for team_id in form.getlist('team_ids')] or [team[0] for team in teams]
+    preview = bool(form.get('preview'))
+    try:
+        fixtures, summary = schedule_season(team_ids, rules, double=form.get('format', 'double') == 'double',
+                                            dry_run=preview)
+    except SchedulingError as e:
+        flash(str(e), 'danger')
+        return show()
+    except Exception as e:
+        flash(f'Error scheduling season: {str(e)}', 'danger')
+        return show()
+    
+    if preview:
+        # Same columns as MATCHES, so the records look the names up in the reference cache
+        rows = [match_record((None,) + fixture.row() + (None, None)) for fixture in fixtures]
+        return show([(fixture.round, row) for fixture, row in zip(fixtures, rows)], summary)
+    
+    flash(f"Scheduled {summary['matches']} matches from {summary['first_kickoff'].strftime('%d %B %Y')} "
+          f"to {summary['last_kickoff'].strftime('%d %B %Y')}.", 'success')
+    return redirect(url_for('match.upcoming_matches'))
 
 @match_bp.route('/matches/update/<int:match_id>', methods=['GET', 'POST'])
 @login_required
@@ -243,15 +376,30 @@ def update_match(match_id):
         status = request.form['status']
         
         try:
-            cursor.execute(
-                '''UPDATE MATCHES 
-                   SET HomeScore = ?, AwayScore = ?, Status = ? 
-                   WHERE MatchID = ?''',
-                (home_score, away_score, status, match_id)
-            )
+            home_score = int(home_score) if home_score != '' else None
+            away_score = int(away_score) if away_score != '' else None
+            
+            cursor.execute(MATCH_TEAMS, (match_id,))
+            match = cursor.fetchone()
+            if not match and get_archive().match(match_id) is None:
+                conn.close()
+                flash('Match not found!', 'danger')
+                return redirect(url_for('match.matches'))
+            if not match or get_archive().covers(match[2]):
+                conn.close()
+                flash('This match belongs to an archived season and can no longer be changed.', 'danger')
+                return redirect(url_for('match.match_details', match_id=match_id))
+            
+            cursor.execute(MATCH_SET_SCORE, (home_score, away_score, status, match_id))
             conn.commit()
-            flash('Match updated successfully!', 'success')
             conn.close()
+            
+            # Let standings and caches pick up the new score
+            events.publish(events.MATCH_UPDATED, match_id=match_id,
+                           home_team_id=match[0], away_team_id=match[1], match_datetime=match[2],
+                           home_score=home_score, away_score=away_score, status=status)
+            
+            flash('Match updated successfully!', 'success')
             return redirect(url_for('match.match_details', match_id=match_id))
         except Exception as e:
             conn.rollback()
@@ -260,14 +408,7 @@ def update_match(match_id):
             return redirect(url_for('match.match_details', match_id=match_id))
     
     # GET request - show form
-    cursor.execute('''
-        SELECT M.*, HT.TeamName as HomeTeam, AT.TeamName as AwayTeam, V.VenueName 
-        FROM MATCHES M
-        JOIN TEAMS HT ON M.HomeTeamID = HT.TeamID
-        JOIN TEAMS AT ON M.AwayTeamID = AT.TeamID
-        JOIN VENUES V ON M.VenueID = V.VenueID
-        WHERE M.MatchID = ?
-    ''', (match_id,))
+    cursor.execute(MATCH_BY_ID, (match_id,))
     match = cursor.fetchone()
     
     if not match:
@@ -276,4 +417,22 @@ def update_match(match_id):
         return redirect(url_for('match.matches'))
     
     conn.close()
-    return render_template('update_match.html', match=match)
\ No newline at end of file
+    match = with_match_names([match])[0]
+    return render_template('update_match.html', match=match)
+
+@match_bp.route('/matches/stats/import', methods=['POST'])
+@login_required
+@role_required(['admin', 'coach'])
+def import_stats():
+    # Bulk load of box scores ('stats') or final scores ('results') from a CSV/JSON upload
+    upload = request.files.get('file')
+    kind = request.form.get('kind', 'stats')
+    if not upload or kind not in ('stats', 'results'):
+        return jsonify({'error': 'Upload a file and choose kind=stats or kind=results'}), 400
+    
+    batch_size = request.form.get('batch_size', BATCH_SIZE, type=int)
+    report = ingest_upload(upload, kind, batch_size)
+    if report.input_error:
+        # Undecodable or malformed input; rows read before the fault were still written
+        return jsonify(dict(report.as_dict(), error=f'Could not read the upload {report.input_error}')), 400
+    return jsonify(report.as_dict())
\ No newline at end of file
@@ -0,0 +1,170 @@
+"""
+Keyset pagination for the match listings
+Pages are addressed by (MatchDateTime, MatchID) cursors, so the cost of a page
+depends on the page size and not on how many matches are stored. Listings
+that reach back past the season archive's boundary continue into the
+archived seasons' snapshots.
+"""
+
+import os
+import json
+import base64
+from datetime import datetime
+
+PAGE_SIZE = int(os.environ.get('MATCHES_PAGE_SIZE', 25))
+MAX_PAGE_SIZE = 100
+
+
+class Page:
+    """One page of rows plus the tokens needed to move to its neighbours"""
+
+    def __init__(self, rows, page_size, next_token=None, prev_token=None, filters=None):
+        self.rows = rows
+        self.page_size = page_size
+        self.next_token = next_token
+        self.prev_token = prev_token
+        self.filters = filters or {}
+
+    @property
+    def has_next(self):
+        return self.next_token is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_token is not None
+
+
+def encode_cursor(match_datetime, match_id):
+    """Turn a (MatchDateTime, MatchID) key into an opaque URL-safe token"""
+    payload = json.dumps([match_datetime.isoformat(), int(match_id)])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Inverse of encode_cursor; raises ValueError for a malformed token"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        match_datetime, match_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(match_datetime), int(match_id)
+    except (TypeError, ValueError, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid page token: {token}") from e
+
+
+def page_args(args):
+    """Read page_size, after/before tokens and filters from request.args"""
+    try:
+        page_size = int(args.get('page_size', PAGE_SIZE))
+    except ValueError:
+        page_size = PAGE_SIZE
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+
+    filters = {}
+    for name in ('team_id', 'venue_id'):
+        value = args.get(name)
+        if value and value.isdigit():
+            filters[name] = int(value)
+    if args.get('status'):
+        filters['status'] = args.get('status')
+
+    return {
+        'page_size': page_size,
+        'after': args.get('after') or None,
+        'before': args.get('before') or None,
+        'filters': filters,
+    }
+
+
+def fetch_match_page(cursor, select_sql, where=None, params=(), descending=True,
+                     page_size=PAGE_SIZE, after=None, before=None, filters=None,
+                     key=lambda row: (row[3], row[0]), build=None, archive=None):
+    """
+    Run select_sql (a MATCHES M query without WHERE/ORDER BY) for one page.
+
+    where/params add a fixed condition (e.g. upcoming only), filters may hold
+    team_id, venue_id and status. after/before are tokens from a previous
+    page. key extracts (MatchDateTime, MatchID) from a row, and build (if
+    given) maps the page's rows onto records (see records.py).
+
+    archive (season_archive.SeasonArchive) serves the matches before its
+    boundary from the season snapshots; only pass it to listings whose where
+    holds for every archived match (past and all matches, not upcoming).
+    """
+    filters = filters or {}
+    conditions = [where] if where else []
+    params = list(params)
+
+    if 'team_id' in filters:
+        conditions.append('(M.HomeTeamID = ? OR M.AwayTeamID = ?)')
+        params += [filters['team_id'], filters['team_id']]
+    if 'venue_id' in filters:
+        conditions.append('M.VenueID = ?')
+        params.append(filters['venue_id'])
+    if 'status' in filters:
+        conditions.append('M.Status = ?')
+        params.append(filters['status'])
+
+    # Walking backwards means reading the opposite direction and flipping the rows
+    backwards = before is not None and after is None
+    token = before if backwards else after
+    forward_desc = descending != backwards
+
+    position = None
+    if token:
+        position = decode_cursor(token)
+        match_datetime, match_id = position
+        op = '<' if forward_desc else '>'
+        conditions.append(f'(M.MatchDateTime {op} ? OR (M.MatchDateTime = ? AND M.MatchID {op} ?))')
+        params += [match_datetime, match_datetime, match_id]
+
+    # Matches before the boundary are read from the archive, not MATCHES
+    boundary = archive.boundary() if archive is not None else None
+    if boundary is not None:
+        conditions.append('M.MatchDateTime >= ?')
+        params.append(boundary)
+
+    direction = 'DESC' if forward_desc else 'ASC'
+    tail = ''
+    if conditions:
+        tail += '\nWHERE ' + ' AND '.join(conditions)
+    tail += f'\nORDER BY M.MatchDateTime {direction}, M.MatchID {direction}\nLIMIT {page_size + 1}'
+    # A named query (queries.py) keeps each variant, so it is translated once
+    sql = select_sql.extend(tail) if hasattr(select_sql, 'extend') else select_sql + tail
+
+    limit = page_size + 1
+    if boundary is None:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    elif forward_desc:
+        # Newest first: the live seasons, then on into the archive
+        rows = []
+        if position is None or position[0] >= boundary:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        if len(rows) < limit:
+            rows += archive.page(True, position, filters, limit - len(rows))
+    else:
+        # Oldest first: the archive, then on into the live seasons
+        rows = []
+        if position is None or position[0] < boundary:
+            rows = archive.page(False, position, filters, limit)
+        if len(rows) < limit:
+            cursor.execute(sql, params)
+            rows += cursor.fetchall()[:limit - len(rows)]
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if backwards:
+        rows.reverse()
+
+    next_token = prev_token = None
+    if rows:
+        first, last = encode_cursor(*key(rows[0])), encode_cursor(*key(rows[-1]))
+        if backwards:
+            prev_token = first if has_more else None
+            next_token = last
+        else:
+            next_token = last if has_more else None
+            prev_token = first if token else None
+
+    if build is not None:
+        rows = [build(row) for row in rows]
+    return Page(rows, page_size, next_token, prev_token, filters)
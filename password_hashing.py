@@ -0,0 +1,132 @@
+"""
+Password hashing for Sports Management System
+Runs bcrypt in a bounded process pool so a burst of logins cannot tie up
+the web threads, and rejects work quickly once the queue is full. A queue slot
+is held until its job has finished, even when the request stopped waiting.
+"""
+
+import os
+import re
+import atexit
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+
+logger = logging.getLogger('auth')
+
+# Hashing settings (can be overridden from the environment)
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+HASH_WORKERS = int(os.environ.get('HASH_WORKERS', os.cpu_count() or 2))
+HASH_QUEUE_LIMIT = int(os.environ.get('HASH_QUEUE_LIMIT', HASH_WORKERS * 4))
+HASH_TIMEOUT = float(os.environ.get('HASH_TIMEOUT', 10))
+RETRY_AFTER_SECONDS = 2
+
+_COST_RE = re.compile(r'^\$2[aby]?\$(\d{2})\$')
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing queue is full or a job does not finish in time; the caller should answer 503"""
+
+    retry_after = RETRY_AFTER_SECONDS
+
+
+# These run inside the worker processes, so they must stay module level
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check(pw_hash, password):
+    try:
+        return bcrypt.checkpw(password.encode('utf-8'), pw_hash.encode('utf-8'))
+    except ValueError:
+        # Malformed hash stored for this user
+        return False
+
+
+class PasswordHasher:
+    """Bounded process pool for bcrypt hashing and checking"""
+
+    def __init__(self, rounds=BCRYPT_ROUNDS, workers=HASH_WORKERS,
+                 queue_limit=HASH_QUEUE_LIMIT, timeout=HASH_TIMEOUT):
+        self.rounds = rounds
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max(queue_limit, 1))
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _submit(self, fn, *args):
+        # workers=0 hashes inline (useful for scripts and debugging)
+        if self.workers <= 0:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            logger.warning("Password hashing queue full, rejecting request")
+            raise HashingBusy("Too many sign-in requests, please retry shortly")
+        try:
+            executor, future = self._start(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # The slot is freed when the job ends, not when this request gives up on it
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            logger.warning(f"Password hashing took longer than {self.timeout}s, rejecting request")
+            raise HashingBusy("Sign-in is slow right now, please retry shortly")
+        except BrokenProcessPool:
+            logger.error("Password hashing worker died, restarting the pool")
+            self._discard(executor)
+            raise HashingBusy("Sign-in is restarting, please retry shortly")
+
+    def _start(self, fn, *args):
+        # Submit to the pool, replacing a pool whose workers have died
+        executor = self._pool()
+        try:
+            return executor, executor.submit(fn, *args)
+        except BrokenProcessPool:
+            logger.error("Password hashing pool was broken, restarting it")
+            self._discard(executor)
+            executor = self._pool()
+            return executor, executor.submit(fn, *args)
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _discard(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def hash_password(self, password):
+        """bcrypt hash of password at the configured cost"""
+        return self._submit(_hash, password, self.rounds)
+
+    def check_password(self, pw_hash, password):
+        return self._submit(_check, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        """True when pw_hash was made with a different cost than configured"""
+        match = _COST_RE.match(pw_hash or '')
+        return not match or int(match.group(1)) != self.rounds
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_hasher = PasswordHasher()
+atexit.register(_hasher.shutdown)
+
+
+def get_hasher():
+    return _hasher
@@ -0,0 +1,357 @@
+"""
+Player performance analytics over PLAYER_STATS
+Loads the stats into columnar NumPy arrays once, then computes season totals,
+per-90 rates, rolling ratings and positional percentiles for every player in
+one batch instead of aggregating row by row in the templates. Seasons in the
+season archive (season_archive.py) are aggregated straight from their
+memory-mapped snapshots; only the live seasons are loaded from PLAYER_STATS.
+"""
+
+import os
+import time
+import logging
+import threading
+from datetime import datetime
+
+import numpy as np
+
+import events
+from db_pool import get_pool
+from queries import register
+
+logger = logging.getLogger('analytics')
+
+ROLLING_WINDOW = int(os.environ.get('ANALYTICS_ROLLING_WINDOW', 5))
+REFRESH_SECONDS = float(os.environ.get('ANALYTICS_REFRESH_SECONDS', 60))
+SEASON_START_MONTH = int(os.environ.get('SEASON_START_MONTH', 8))
+FETCH_CHUNK = 5000
+
+# Columns loaded for every PLAYER_STATS row, in this order
+_STATS_SQL = register('analytics.stats', '''
+    SELECT PS.StatID, PS.PlayerID, PS.MatchID, P.TeamID, M.MatchDateTime,
+           PS.Goals, PS.Assists, PS.YellowCards, PS.RedCards, PS.MinutesPlayed, PS.PerformanceRating
+    FROM PLAYER_STATS PS
+    JOIN MATCHES M ON PS.MatchID = M.MatchID
+    JOIN PLAYERS P ON PS.PlayerID = P.PlayerID
+    WHERE PS.StatID > ? AND M.MatchDateTime >= ?
+    ORDER BY PS.StatID
+''')
+# Live rows start at the archive's boundary; this when nothing is archived
+_NO_BOUNDARY = datetime(1900, 1, 1)
+_INT_COLUMNS = ('stat_id', 'player_id', 'match_id', 'team_id')
+_COUNT_COLUMNS = ('goals', 'assists', 'yellow_cards', 'red_cards', 'minutes')
+
+
+def season_for(when):
+    """Season a date belongs to, as its starting year (2024 for 2024/25)"""
+    return when.year if when.month >= SEASON_START_MONTH else when.year - 1
+
+
+def _seasons(match_time):
+    years = match_time.astype('datetime64[Y]').astype(np.int64) + 1970
+    months = match_time.astype('datetime64[M]').astype(np.int64) % 12 + 1
+    return years - (months < SEASON_START_MONTH)
+
+
+def _percentiles(values, groups):
+    """Percent of the same group scoring at or below each value"""
+    result = np.zeros(len(values))
+    for group in np.unique(groups):
+        idx = np.flatnonzero(groups == group)
+        ordered = np.sort(values[idx])
+        result[idx] = 100.0 * np.searchsorted(ordered, values[idx], side='right') / len(idx)
+    return result
+
+
+class SeasonAggregates:
+    """Per-player aggregates for one season (or all seasons), computed in batch"""
+
+    def __init__(self, columns, mask, positions, window):
+        player_ids = columns['player_id'][mask]
+        self.player_ids, inverse = np.unique(player_ids, return_inverse=True)
+        n = len(self.player_ids)
+        self.index = {pid: i for i, pid in enumerate(self.player_ids.tolist())}
+
+        self.matches = np.bincount(inverse, minlength=n)
+        self.totals = {}
+        for name in _COUNT_COLUMNS:
+            self.totals[name] = np.bincount(inverse, weights=columns[name][mask], minlength=n)
+
+        ratings = columns['rating'][mask]
+        rated = ~np.isnan(ratings)
+        rating_sum = np.bincount(inverse, weights=np.where(rated, ratings, 0.0), minlength=n)
+        rating_count = np.bincount(inverse, weights=rated.astype(np.float64), minlength=n)
+        self.avg_rating = np.divide(rating_sum, rating_count, out=np.zeros(n), where=rating_count > 0)
+
+        minutes = self.totals['minutes']
+        self.per90 = {}
+        for name in ('goals', 'assists'):
+            self.per90[name] = np.divide(self.totals[name] * 90.0, minutes,
+                                         out=np.zeros(n), where=minutes > 0)
+
+        # Rolling average rating over each player's last `window` rated matches
+        order = np.lexsort((columns['match_time'][mask], inverse))
+        sorted_players = inverse[order]
+        sorted_ratings = np.where(rated, ratings, 0.0)[order]
+        sum_cs = np.concatenate(([0.0], np.cumsum(sorted_ratings)))
+        cnt_cs = np.concatenate(([0.0], np.cumsum(rated[order])))
+        group_start = np.searchsorted(sorted_players, np.arange(n), side='left')
+        positions_in_order = np.arange(len(order))
+        window_start = np.maximum(positions_in_order - window + 1, group_start[sorted_players])
+        window_count = cnt_cs[positions_in_order + 1] - cnt_cs[window_start]
+        window_sum = sum_cs[positions_in_order + 1] - sum_cs[window_start]
+        self.rolling = np.divide(window_sum, window_count, out=np.full(len(order), np.nan),
+                                 where=window_count > 0)
+        self.rolling_order = order
+        self.group_start = group_start
+        self.group_end = np.searchsorted(sorted_players, np.arange(n), side='right')
+        last = self.group_end - 1
+        self.latest_rolling = self.rolling[last] if n else np.zeros(0)
+
+        # Percentile ranks among players in the same position
+        self.positions = np.array([positions.get(pid, '') for pid in self.player_ids.tolist()], dtype=object)
+        self.rating_percentile = _percentiles(self.avg_rating, self.positions)
+        self.goals_per90_percentile = _percentiles(self.per90['goals'], self.positions)
+
+    def summary(self, player_id):
+        i = self.index.get(player_id)
+        if i is None:
+            return None
+        return {
+            'player_id': player_id,
+            'position': self.positions[i],
+            'matches': int(self.matches[i]),
+            'goals': int(self.totals['goals'][i]),
+            'assists': int(self.totals['assists'][i]),
+            'yellow_cards': int(self.totals['yellow_cards'][i]),
+            'red_cards': int(self.totals['red_cards'][i]),
+            'minutes': int(self.totals['minutes'][i]),
+            'avg_rating': round(float(self.avg_rating[i]), 2),
+            'goals_per90': round(float(self.per90['goals'][i]), 2),
+            'assists_per90': round(float(self.per90['assists'][i]), 2),
+            'rolling_rating': None if np.isnan(self.latest_rolling[i]) else round(float(self.latest_rolling[i]), 2),
+            'rating_percentile': round(float(self.rating_percentile[i]), 1),
+            'goals_per90_percentile': round(float(self.goals_per90_percentile[i]), 1),
+        }
+
+
+class PlayerAnalytics:
+    """Columnar PLAYER_STATS store with cached per-season aggregates"""
+
+    def __init__(self, window=ROLLING_WINDOW, refresh_seconds=REFRESH_SECONDS):
+        self.window = window
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.RLock()
+        self._columns = None
+        self._players = {}  # PlayerID -> (FullName, Position, TeamID)
+        self._last_stat_id = 0
+        self._aggregates = {}
+        self._match_order = None
+        self._all_columns = None
+        self._archive = None
+        self._boundary = None
+        self._loaded_at = 0.0
+        self._dirty = True
+
+    def use_archive(self, archive):
+        """Read seasons before archive.boundary() from the archive's snapshots"""
+        with self._lock:
+            self._archive = archive
+            self._dirty = True
+
+    def mark_dirty(self, **payload):
+        """Called when stats rows are written; the next read loads them"""
+        self._dirty = True
+
+    def reload(self):
+        """Drop everything and load PLAYER_STATS from scratch"""
+        with self._lock:
+            self._columns = None
+            self._last_stat_id = 0
+            self._aggregates = {}
+            self.refresh()
+
+    def refresh(self):
+        """Load stats rows added since the last refresh"""
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self):
+        # Caller holds the lock, so concurrent refreshes cannot load the same rows twice
+        started = time.perf_counter()
+        boundary = self._archive.boundary() if self._archive is not None else None
+        if boundary != self._boundary:
+            # A season was archived: its rows now come from the snapshot, so start the live columns again
+            self._columns = None
+            self._last_stat_id = 0
+            self._aggregates = {}
+            self._all_columns = None
+            self._boundary = boundary
+
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT PlayerID, FullName, Position, TeamID FROM PLAYERS')
+            players = {row[0]: (row[1], row[2], row[3]) for row in cursor.fetchall()}
+
+            cursor.execute(_STATS_SQL, (self._last_stat_id, boundary or _NO_BOUNDARY))
+            rows = []
+            while True:
+                chunk = cursor.fetchmany(FETCH_CHUNK)
+                if not chunk:
+                    break
+                rows.extend(chunk)
+
+        self._players = players
+        if rows:
+            new = self._to_columns(rows)
+            if self._columns is None:
+                self._columns = new
+            else:
+                self._columns = {name: np.concatenate((self._columns[name], new[name]))
+                                 for name in self._columns}
+            self._last_stat_id = int(new['stat_id'][-1])
+            # Only seasons that received rows need recomputing
+            for season in np.unique(new['season']).tolist():
+                self._aggregates.pop(season, None)
+            self._aggregates.pop('all', None)
+            self._all_columns = None
+            self._match_order = None
+        elif self._columns is None:
+            self._columns = self._to_columns([])
+        self._loaded_at = time.monotonic()
+        self._dirty = False
+
+        logger.info(f"Analytics refresh loaded {len(rows)} stats rows in "
+                    f"{(time.perf_counter() - started) * 1000:.1f} ms")
+
+    @staticmethod
+    def _to_columns(rows):
+        columns = {}
+        for i, name in enumerate(_INT_COLUMNS):
+            columns[name] = np.array([row[i] for row in rows], dtype=np.int64)
+        columns['match_time'] = np.array([row[4] for row in rows], dtype='datetime64[s]')
+        for i, name in enumerate(_COUNT_COLUMNS, start=5):
+            columns[name] = np.array([row[i] or 0 for row in rows], dtype=np.float64)
+        columns['rating'] = np.array([np.nan if row[10] is None else row[10] for row in rows],
+                                     dtype=np.float64)
+        columns['season'] = _seasons(columns['match_time'])
+        return columns
+
+    def _ensure_fresh(self):
+        if self._dirty or time.monotonic() - self._loaded_at > self.refresh_seconds:
+            with self._lock:
+                if self._dirty or time.monotonic() - self._loaded_at > self.refresh_seconds:
+                    self.refresh()
+
+    def season(self, season=None):
+        """Aggregates for a season (default: current season, 'all' for career)"""
+        self._ensure_fresh()
+        if season is None:
+            season = season_for(datetime.now())
+        with self._lock:
+            aggregates = self._aggregates.get(season)
+            if aggregates is None:
+                columns, mask = self._season_columns(season)
+                positions = {pid: info[1] for pid, info in self._players.items()}
+                aggregates = SeasonAggregates(columns, mask, positions, self.window)
+                self._aggregates[season] = aggregates
+            return aggregates
+
+    def _season_columns(self, season):
+        # (columns, mask) holding a season's rows; caller holds the lock
+        snapshot = self._archive.snapshot(season) if self._archive is not None and season != 'all' else None
+        if snapshot is not None and snapshot.end <= (self._boundary or _NO_BOUNDARY):
+            # Archived seasons are aggregated from the memory-mapped snapshot, without copying it
+            return snapshot.stats, slice(None)
+        if season == 'all':
+            if self._all_columns is None:
+                parts = [snapshot.stats for snapshot in (self._archive.snapshots() if self._archive else [])
+                         if snapshot.end <= (self._boundary or _NO_BOUNDARY)]
+                self._all_columns = self._columns if not parts else \
+                    {name: np.concatenate([part[name] for part in parts] + [self._columns[name]])
+                     for name in self._columns}
+            return self._all_columns, slice(None)
+        return self._columns, self._columns['season'] == season
+
+    def player_summary(self, player_id, season=None):
+        """Season totals, per-90 rates, rolling rating and percentiles for one player"""
+        return self.season(season).summary(player_id)
+
+    def rolling_ratings(self, player_id, season='all'):
+        """(MatchID, MatchDateTime, rolling rating) for each of the player's matches"""
+        if season is None:
+            season = season_for(datetime.now())
+        aggregates = self.season(season)
+        i = aggregates.index.get(player_id)
+        if i is None:
+            return []
+        with self._lock:
+            columns, mask = self._season_columns(season)
+            mask_rows = np.arange(len(columns['stat_id'])) if isinstance(mask, slice) else np.flatnonzero(mask)
+            span = slice(aggregates.group_start[i], aggregates.group_end[i])
+            rows = mask_rows[aggregates.rolling_order[span]]
+            return [(int(m), t.astype(datetime), None if np.isnan(r) else round(float(r), 2))
+                    for m, t, r in zip(columns['match_id'][rows],
+                                       columns['match_time'][rows],
+                                       aggregates.rolling[span])]
+
+    def leaderboard(self, metric='avg_rating', position=None, season=None, limit=10):
+        """Top players by 'avg_rating', 'goals', 'assists', 'goals_per90' or 'assists_per90'"""
+        aggregates = self.season(season)
+        if metric == 'avg_rating':
+            values = aggregates.avg_rating
+        elif metric.endswith('_per90'):
+            values = aggregates.per90[metric[:-len('_per90')]]
+        else:
+            values = aggregates.totals[metric]
+        candidates = np.arange(len(values))
+        if position:
+            candidates = candidates[aggregates.positions == position]
+        top = candidates[np.argsort(-values[candidates], kind='stable')[:limit]]
+        return [aggregates.summary(int(aggregates.player_ids[i])) for i in top]
+
+    def match_stats(self, match_id):
+        """Stats rows for one match as dicts, best rating first"""
+        self._ensure_fresh()
+        with self._lock:
+            columns = self._columns
+            if self._match_order is None:
+                self._match_order = np.argsort(columns['match_id'], kind='stable')
+            sorted_ids = columns['match_id'][self._match_order]
+            lo, hi = np.searchsorted(sorted_ids, [match_id, match_id + 1])
+            rows = self._match_order[lo:hi]
+            if not len(rows) and self._archive is not None:
+                # Not a live match; archived stats are stored sorted by MatchID
+                archived = self._archive.match_stats(match_id)
+                if archived is not None:
+                    columns, span = archived
+                    rows = np.arange(span.start, span.stop)
+            result = []
+            for r in rows.tolist():
+                name, position, _ = self._players.get(int(columns['player_id'][r]), (None, None, None))
+                rating = columns['rating'][r]
+                result.append({
+                    'player_id': int(columns['player_id'][r]),
+                    'team_id': int(columns['team_id'][r]),
+                    'player_name': name,
+                    'position': position,
+                    'goals': int(columns['goals'][r]),
+                    'assists': int(columns['assists'][r]),
+                    'yellow_cards': int(columns['yellow_cards'][r]),
+                    'red_cards': int(columns['red_cards'][r]),
+                    'minutes': int(columns['minutes'][r]),
+                    'rating': None if np.isnan(rating) else float(rating),
+                })
+        result.sort(key=lambda stat: -(stat['rating'] or 0))
+        return result
+
+
+_analytics = PlayerAnalytics()
+
+
+def get_analytics():
+    return _analytics
+
+
+events.subscribe(events.PLAYER_STATS_WRITTEN, _analytics.mark_dirty)
+events.subscribe(events.SEASON_ARCHIVED, _analytics.mark_dirty)
@@ -0,0 +1,238 @@
+"""
+Named query registry for Sports Management System
+The statements the routes run are registered here once, under a name, rather
+than rebuilt in each handler. A query may carry hand-written text for a
+dialect; otherwise its text for the configured backend is translated once and
+kept. Named queries are plain strings, so they go anywhere SQL does. The
+pooled connections prepare each one once per connection (see
+db_pool.StatementCache), and query_stats reports the timings per name.
+
+Usage:
+    python queries.py            - list the registered queries
+    python queries.py <name>     - print a query's text for each dialect
+"""
+
+import sys
+import threading
+from collections import OrderedDict
+
+from query_stats import get_query_stats
+from records import MATCH_COLUMNS
+
+DIALECTS = ('access', 'sqlite')
+
+# Most extensions of one query kept (e.g. the match list's WHERE/ORDER BY variants)
+EXTENSIONS_KEPT = 256
+
+
+class NamedQuery(str):
+    """SQL text with a registry name and its text for each backend"""
+
+    def __new__(cls, name, sql, dialects=None):
+        query = super().__new__(cls, sql)
+        query.name = name
+        query.dialects = dict(dialects or {})  # dialect -> hand-written text
+        query._texts = {}
+        query._extensions = {}
+        return query
+
+    def __reduce__(self):
+        # Report sections run in worker processes
+        return NamedQuery, (self.name, str(self), self.dialects)
+
+    def text_for(self, backend):
+        """The text sent to backend's driver, translated on first use"""
+        text = self._texts.get(backend.name)
+        if text is None:
+            text = self.dialects.get(backend.name) or backend.translate(str(self))
+            self._texts[backend.name] = text
+        return text
+
+    def extend(self, tail):
+        """This query with tail appended (WHERE, ORDER BY, ...), under the same name"""
+        query = self._extensions.get(tail)
+        if query is None:
+            query = NamedQuery(self.name, str(self) + tail,
+                               {dialect: text + tail for dialect, text in self.dialects.items()})
+            if len(self._extensions) < EXTENSIONS_KEPT:
+                self._extensions[tail] = query
+        return query
+
+
+class QueryRegistry:
+    """Every named query, in registration order"""
+
+    def __init__(self):
+        self._queries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def register(self, name, sql, **dialects):
+        """Add a query (with optional text per dialect, e.g. sqlite='...') and return it"""
+        unknown = set(dialects) - set(DIALECTS)
+        if unknown:
+            raise ValueError(f"Unknown dialects for query {name}: {', '.join(sorted(unknown))}")
+        with self._lock:
+            existing = self._queries.get(name)
+            if existing is not None:
+                if existing != sql or existing.dialects != dialects:
+                    raise ValueError(f"Query {name} is already registered with different text")
+                return existing
+            query = self._queries[name] = NamedQuery(name, sql, dialects)
+            return query
+
+    def get(self, name):
+        return self._queries[name]
+
+    def names(self):
+        return list(self._queries)
+
+    def timings(self):
+        """Per-name totals from query_stats for every registered query, slowest first"""
+        totals = get_query_stats().by_name()
+        timings = [dict(totals.get(name, {'calls': 0, 'total_ms': 0.0, 'mean_ms': 0.0, 'max_ms': 0.0, 'rows': 0}),
+                        name=name) for name in self._queries]
+        return sorted(timings, key=lambda timing: timing['total_ms'], reverse=True)
+
+
+_registry = QueryRegistry()
+
+
+def get_registry():
+    return _registry
+
+
+def register(name, sql, **dialects):
+    return _registry.register(name, sql, **dialects)
+
+
+# Users and registration
+USER_LOGIN = register('users.login', 'SELECT UserID, Username, Password, Role FROM USERS WHERE Username = ?')
+USER_NAME = register('users.name', 'SELECT Username FROM USERS WHERE UserID = ?')
+USER_INSERT = register('users.insert', 'INSERT INTO USERS (Username, Password, Email, Phone, RegistrationDate, Role) '
+                                       'VALUES (?, ?, ?, ?, ?, ?)')
+USER_SET_PASSWORD = register('users.set_password', 'UPDATE USERS SET Password = ? WHERE UserID = ?')
+USER_SET_ROLE = register('users.set_role', 'UPDATE USERS SET Role = ? WHERE UserID = ?')
+FAN_INSERT = register('fans.insert', 'INSERT INTO FANS (UserID, MembershipType, JoinDate, LoyaltyPoints) '
+                                     'VALUES (?, ?, ?, ?)')
+FAN_BY_USER = register('fans.by_user', 'SELECT * FROM FANS WHERE UserID = ?')
+MEDICAL_STAFF_INSERT = register('medical_staff.insert', 'INSERT INTO MEDICAL_STAFF (UserID, Specialization, '
+                                                         'Qualification) VALUES (?, ?, ?)')
+MEDICAL_STAFF_BY_USER = register('medical_staff.by_user', 'SELECT * FROM MEDICAL_STAFF WHERE UserID = ?')
+PLAYER_INSERT = register('players.insert', 'INSERT INTO PLAYERS (UserID, FullName, DateOfBirth, Position, TeamID, '
+                                           'Status) VALUES (?, ?, ?, ?, ?, ?)')
+PLAYER_BY_USER = register('players.by_user', '''
+    SELECT PlayerID, UserID, FullName, DateOfBirth, Position, TeamID, Status
+    FROM PLAYERS
+    WHERE UserID = ?
+''')
+COACH_TEAM = register('teams.by_coach', 'SELECT TeamID, TeamName, League FROM TEAMS WHERE CoachID = ?')
+
+# ID of the row just inserted on this connection
+LAST_ID = register('last_id', 'SELECT @@IDENTITY', sqlite='SELECT last_insert_rowid()')
+
+# Matches; rows become Match records (records.match_record). The match listings
+# add WHERE, ORDER BY and the page limit with MATCH_LIST.extend (see pagination.py)
+MATCH_LIST = register('matches.list', f'''
+    SELECT {MATCH_COLUMNS}
+    FROM MATCHES M''')
+MATCH_BY_ID = register('matches.by_id', f'SELECT {MATCH_COLUMNS} FROM MATCHES M WHERE M.MatchID = ?')
+MATCH_STATUS = register('matches.status', 'SELECT Status FROM MATCHES WHERE MatchID = ?')
+MATCH_TEAMS = register('matches.teams', 'SELECT HomeTeamID, AwayTeamID, MatchDateTime FROM MATCHES WHERE MatchID = ?')
+# The next fixtures, on the MatchDateTime index (admin and fan dashboards)
+NEXT_MATCHES = register('matches.next', f'''
+    SELECT {MATCH_COLUMNS}
+    FROM MATCHES M
+    WHERE M.MatchDateTime > NOW()
+    ORDER BY M.MatchDateTime
+    LIMIT 5
+''')
+# A team's upcoming fixtures (coach and player dashboards)
+TEAM_UPCOMING_MATCHES = register('matches.team_upcoming', f'''
+    SELECT {MATCH_COLUMNS}
+    FROM MATCHES M
+    WHERE (M.HomeTeamID = ? OR M.AwayTeamID = ?) AND M.MatchDateTime > NOW()
+    ORDER BY M.MatchDateTime
+''')
+# Also used by the season scheduler's bulk insert
+MATCH_INSERT = register('matches.insert', '''
+    INSERT INTO MATCHES (HomeTeamID, AwayTeamID, MatchDateTime, VenueID, Status)
+    VALUES (?, ?, ?, ?, ?)
+''')
+MATCH_SET_SCORE = register('matches.set_score', '''
+    UPDATE MATCHES
+    SET HomeScore = ?, AwayScore = ?, Status = ?
+    WHERE MatchID = ?
+''')
+
+# Fan engagement
+# Feed of a match page
+ENGAGEMENT_FEED = register('engagement.match_feed', '''
+    SELECT U.Username, FE.EngagementDate, FE.EngagementType, FE.Prediction, FE.Comment
+    FROM FAN_ENGAGEMENT FE
+    JOIN FANS F ON FE.FanID = F.FanID
+    JOIN USERS U ON F.UserID = U.UserID
+    WHERE FE.MatchID = ?
+    ORDER BY FE.EngagementDate DESC
+''')
+# A fan's history on the fan dashboard; matches of pruned seasons are looked up in the season archive
+FAN_ENGAGEMENT_HISTORY = register('engagement.fan_history', '''
+    SELECT FE.EngagementDate, FE.EngagementType, FE.Comment, M.MatchDateTime, M.HomeTeamID, M.AwayTeamID,
+           FE.MatchID
+    FROM FAN_ENGAGEMENT FE
+    LEFT JOIN MATCHES M ON FE.MatchID = M.MatchID
+    WHERE FE.FanID = ?
+    ORDER BY FE.EngagementDate DESC
+''')
+
+# Player dashboard
+PLAYER_PHYSIO_RECORDS = register('physio_records.by_player', '''
+    SELECT PR.RecordID, PR.RecordDate, PR.InjuryType, PR.Diagnosis, PR.Treatment,
+           PR.ExpectedRecovery, PR.Status, MS.Specialization, U.Username
+    FROM (PHYSIO_RECORDS PR
+    INNER JOIN MEDICAL_STAFF MS ON PR.StaffID = MS.StaffID)
+    INNER JOIN USERS U ON MS.UserID = U.UserID
+    WHERE PR.PlayerID = ?
+    ORDER BY PR.RecordDate DESC
+''')
+PLAYER_MATCH_STATS = register('player_stats.by_player', '''
+    SELECT PS.StatID, PS.MatchID, PS.Goals, PS.Assists, PS.YellowCards, PS.RedCards,
+           PS.MinutesPlayed, PS.PerformanceRating, M.MatchDateTime, M.HomeTeamID, M.AwayTeamID
+    FROM PLAYER_STATS PS
+    INNER JOIN MATCHES M ON PS.MatchID = M.MatchID
+    WHERE PS.PlayerID = ?
+    ORDER BY M.MatchDateTime DESC
+''')
+
+# Medical records
+PHYSIO_RECORD_INSERT = register('physio_records.insert', '''
+    INSERT INTO PHYSIO_RECORDS
+    (PlayerID, RecordDate, InjuryType, Diagnosis, Treatment, ExpectedRecovery, Status, StaffID)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+''')
+PHYSIO_RECORD_BY_ID = register('physio_records.by_id', 'SELECT PlayerID, RecordDate, InjuryType, StaffID '
+                                                       'FROM PHYSIO_RECORDS WHERE RecordID = ?')
+PHYSIO_RECORD_UPDATE = register('physio_records.update', '''
+    UPDATE PHYSIO_RECORDS
+    SET Diagnosis = ?, Treatment = ?, ExpectedRecovery = ?, Status = ?
+    WHERE RecordID = ?
+''')
+
+
+if __name__ == "__main__":
+    from db_backends import create_backend
+
+    if len(sys.argv) > 2:
+        print("Usage: python queries.py [name]")
+        sys.exit(1)
+    if len(sys.argv) == 1:
+        for name in _registry.names():
+            print(name)
+        sys.exit(0)
+    try:
+        query = _registry.get(sys.argv[1])
+    except KeyError:
+        print(f"No query named {sys.argv[1]}")
+        sys.exit(1)
+    for dialect in DIALECTS:
+        print(f"-- {dialect}")
+        print(query.text_for(create_backend(dialect)).strip())
@@ -0,0 +1,307 @@
+"""
+SQL instrumentation for Sports Management System
+Every pooled cursor is wrapped so each statement's normalized text, parameter
+count, rows returned, execute time and fetch time are recorded. Statements are
+aggregated in a fixed-size table, counted per request (for N+1 detection) and
+written to a slow-query log when they run past the threshold. Statements from
+the query registry (queries.py) also carry their name, so their totals can be
+read per name.
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+import contextvars
+from collections import Counter
+from functools import lru_cache
+
+logger = logging.getLogger('queries')
+
+# Instrumentation settings (can be overridden from the environment)
+SQL_INSTRUMENTATION = os.environ.get('SQL_INSTRUMENTATION', '1') == '1'
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG', 'slow_queries.log')
+QUERY_STATS_SIZE = int(os.environ.get('QUERY_STATS_SIZE', 200))
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 10))
+
+# Slow statements go to their own file so they are easy to tail
+slow_logger = logging.getLogger('queries.slow')
+if SLOW_QUERY_LOG and not slow_logger.handlers:
+    _handler = logging.FileHandler(SLOW_QUERY_LOG)
+    _handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+    slow_logger.addHandler(_handler)
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_SPACE_RE = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=1024)
+def normalize(sql):
+    """Statement text with literals replaced by ? and whitespace collapsed"""
+    text = _STRING_RE.sub('?', sql)
+    text = _NUMBER_RE.sub('?', text)
+    text = _IN_LIST_RE.sub('(?...)', text)
+    return _SPACE_RE.sub(' ', text).strip()
+
+
+class StatementStats:
+    """Running totals for one normalized statement"""
+
+    __slots__ = ('sql', 'name', 'calls', 'exec_time', 'fetch_time', 'max_time', 'rows', 'params', 'error')
+
+    def __init__(self, sql, error=0.0):
+        self.sql = sql
+        self.name = None
+        self.calls = 0
+        self.exec_time = 0.0
+        self.fetch_time = 0.0
+        self.max_time = 0.0
+        self.rows = 0
+        self.params = 0
+        # Total time of the entry this one replaced; an upper bound on what was lost
+        self.error = error
+
+    @property
+    def total_time(self):
+        return self.exec_time + self.fetch_time
+
+    def as_dict(self):
+        calls = self.calls or 1
+        return {
+            'sql': self.sql,
+            'name': self.name,
+            'calls': self.calls,
+            'total_ms': round(self.total_time * 1000, 2),
+            'exec_ms': round(self.exec_time * 1000, 2),
+            'fetch_ms': round(self.fetch_time * 1000, 2),
+            'mean_ms': round(self.total_time * 1000 / calls, 3),
+            'max_ms': round(self.max_time * 1000, 2),
+            'rows': self.rows,
+            'rows_per_call': round(self.rows / calls, 1),
+            'params': self.params,
+            'error_ms': round(self.error * 1000, 2),
+        }
+
+
+class QueryStats:
+    """
+    Fixed-memory table of statement totals. When it is full, a new statement
+    replaces the entry with the least total time (space-saving style), so the
+    expensive statements stay and memory never grows past max_size entries.
+    """
+
+    def __init__(self, max_size=QUERY_STATS_SIZE):
+        self.max_size = max_size
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._evictions = 0
+
+    def _entry(self, sql):
+        entry = self._entries.get(sql)
+        if entry is None:
+            error = 0.0
+            if len(self._entries) >= self.max_size:
+                victim = min(self._entries.values(), key=lambda e: e.total_time)
+                del self._entries[victim.sql]
+                error = victim.total_time
+                self._evictions += 1
+            entry = self._entries[sql] = StatementStats(sql, error)
+        return entry
+
+    def record_execute(self, sql, params, seconds, name=None):
+        with self._lock:
+            entry = self._entry(sql)
+            entry.name = name
+            entry.calls += 1
+            entry.exec_time += seconds
+            entry.params = params
+
+    def record_fetch(self, sql, rows, seconds):
+        with self._lock:
+            entry = self._entry(sql)
+            entry.rows += rows
+            entry.fetch_time += seconds
+
+    def record_max(self, sql, seconds):
+        with self._lock:
+            entry = self._entries.get(sql)
+            if entry is not None and seconds > entry.max_time:
+                entry.max_time = seconds
+
+    def top(self, limit=20, order_by='total_time'):
+        """Statements sorted by total_time, calls, max_time or rows"""
+        with self._lock:
+            entries = sorted(self._entries.values(), key=lambda e: getattr(e, order_by), reverse=True)
+            return [entry.as_dict() for entry in entries[:limit]]
+
+    def by_name(self):
+        """Totals per registry name; the variants of an extended query are added together"""
+        totals = {}
+        with self._lock:
+            for entry in self._entries.values():
+                if entry.name is None:
+                    continue
+                total = totals.setdefault(entry.name, {'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rows': 0})
+                total['calls'] += entry.calls
+                total['total_ms'] += entry.total_time * 1000
+                total['max_ms'] = max(total['max_ms'], entry.max_time * 1000)
+                total['rows'] += entry.rows
+        for total in totals.values():
+            total['mean_ms'] = round(total['total_ms'] / (total['calls'] or 1), 3)
+            total['total_ms'] = round(total['total_ms'], 2)
+            total['max_ms'] = round(total['max_ms'], 2)
+        return totals
+
+    def stats(self):
+        with self._lock:
+            return {'statements': len(self._entries), 'max_size': self.max_size,
+                    'evictions': self._evictions}
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+            self._evictions = 0
+
+
+class RequestQueries:
+    """Statements run while serving one request"""
+
+    __slots__ = ('label', 'count', 'time', 'statements', '_lock')
+
+    def __init__(self, label):
+        self.label = label
+        self.count = 0
+        self.time = 0.0
+        self.statements = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, sql, seconds):
+        # Worker threads started with a copied context share this object
+        with self._lock:
+            self.count += 1
+            self.time += seconds
+            self.statements[sql] += 1
+
+    def add_time(self, seconds):
+        with self._lock:
+            self.time += seconds
+
+    def repeated(self, threshold=N_PLUS_ONE_THRESHOLD):
+        """Statements run at least threshold times - likely N+1 loops"""
+        return [(sql, count) for sql, count in self.statements.most_common() if count >= threshold]
+
+
+_stats = QueryStats()
+_current = contextvars.ContextVar('current_request_queries', default=None)
+
+
+def get_query_stats():
+    return _stats
+
+
+def begin_request(label):
+    """Start counting statements for the current request; returns the token for end_request"""
+    return _current.set(RequestQueries(label))
+
+
+def end_request(token):
+    """Stop counting; logs likely N+1 patterns and returns the RequestQueries"""
+    queries = _current.get()
+    _current.reset(token)
+    if queries is not None:
+        for sql, count in queries.repeated():
+            logger.warning(f"Possible N+1 in {queries.label}: {count} x {sql}")
+    return queries
+
+
+def current_request():
+    return _current.get()
+
+
+class InstrumentedCursor:
+    """Cursor wrapper that times execute and fetch calls"""
+
+    def __init__(self, raw):
+        self._raw = raw
+        self._sql = None
+        self._elapsed = 0.0
+        self._slow_logged = False
+
+    def _record_execute(self, sql, params, seconds):
+        self._sql = normalize(sql)
+        self._elapsed = seconds
+        self._slow_logged = False
+        _stats.record_execute(self._sql, params, seconds, getattr(sql, 'name', None))
+        _stats.record_max(self._sql, seconds)
+        queries = _current.get()
+        if queries is not None:
+            queries.add(self._sql, seconds)
+        self._check_slow()
+
+    def _record_fetch(self, rows, seconds):
+        if self._sql is None:
+            return
+        self._elapsed += seconds
+        _stats.record_fetch(self._sql, rows, seconds)
+        _stats.record_max(self._sql, self._elapsed)
+        queries = _current.get()
+        if queries is not None:
+            queries.add_time(seconds)
+        self._check_slow()
+
+    def _check_slow(self):
+        if not self._slow_logged and self._elapsed * 1000 >= SLOW_QUERY_MS:
+            self._slow_logged = True
+            queries = _current.get()
+            where = queries.label if queries is not None else '-'
+            slow_logger.warning(f"{self._elapsed * 1000:.1f} ms [{where}] {self._sql}")
+
+    def execute(self, sql, params=()):
+        start = time.perf_counter()
+        self._raw.execute(sql, params)
+        self._record_execute(sql, len(params), time.perf_counter() - start)
+        return self
+
+    def executemany(self, sql, params_list):
+        params_list = list(params_list)
+        start = time.perf_counter()
+        self._raw.executemany(sql, params_list)
+        self._record_execute(sql, sum(len(params) for params in params_list), time.perf_counter() - start)
+        return self
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = self._raw.fetchone()
+        self._record_fetch(0 if row is None else 1, time.perf_counter() - start)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = self._raw.fetchmany(size) if size is not None else self._raw.fetchmany()
+        self._record_fetch(len(rows), time.perf_counter() - start)
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = self._raw.fetchall()
+        self._record_fetch(len(rows), time.perf_counter() - start)
+        return rows
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+def instrument(cursor):
+    """Wrap cursor when instrumentation is switched on"""
+    return InstrumentedCursor(cursor) if SQL_INSTRUMENTATION else cursor
@@ -0,0 +1,124 @@
+"""
+Row records for Sports Management System
+Query results are mapped onto small __slots__ records (Match, PlayerStat,
+PhysioRecord, Engagement) instead of reaching templates as driver rows, so
+templates use names (match.home_team) rather than positions (match[8]).
+Each query selects only the columns its view renders, rows are read from the
+cursor with fetchmany in chunks of FETCH_CHUNK, and team and venue names are
+filled in from the reference cache as each record is built, on the thread
+that runs the query.
+"""
+
+import os
+
+from reference_cache import team_name, venue
+
+FETCH_CHUNK = int(os.environ.get('FETCH_CHUNK', 500))
+
+
+class Record:
+    """A fixed set of named slots; slots a query does not select are None"""
+
+    __slots__ = ()
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            setattr(self, name, values.get(name))
+        self.resolve()
+
+    def resolve(self):
+        """Fill in the slots derived from the selected columns (names from the reference cache)"""
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+def _team(team_id):
+    return team_name(team_id) if team_id is not None else None
+
+
+class Match(Record):
+    __slots__ = ('match_id', 'home_team_id', 'away_team_id', 'match_datetime', 'venue_id',
+                 'status', 'home_score', 'away_score', 'home_team', 'away_team', 'venue_name', 'location')
+
+    def resolve(self):
+        self.home_team = _team(self.home_team_id)
+        self.away_team = _team(self.away_team_id)
+        venue_row = venue(self.venue_id) if self.venue_id is not None else None
+        self.venue_name, self.location = (venue_row[1], venue_row[2]) if venue_row else (None, None)
+
+
+class PlayerStat(Record):
+    __slots__ = ('stat_id', 'match_id', 'goals', 'assists', 'yellow_cards', 'red_cards',
+                 'minutes_played', 'performance_rating', 'match_datetime', 'home_team_id', 'away_team_id',
+                 'home_team', 'away_team')
+
+    def resolve(self):
+        self.home_team = _team(self.home_team_id)
+        self.away_team = _team(self.away_team_id)
+
+
+class PhysioRecord(Record):
+    __slots__ = ('record_id', 'player_id', 'record_date', 'injury_type', 'diagnosis', 'treatment',
+                 'expected_recovery', 'status', 'staff_id', 'full_name', 'position', 'team_id',
+                 'team_name', 'specialization', 'staff_name')
+
+    def resolve(self):
+        self.team_name = _team(self.team_id)
+
+
+class Engagement(Record):
+    __slots__ = ('engagement_id', 'fan_id', 'match_id', 'prediction', 'engagement_date',
+                 'engagement_type', 'comment', 'username', 'match_datetime', 'home_team_id', 'away_team_id',
+                 'home_team', 'away_team')
+
+    def resolve(self):
+        self.home_team = _team(self.home_team_id)
+        self.away_team = _team(self.away_team_id)
+
+
+# Column lists for the MATCHES rows every match view renders
+MATCH_FIELDS = 'match_id home_team_id away_team_id match_datetime venue_id status home_score away_score'
+MATCH_COLUMNS = 'M.MatchID, M.HomeTeamID, M.AwayTeamID, M.MatchDateTime, M.VenueID, M.Status, M.HomeScore, M.AwayScore'
+
+
+def mapper(record, fields):
+    """row -> record for rows whose columns are fields (names, in order)"""
+    fields = tuple(fields.split()) if isinstance(fields, str) else tuple(fields)
+    unknown = set(fields) - set(record.__slots__)
+    if unknown:
+        raise ValueError(f"{record.__name__} has no fields {', '.join(sorted(unknown))}")
+    rest = tuple(name for name in record.__slots__ if name not in fields)
+
+    def build(row):
+        item = record.__new__(record)
+        for name, value in zip(fields, row):
+            setattr(item, name, value)
+        for name in rest:
+            setattr(item, name, None)
+        item.resolve()
+        return item
+    return build
+
+
+match_record = mapper(Match, MATCH_FIELDS)
+
+
+def iter_records(cursor, build, chunk=FETCH_CHUNK):
+    """Records for the rows of the cursor's current result, read chunk rows at a time"""
+    while True:
+        rows = cursor.fetchmany(chunk)
+        if not rows:
+            return
+        for row in rows:
+            yield build(row)
+
+
+def fetch_records(cursor, build, sql, params=(), chunk=FETCH_CHUNK):
+    """Run sql and return its rows as records"""
+    cursor.execute(sql, params)
+    return list(iter_records(cursor, build, chunk))
@@ -0,0 +1,170 @@
+"""
+Read-through cache for reference data (teams and venues)
+Keeps the small, rarely written TEAMS and VENUES tables in memory so the
+routes can fill dropdowns and resolve names without querying them again
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import events
+from db_pool import get_pool
+
+logger = logging.getLogger('database')
+
+CACHE_TTL = float(os.environ.get('REFERENCE_CACHE_TTL', 300))
+CACHE_SIZE = int(os.environ.get('REFERENCE_CACHE_SIZE', 10000))
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after ttl seconds"""
+
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING or entry[1] < time.monotonic():
+                if entry is not _MISSING:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_prefix(self, prefix):
+        """Drop every tuple key whose first element is prefix"""
+        with self._lock:
+            for key in [k for k in self._data if isinstance(k, tuple) and k[0] == prefix]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._data), 'maxsize': self.maxsize,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+_cache = TTLCache()
+_load_lock = threading.Lock()
+
+
+def _load(table):
+    # One loader at a time so a cold cache does not stampede the database
+    with _load_lock:
+        rows = _cache.get((table, 'all'))
+        if rows is not None:
+            return rows
+
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            if table == 'teams':
+                cursor.execute('SELECT TeamID, TeamName FROM TEAMS ORDER BY TeamName')
+            else:
+                cursor.execute('SELECT VenueID, VenueName, Location FROM VENUES ORDER BY VenueName')
+            rows = [tuple(row) for row in cursor.fetchall()]
+
+        _cache.set((table, 'all'), rows)
+        for row in rows:
+            _cache.set((table, row[0]), row)
+        logger.info(f"Loaded {len(rows)} {table} into the reference cache")
+        return rows
+
+
+def get_teams():
+    """All teams as (TeamID, TeamName) tuples"""
+    rows = _cache.get(('teams', 'all'))
+    return rows if rows is not None else _load('teams')
+
+
+def get_venues():
+    """All venues as (VenueID, VenueName, Location) tuples"""
+    rows = _cache.get(('venues', 'all'))
+    return rows if rows is not None else _load('venues')
+
+
+def _lookup(table, key_id):
+    row = _cache.get((table, key_id))
+    if row is None:
+        # Unknown or evicted id: reload the table once
+        _cache.delete((table, 'all'))
+        _load(table)
+        row = _cache.get((table, key_id))
+        if row is None:
+            # Remember the miss briefly so bad ids do not trigger reload storms
+            _cache.set((table, key_id), (), ttl=30)
+    return row or None
+
+
+def team_name(team_id):
+    row = _lookup('teams', team_id)
+    return row[1] if row else None
+
+
+def venue(venue_id):
+    """(VenueID, VenueName, Location) for venue_id, or None"""
+    return _lookup('venues', venue_id)
+
+
+def with_match_names(rows, location=False):
+    """
+    Append HomeTeam, AwayTeam, VenueName (and Location) to MATCHES rows
+    fetched with SELECT M.*, giving the same layout as the TEAMS/VENUES joins.
+    """
+    result = []
+    for row in rows:
+        venue_row = venue(row[4]) or (row[4], None, None)
+        names = (team_name(row[1]), team_name(row[2]), venue_row[1])
+        if location:
+            names += (venue_row[2],)
+        result.append(tuple(row) + names)
+    return result
+
+
+def with_team_names(rows):
+    """Replace trailing HomeTeamID, AwayTeamID columns with the team names"""
+    return [tuple(row[:-2]) + (team_name(row[-2]), team_name(row[-1])) for row in rows]
+
+
+def invalidate_teams(**payload):
+    _cache.delete_prefix('teams')
+
+
+def invalidate_venues(**payload):
+    _cache.delete_prefix('venues')
+
+
+def cache_stats():
+    return _cache.stats()
+
+
+# Drop cached rows as soon as a team or venue is written
+events.subscribe(events.TEAM_WRITTEN, invalidate_teams)
+events.subscribe(events.VENUE_WRITTEN, invalidate_venues)
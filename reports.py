@@ -0,0 +1,838 @@
+"""
+Report engine for Sports Management System
+Season summaries, team, player and fan engagement reports, written out as CSV
+or JSON by generators so an export of any number of seasons is streamed a
+chunk of rows at a time. Each report is a list of sections: the aggregate
+sections are independent of each other and are computed in a process pool,
+while the row-per-match sections are read from the cursor with fetchmany as
+the output is written. Archived seasons are read from their snapshots
+(season_archive.py), whose matches may be gone from MATCHES. Long reports can be queued as jobs that write to
+REPORT_DIR on a background thread instead of holding a web worker.
+
+Usage:
+    python reports.py season [2024 | 2022-2024] [--format csv|json] [--output season.csv]
+    python reports.py team <team_id> [seasons] [--format json]
+    python reports.py player <player_id> [seasons]
+    python reports.py engagement [seasons]
+"""
+
+import os
+import csv
+import sys
+import json
+import heapq
+import queue
+import uuid
+import atexit
+import logging
+import argparse
+import threading
+import multiprocessing
+from datetime import datetime, date
+from decimal import Decimal
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from db_pool import get_pool
+from records import MATCH_COLUMNS, iter_records, match_record
+from queries import register
+from reference_cache import team_name
+from standings import TeamRecord
+from player_analytics import SEASON_START_MONTH, season_for
+from fan_engagement import ENGAGEMENT_TYPES
+from season_archive import get_archive
+
+logger = logging.getLogger('reports')
+
+# Report settings (can be overridden from the environment)
+REPORT_WORKERS = int(os.environ.get('REPORT_WORKERS', min(4, os.cpu_count() or 2)))
+REPORT_SECTION_TIMEOUT = float(os.environ.get('REPORT_SECTION_TIMEOUT', 300))
+REPORT_DIR = os.environ.get('REPORT_DIR', './reports')
+REPORT_JOB_WORKERS = int(os.environ.get('REPORT_JOB_WORKERS', 1))
+REPORT_QUEUE_LIMIT = int(os.environ.get('REPORT_QUEUE_LIMIT', 20))
+REPORT_JOB_HISTORY = int(os.environ.get('REPORT_JOB_HISTORY', 50))
+REPORT_TOP = int(os.environ.get('REPORT_TOP', 10))
+MAX_SEASONS = 50
+LINES_PER_CHUNK = 500
+
+FORMATS = {'csv': 'text/csv', 'json': 'application/json'}
+
+
+class InvalidReport(ValueError):
+    """Unknown report or format, or parameters it cannot be run with"""
+
+
+class ReportsBusy(Exception):
+    """Raised when the job queue is full; the admin should retry later"""
+
+
+# What a report is run for; a namedtuple so it pickles into the pool workers
+ReportParams = namedtuple('ReportParams', 'first_season last_season team_id player_id')
+
+
+def season_bounds(season):
+    """[start, end) of a season given by its starting year"""
+    return datetime(season, SEASON_START_MONTH, 1), datetime(season + 1, SEASON_START_MONTH, 1)
+
+
+def _range(params):
+    return season_bounds(params.first_season)[0], season_bounds(params.last_season)[1]
+
+
+def _seasons(params):
+    return range(params.first_season, params.last_season + 1)
+
+
+# SQL used by the sections
+MATCHES_IN_RANGE_SQL = register('reports.matches_in_range', f'''
+    SELECT {MATCH_COLUMNS}
+    FROM MATCHES M
+    WHERE M.MatchDateTime >= ? AND M.MatchDateTime < ?
+    ORDER BY M.MatchDateTime, M.MatchID
+''')
+SEASON_RESULTS_SQL = register('reports.season_results', '''
+    SELECT M.Status, M.HomeScore, M.AwayScore
+    FROM MATCHES M
+    WHERE M.MatchDateTime >= ? AND M.MatchDateTime < ?
+''')
+TEAM_MATCHES_SQL = register('reports.team_matches', f'''
+    SELECT {MATCH_COLUMNS}
+    FROM MATCHES M
+    WHERE M.MatchDateTime >= ? AND M.MatchDateTime < ? AND (M.HomeTeamID = ? OR M.AwayTeamID = ?)
+    ORDER BY M.MatchDateTime, M.MatchID
+''')
+# Rating total and count rather than AVG, so seasons can be added up
+PLAYER_TOTALS_SQL = register('reports.player_totals', '''
+    SELECT PS.PlayerID, COUNT(*), SUM(PS.Goals), SUM(PS.Assists), SUM(PS.YellowCards),
+           SUM(PS.RedCards), SUM(PS.MinutesPlayed), SUM(PS.PerformanceRating), COUNT(PS.PerformanceRating)
+    FROM PLAYER_STATS PS
+    JOIN MATCHES M ON PS.MatchID = M.MatchID
+    WHERE M.MatchDateTime >= ? AND M.MatchDateTime < ?
+    GROUP BY PS.PlayerID
+''')
+TEAM_PLAYER_TOTALS_SQL = register('reports.team_player_totals', '''
+    SELECT PS.PlayerID, COUNT(*), SUM(PS.Goals), SUM(PS.Assists), SUM(PS.YellowCards),
+           SUM(PS.RedCards), SUM(PS.MinutesPlayed), SUM(PS.PerformanceRating), COUNT(PS.PerformanceRating)
+    FROM PLAYER_STATS PS
+    JOIN MATCHES M ON PS.MatchID = M.MatchID
+    JOIN PLAYERS P ON PS.PlayerID = P.PlayerID
+    WHERE M.MatchDateTime >= ? AND M.MatchDateTime < ? AND P.TeamID = ?
+    GROUP BY PS.PlayerID
+''')
+PLAYER_LINES_SQL = register('reports.player_lines', '''
+    SELECT M.MatchDateTime, M.MatchID, M.HomeTeamID, M.AwayTeamID, M.HomeScore, M.AwayScore,
+           PS.Goals, PS.Assists, PS.YellowCards, PS.RedCards, PS.MinutesPlayed, PS.PerformanceRating
+    FROM PLAYER_STATS PS
+    JOIN MATCHES M ON PS.MatchID = M.MatchID
+    WHERE PS.PlayerID = ? AND M.MatchDateTime >= ? AND M.MatchDateTime < ?
+    ORDER BY M.MatchDateTime
+''')
+PLAYERS_SQL = register('reports.players', 'SELECT PlayerID, FullName, Position, TeamID FROM PLAYERS')
+PLAYER_SQL = register('reports.player',
+                      'SELECT PlayerID, FullName, Position, TeamID FROM PLAYERS WHERE PlayerID = ?')
+TEAM_INJURIES_SQL = register('reports.team_injuries', '''
+    SELECT PR.PlayerID, PR.RecordDate, PR.InjuryType, PR.ExpectedRecovery, PR.Status
+    FROM PHYSIO_RECORDS PR
+    JOIN PLAYERS P ON PR.PlayerID = P.PlayerID
+    WHERE P.TeamID = ? AND PR.RecordDate >= ? AND PR.RecordDate < ?
+    ORDER BY PR.RecordDate
+''')
+PLAYER_INJURIES_SQL = register('reports.player_injuries', '''
+    SELECT PR.PlayerID, PR.RecordDate, PR.InjuryType, PR.ExpectedRecovery, PR.Status
+    FROM PHYSIO_RECORDS PR
+    WHERE PR.PlayerID = ? AND PR.RecordDate >= ? AND PR.RecordDate < ?
+    ORDER BY PR.RecordDate
+''')
+ENGAGEMENT_TYPES_SQL = register('reports.engagement_types', '''
+    SELECT FE.EngagementType, COUNT(*)
+    FROM FAN_ENGAGEMENT FE
+    JOIN MATCHES M ON FE.MatchID = M.MatchID
+    WHERE M.MatchDateTime >= ? AND M.MatchDateTime < ?
+    GROUP BY FE.EngagementType
+''')
+TOP_FANS_SQL = register('reports.top_fans', '''
+    SELECT FE.FanID, COUNT(*)
+    FROM FAN_ENGAGEMENT FE
+    JOIN MATCHES M ON FE.MatchID = M.MatchID
+    WHERE M.MatchDateTime >= ? AND M.MatchDateTime < ?
+    GROUP BY FE.FanID
+''')
+FAN_NAME_SQL = register('reports.fan_name', '''
+    SELECT U.Username, F.MembershipType
+    FROM FANS F
+    JOIN USERS U ON F.UserID = U.UserID
+    WHERE F.FanID = ?
+''')
+MATCH_ENGAGEMENT_SQL = register('reports.match_engagement', '''
+    SELECT M.MatchID, M.MatchDateTime, M.HomeTeamID, M.AwayTeamID, FE.EngagementType, COUNT(*)
+    FROM FAN_ENGAGEMENT FE
+    JOIN MATCHES M ON FE.MatchID = M.MatchID
+    WHERE M.MatchDateTime >= ? AND M.MatchDateTime < ?
+    GROUP BY M.MatchID, M.MatchDateTime, M.HomeTeamID, M.AwayTeamID, FE.EngagementType
+    ORDER BY M.MatchDateTime, M.MatchID
+''')
+
+
+def _rows(cursor, sql, params):
+    """Raw rows of a query, read FETCH_CHUNK at a time"""
+    cursor.execute(sql, params)
+    return iter_records(cursor, tuple)
+
+
+def _rating(value):
+    return round(float(value), 2) if value is not None else None
+
+
+def _average(total, count):
+    return round(total / count, 2) if count else None
+
+
+def _score(match):
+    if match.home_score is None or match.away_score is None:
+        return ''
+    return f"{match.home_score}-{match.away_score}"
+
+
+def _players(cursor):
+    return {row[0]: row for row in _rows(cursor, PLAYERS_SQL, ())}
+
+
+# Sources. Each reads one season, from its snapshot once it is archived, otherwise with SQL.
+
+def _season_results(cursor, season):
+    """(Status, HomeScore, AwayScore) of every match in a season"""
+    snapshot = get_archive().snapshot(season)
+    if snapshot is None:
+        return _rows(cursor, SEASON_RESULTS_SQL, season_bounds(season))
+    return (snapshot.row(i)[5:8] for i in range(len(snapshot)))
+
+
+def _season_matches(cursor, season, team_id=None):
+    """Match records of a season (or of team_id's matches in it) in kick-off order"""
+    snapshot = get_archive().snapshot(season)
+    if snapshot is not None:
+        filters = {'team_id': team_id} if team_id is not None else {}
+        return (match_record(snapshot.row(i)) for i in snapshot.page(False, None, filters, len(snapshot)))
+    if team_id is None:
+        cursor.execute(MATCHES_IN_RANGE_SQL, season_bounds(season))
+    else:
+        cursor.execute(TEAM_MATCHES_SQL, (*season_bounds(season), team_id, team_id))
+    return iter_records(cursor, match_record)
+
+
+def _player_totals(cursor, season, team_id=None, players=None):
+    """player_id -> [appearances, goals, assists, yellow, red, minutes, rating total, rated] for a season"""
+    snapshot = get_archive().snapshot(season)
+    if snapshot is not None:
+        totals = snapshot.player_totals()
+        if team_id is not None:
+            # The current squad, as the live query's join to PLAYERS gives
+            totals = {player_id: line for player_id, line in totals.items()
+                      if player_id in players and players[player_id][3] == team_id}
+        return totals
+    if team_id is None:
+        rows = _rows(cursor, PLAYER_TOTALS_SQL, season_bounds(season))
+    else:
+        rows = _rows(cursor, TEAM_PLAYER_TOTALS_SQL, (*season_bounds(season), team_id))
+    return {row[0]: [value or 0 for value in row[1:7]] + [float(row[7] or 0), row[8] or 0] for row in rows}
+
+
+def _player_lines(cursor, player_id, season):
+    """PLAYER_LINES_SQL rows of a player in a season"""
+    snapshot = get_archive().snapshot(season)
+    if snapshot is not None:
+        return snapshot.player_lines(player_id)
+    return _rows(cursor, PLAYER_LINES_SQL, (player_id, *season_bounds(season)))
+
+
+def _engagement_types(cursor, season):
+    snapshot = get_archive().snapshot(season)
+    if snapshot is not None:
+        return snapshot.engagement_counts()
+    return dict(_rows(cursor, ENGAGEMENT_TYPES_SQL, season_bounds(season)))
+
+
+def _fan_engagement(cursor, season):
+    """fan_id -> engagements on a season's matches"""
+    snapshot = get_archive().snapshot(season)
+    if snapshot is None:
+        return dict(_rows(cursor, TOP_FANS_SQL, season_bounds(season)))
+    totals = {}
+    for (fan_id, _), count in snapshot.engagement_counts('fan_id').items():
+        totals[fan_id] = totals.get(fan_id, 0) + count
+    return totals
+
+
+def _match_engagement(cursor, season):
+    """MATCH_ENGAGEMENT_SQL rows of a season: one per (match, type), in kick-off order"""
+    snapshot = get_archive().snapshot(season)
+    if snapshot is None:
+        return _rows(cursor, MATCH_ENGAGEMENT_SQL, season_bounds(season))
+    rows = []
+    for (match_id, kind), total in snapshot.engagement_counts('match_id').items():
+        match = snapshot.row(snapshot.find(match_id))
+        rows.append((match_id, match[3], match[1], match[2], kind, total))
+    return sorted(rows, key=lambda row: (row[1], row[0]))
+
+
+# Sections. Each takes (cursor, params) and yields tuples in the order of its columns.
+# Pooled sections run in the worker processes and must stay module level.
+
+def season_summary(cursor, params):
+    for season in _seasons(params):
+        matches = completed = cancelled = goals = home_wins = draws = away_wins = 0
+        for status, home_score, away_score in _season_results(cursor, season):
+            matches += 1
+            if status == 'Cancelled':
+                cancelled += 1
+            if status != 'Completed' or home_score is None or away_score is None:
+                continue
+            completed += 1
+            goals += home_score + away_score
+            if home_score > away_score:
+                home_wins += 1
+            elif home_score < away_score:
+                away_wins += 1
+            else:
+                draws += 1
+        if matches:
+            yield (season, matches, completed, cancelled, goals,
+                   round(goals / completed, 2) if completed else None, home_wins, draws, away_wins)
+
+
+def _team_records(matches):
+    records = {}
+    for match in matches:
+        if match.status != 'Completed' or match.home_score is None or match.away_score is None:
+            continue
+        for team_id, scored, conceded in ((match.home_team_id, match.home_score, match.away_score),
+                                          (match.away_team_id, match.away_score, match.home_score)):
+            record = records.get(team_id)
+            if record is None:
+                record = records[team_id] = TeamRecord(team_id)
+            record._add(match.match_datetime, match.match_id, int(scored), int(conceded), 1)
+    return records
+
+
+def league_table(cursor, params):
+    for season in _seasons(params):
+        records = _team_records(_season_matches(cursor, season))
+        ordered = sorted(records.values(), key=lambda r: (-r.points, -r.goal_difference, -r.goals_for))
+        for position, record in enumerate(ordered, 1):
+            yield (season, position, team_name(record.team_id), record.played, record.wins, record.draws,
+                   record.losses, record.goals_for, record.goals_against, record.goal_difference,
+                   record.points, record.form)
+
+
+def top_scorers(cursor, params):
+    players = _players(cursor)
+    for season in _seasons(params):
+        totals = _player_totals(cursor, season)
+        best = heapq.nlargest(REPORT_TOP, totals.items(), key=lambda item: (item[1][1], item[1][2]))
+        for rank, (player_id, (appearances, goals, assists, _, _, _, rating, rated)) in enumerate(best, 1):
+            player = players.get(player_id, (player_id, None, None, None))
+            yield (season, rank, player[1], player[2], team_name(player[3]) if player[3] else None,
+                   appearances, goals, assists, _average(rating, rated))
+
+
+def engagement_by_type(cursor, params):
+    for season in _seasons(params):
+        counts = _engagement_types(cursor, season)
+        if counts:
+            yield (season, *(counts.get(kind, 0) for kind in ENGAGEMENT_TYPES), sum(counts.values()))
+
+
+def top_fans(cursor, params):
+    totals = {}
+    for season in _seasons(params):
+        for fan_id, engagements in _fan_engagement(cursor, season).items():
+            totals[fan_id] = totals.get(fan_id, 0) + engagements
+    for rank, (fan_id, engagements) in enumerate(heapq.nlargest(REPORT_TOP * 2, totals.items(),
+                                                                key=lambda item: item[1]), 1):
+        cursor.execute(FAN_NAME_SQL, (fan_id,))
+        fan = cursor.fetchone() or (None, None)
+        yield (rank, fan_id, fan[0], fan[1], engagements)
+
+
+def season_matches(cursor, params):
+    for season in _seasons(params):
+        for match in _season_matches(cursor, season):
+            yield (season, match.match_id, match.match_datetime, match.home_team,
+                   match.away_team, _score(match), match.status, match.venue_name)
+
+
+def match_engagement(cursor, params):
+    # Rows arrive one per (match, type); pivot them a match at a time
+    current, counts = None, {}
+    for season in _seasons(params):
+        for match_id, match_datetime, home_team_id, away_team_id, kind, total in _match_engagement(cursor, season):
+            if current and current[0] != match_id:
+                yield (*current, *(counts.get(k, 0) for k in ENGAGEMENT_TYPES), sum(counts.values()))
+                counts = {}
+            current = (match_id, match_datetime, team_name(home_team_id), team_name(away_team_id))
+            counts[kind] = total
+    if current:
+        yield (*current, *(counts.get(k, 0) for k in ENGAGEMENT_TYPES), sum(counts.values()))
+
+
+def team_summary(cursor, params):
+    for season in _seasons(params):
+        record = _team_records(_season_matches(cursor, season, params.team_id)).get(params.team_id)
+        if record:
+            yield (season, record.played, record.wins, record.draws, record.losses, record.goals_for,
+                   record.goals_against, record.goal_difference, record.points, record.form)
+
+
+def team_squad(cursor, params):
+    players = _players(cursor)
+    totals = {}
+    for season in _seasons(params):
+        for player_id, line in _player_totals(cursor, season, params.team_id, players).items():
+            total = totals.get(player_id)
+            if total is None:
+                total = totals[player_id] = [0, 0, 0, 0, 0, 0, 0.0, 0]
+            for index, value in enumerate(line):
+                total[index] += value
+    ordered = sorted(totals.items(), key=lambda item: (-item[1][1], -item[1][0]))
+    for player_id, (appearances, goals, assists, yellow, red, minutes, rating, rated) in ordered:
+        player = players.get(player_id, (player_id, None, None, None))
+        yield (player_id, player[1], player[2], appearances, goals, assists,
+               yellow, red, minutes, _average(rating, rated))
+
+
+def _injuries(cursor, sql, owner_id, params, players):
+    start, end = _range(params)
+    for player_id, record_date, injury_type, expected_recovery, status in _rows(cursor, sql, (owner_id, start, end)):
+        yield (record_date, player_id, players[player_id][1] if player_id in players else None,
+               injury_type, status, expected_recovery)
+
+
+def team_injuries(cursor, params):
+    return _injuries(cursor, TEAM_INJURIES_SQL, params.team_id, params, _players(cursor))
+
+
+def team_results(cursor, params):
+    for season in _seasons(params):
+        for match in _season_matches(cursor, season, params.team_id):
+            home = match.home_team_id == params.team_id
+            yield (season, match.match_id, match.match_datetime,
+                   match.away_team if home else match.home_team, 'H' if home else 'A',
+                   _score(match), match.status, match.venue_name)
+
+
+def player_summary(cursor, params):
+    seasons = OrderedDict()
+    for season in _seasons(params):
+        for row in _player_lines(cursor, params.player_id, season):
+            totals = seasons.get(season)
+            if totals is None:
+                totals = seasons[season] = [0, 0, 0, 0, 0, 0, 0.0, 0]
+            totals[0] += 1
+            for index, value in enumerate(row[6:11], 1):
+                totals[index] += value or 0
+            if row[11] is not None:
+                totals[6] += float(row[11])
+                totals[7] += 1
+    for season, (appearances, goals, assists, yellow, red, minutes, rating, rated) in seasons.items():
+        yield (season, appearances, goals, assists, yellow, red, minutes, _average(rating, rated))
+
+
+def player_injuries(cursor, params):
+    cursor.execute(PLAYER_SQL, (params.player_id,))
+    player = cursor.fetchone()
+    return _injuries(cursor, PLAYER_INJURIES_SQL, params.player_id, params,
+                     {player[0]: tuple(player)} if player else {})
+
+
+def player_matches(cursor, params):
+    cursor.execute(PLAYER_SQL, (params.player_id,))
+    player = cursor.fetchone()
+    team_id = player[3] if player else None
+    for season in _seasons(params):
+        for row in _player_lines(cursor, params.player_id, season):
+            match_datetime, match_id, home_team_id, away_team_id, home_score, away_score = row[:6]
+            home = home_team_id == team_id
+            score = f"{home_score}-{away_score}" if home_score is not None and away_score is not None else ''
+            yield (season, match_id, match_datetime,
+                   team_name(away_team_id if home else home_team_id), 'H' if home else 'A', score,
+                   *(value or 0 for value in row[6:11]), _rating(row[11]))
+
+
+Section = namedtuple('Section', 'name title columns compute pooled')
+Report = namedtuple('Report', 'name title needs sections')
+
+_PLAYER_TOTAL_COLUMNS = ('appearances', 'goals', 'assists', 'yellow_cards', 'red_cards', 'minutes', 'avg_rating')
+_ENGAGEMENT_COLUMNS = tuple(kind.lower() for kind in ENGAGEMENT_TYPES) + ('total',)
+
+REPORTS = OrderedDict((report.name, report) for report in (
+    Report('season', 'Season summary', None, (
+        Section('summary', 'Summary', ('season', 'matches', 'completed', 'cancelled', 'goals',
+                                       'goals_per_match', 'home_wins', 'draws', 'away_wins'), season_summary, True),
+        Section('table', 'League table', ('season', 'position', 'team', 'played', 'won', 'drawn', 'lost',
+                                          'goals_for', 'goals_against', 'goal_difference', 'points', 'form'),
+                league_table, True),
+        Section('top_scorers', 'Top scorers', ('season', 'rank', 'player', 'position', 'team',
+                                               'appearances', 'goals', 'assists', 'avg_rating'), top_scorers, True),
+        Section('engagement', 'Fan engagement', ('season',) + _ENGAGEMENT_COLUMNS, engagement_by_type, True),
+        Section('matches', 'Matches', ('season', 'match_id', 'kickoff', 'home_team', 'away_team', 'score',
+                                       'status', 'venue'), season_matches, False),
+    )),
+    Report('team', 'Team report', 'team_id', (
+        Section('summary', 'Season record', ('season', 'played', 'won', 'drawn', 'lost', 'goals_for',
+                                             'goals_against', 'goal_difference', 'points', 'form'),
+                team_summary, True),
+        Section('squad', 'Squad', ('player_id', 'player', 'position') + _PLAYER_TOTAL_COLUMNS, team_squad, True),
+        Section('injuries', 'Injuries', ('record_date', 'player_id', 'player', 'injury_type', 'status',
+                                         'expected_recovery'), team_injuries, True),
+        Section('results', 'Results', ('season', 'match_id', 'kickoff', 'opponent', 'venue_side', 'score',
+                                       'status', 'venue'), team_results, False),
+    )),
+    Report('player', 'Player report', 'player_id', (
+        Section('summary', 'Season totals', ('season',) + _PLAYER_TOTAL_COLUMNS, player_summary, True),
+        Section('injuries', 'Injuries', ('record_date', 'player_id', 'player', 'injury_type', 'status',
+                                         'expected_recovery'), player_injuries, True),
+        Section('matches', 'Match log', ('season', 'match_id', 'kickoff', 'opponent', 'venue_side', 'score',
+                                         'goals', 'assists', 'yellow_cards', 'red_cards', 'minutes', 'rating'),
+                player_matches, False),
+    )),
+    Report('engagement', 'Attendance and engagement', None, (
+        Section('by_type', 'By season', ('season',) + _ENGAGEMENT_COLUMNS, engagement_by_type, True),
+        Section('top_fans', 'Most engaged fans', ('rank', 'fan_id', 'username', 'membership', 'engagements'),
+                top_fans, True),
+        Section('by_match', 'By match', ('match_id', 'kickoff', 'home_team', 'away_team') + _ENGAGEMENT_COLUMNS,
+                match_engagement, False),
+    )),
+))
+
+
+def parse_params(report, seasons=None, team_id=None, player_id=None):
+    """ReportParams for a report, from request or command line values"""
+    spec = REPORTS.get(report)
+    if spec is None:
+        raise InvalidReport(f"Report must be one of {', '.join(REPORTS)}")
+
+    seasons = (seasons or '').strip()
+    try:
+        if not seasons:
+            first = last = season_for(datetime.now())
+        elif '-' in seasons:
+            first, last = (int(part) for part in seasons.split('-', 1))
+        else:
+            first = last = int(seasons)
+    except ValueError:
+        raise InvalidReport('Seasons must be a year such as 2024 or a range such as 2022-2024')
+    if first > last or last - first >= MAX_SEASONS:
+        raise InvalidReport(f"Seasons must run forwards and cover at most {MAX_SEASONS} seasons")
+
+    params = {'team_id': None, 'player_id': None}
+    if spec.needs:
+        value = team_id if spec.needs == 'team_id' else player_id
+        try:
+            params[spec.needs] = int(value)
+        except (TypeError, ValueError):
+            raise InvalidReport(f"The {spec.title.lower()} needs a {spec.needs.replace('_id', '')}")
+    return ReportParams(first, last, params['team_id'], params['player_id'])
+
+
+# Runs inside the worker processes, so it must stay module level
+def _compute(report, section_name, params):
+    section = next(s for s in REPORTS[report].sections if s.name == section_name)
+    with get_pool().connection() as conn:
+        return list(section.compute(conn.cursor(), params))
+
+
+def _streamed(section, params):
+    with get_pool().connection() as conn:
+        yield from section.compute(conn.cursor(), params)
+
+
+class ReportEngine:
+    """Process pool for the aggregate sections and the CSV/JSON writers"""
+
+    def __init__(self, workers=REPORT_WORKERS, timeout=REPORT_SECTION_TIMEOUT):
+        self.workers = workers
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _submit(self, report, section, params):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # Spawned, not forked, so workers never share the web process's pooled connections
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                         mp_context=multiprocessing.get_context('spawn'))
+        return self._executor.submit(_compute, report, section.name, params)
+
+    def sections(self, report, params):
+        """(section, rows) for each section in order; pooled sections start computing at once"""
+        spec = REPORTS[report]
+        futures = {}
+        if self.workers > 0:
+            futures = {section.name: self._submit(report, section, params)
+                       for section in spec.sections if section.pooled}
+        try:
+            for section in spec.sections:
+                if section.name in futures:
+                    rows = futures[section.name].result(timeout=self.timeout)
+                elif section.pooled:
+                    # workers=0 computes inline (useful for scripts and debugging)
+                    rows = _compute(report, section.name, params)
+                else:
+                    rows = _streamed(section, params)
+                yield section, rows
+        finally:
+            for future in futures.values():
+                future.cancel()
+
+    def render(self, report, params, fmt='csv'):
+        """Generator of text chunks for the whole report"""
+        if fmt not in FORMATS:
+            raise InvalidReport(f"Format must be one of {', '.join(FORMATS)}")
+        writer = _write_csv if fmt == 'csv' else _write_json
+        return _chunked(writer(report, params, self.sections(report, params)))
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class _Echo:
+    """File-like object whose write returns the line, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def _write_csv(report, params, sections):
+    # One block per section: a title row, a header row, the rows and a blank line
+    writer = csv.writer(_Echo())
+    for section, rows in sections:
+        yield writer.writerow([f"{REPORTS[report].title}: {section.title}"])
+        yield writer.writerow(section.columns)
+        for row in rows:
+            yield writer.writerow(row)
+        yield '\r\n'
+
+
+def _json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _write_json(report, params, sections):
+    header = {'report': report, 'title': REPORTS[report].title, 'params': params._asdict(),
+              'generated': datetime.now()}
+    yield json.dumps(header, default=_json_value)[:-1] + ', "sections": {'
+    for index, (section, rows) in enumerate(sections):
+        yield f"{', ' if index else ''}{json.dumps(section.name)}: ["
+        for count, row in enumerate(rows):
+            yield (', ' if count else '') + json.dumps(dict(zip(section.columns, row)), default=_json_value)
+        yield ']'
+    yield '}}\n'
+
+
+def _chunked(pieces, lines=LINES_PER_CHUNK):
+    buffer = []
+    for piece in pieces:
+        buffer.append(piece)
+        if len(buffer) >= lines:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
+
+
+def filename(report, params, fmt):
+    seasons = str(params.first_season)
+    if params.last_season != params.first_season:
+        seasons += f"-{params.last_season}"
+    owner = params.team_id or params.player_id
+    return f"{report}{f'-{owner}' if owner else ''}-{seasons}.{fmt}"
+
+
+class ReportJob:
+    """One queued report and where its output went"""
+
+    def __init__(self, report, params, fmt, requested_by=None):
+        self.id = uuid.uuid4().hex
+        self.report = report
+        self.params = params
+        self.fmt = fmt
+        self.requested_by = requested_by
+        self.status = 'queued'
+        self.submitted = datetime.now()
+        self.started = None
+        self.finished = None
+        self.path = None
+        self.size = 0
+        self.error = None
+
+    @property
+    def filename(self):
+        return filename(self.report, self.params, self.fmt)
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'report': self.report,
+            'title': REPORTS[self.report].title,
+            'params': self.params._asdict(),
+            'format': self.fmt,
+            'filename': self.filename,
+            'requested_by': self.requested_by,
+            'status': self.status,
+            'submitted': self.submitted.isoformat(' ', 'seconds'),
+            'started': self.started.isoformat(' ', 'seconds') if self.started else None,
+            'finished': self.finished.isoformat(' ', 'seconds') if self.finished else None,
+            'size': self.size,
+            'error': self.error,
+        }
+
+
+class ReportJobs:
+    """Bounded queue of report jobs, run by background threads into REPORT_DIR"""
+
+    def __init__(self, engine, directory=REPORT_DIR, workers=REPORT_JOB_WORKERS,
+                 queue_limit=REPORT_QUEUE_LIMIT, history=REPORT_JOB_HISTORY):
+        self.engine = engine
+        self.directory = directory
+        self.workers = max(workers, 1)
+        self.history = history
+        self._queue = queue.Queue(maxsize=max(queue_limit, 1))
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._stopping = threading.Event()
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for number in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'report-jobs-{number}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, report, params, fmt='csv', requested_by=None):
+        if fmt not in FORMATS:
+            raise InvalidReport(f"Format must be one of {', '.join(FORMATS)}")
+        job = ReportJob(report, params, fmt, requested_by)
+        self._start()
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            logger.warning("Report queue full, rejecting job")
+            raise ReportsBusy('Too many reports are queued, please retry shortly')
+        with self._lock:
+            self._jobs[job.id] = job
+            # Forget the oldest finished jobs (and their files) beyond the history size
+            finished = [old for old in self._jobs.values() if old.status in ('done', 'failed')]
+            for old in finished[:max(len(self._jobs) - self.history, 0)]:
+                del self._jobs[old.id]
+                self._remove(old)
+        return job
+
+    def _remove(self, job):
+        if job.path and os.path.exists(job.path):
+            try:
+                os.remove(job.path)
+            except OSError as e:
+                logger.warning(f"Could not remove report {job.path}: {e}")
+
+    def _run(self):
+        while not self._stopping.is_set():
+            job = self._queue.get()
+            if self._stopping.is_set():
+                break
+            try:
+                self._generate(job)
+            finally:
+                self._queue.task_done()
+
+    def _generate(self, job):
+        job.status = 'running'
+        job.started = datetime.now()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{job.id}.{job.fmt}")
+        partial = path + '.part'
+        try:
+            with open(partial, 'w', encoding='utf-8', newline='') as out:
+                for chunk in self.engine.render(job.report, job.params, job.fmt):
+                    out.write(chunk)
+            os.replace(partial, path)
+            job.path = path
+            job.size = os.path.getsize(path)
+            job.status = 'done'
+            logger.info(f"Report {job.filename} written to {path} ({job.size} bytes)")
+        except Exception as e:
+            logger.error(f"Report {job.filename} failed: {e}")
+            job.status = 'failed'
+            job.error = str(e)
+            if os.path.exists(partial):
+                os.remove(partial)
+        finally:
+            job.finished = datetime.now()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        """Most recent first"""
+        with self._lock:
+            return [job.as_dict() for job in reversed(self._jobs.values())]
+
+    def stats(self):
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {'queued': self._queue.qsize(), 'workers': self.workers,
+                **{status: statuses.count(status) for status in ('running', 'done', 'failed')}}
+
+    def shutdown(self):
+        """Stop picking up queued jobs (they are lost; the job in progress is not waited for)"""
+        self._stopping.set()
+
+
+_engine = ReportEngine()
+_jobs = ReportJobs(_engine)
+atexit.register(_engine.shutdown)
+atexit.register(_jobs.shutdown)
+
+
+def get_report_engine():
+    return _engine
+
+
+def get_report_jobs():
+    return _jobs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Write a report as CSV or JSON')
+    parser.add_argument('report', choices=list(REPORTS))
+    parser.add_argument('args', nargs='*', help='team or player ID (team and player reports), then seasons')
+    parser.add_argument('--format', choices=list(FORMATS), default='csv')
+    parser.add_argument('--output', help='file to write (default: stdout)')
+    args = parser.parse_args()
+
+    owner = args.args[0] if REPORTS[args.report].needs and args.args else None
+    seasons = args.args[1 if REPORTS[args.report].needs else 0:]
+    try:
+        params = parse_params(args.report, seasons[0] if seasons else None, owner, owner)
+    except InvalidReport as e:
+        print(e)
+        sys.exit(1)
+
+    out = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+    try:
+        for chunk in _engine.render(args.report, params, args.format):
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+        _engine.shutdown()
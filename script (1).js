@@ -231,4 +231,65 @@ function updateSortIndicators(table, sortedColumn) {
             header.classList.remove('sorted', 'sorted-asc');
         }
     });
+}
+
+// Live score updates for the elements marked data-live-match (Scheduled and Ongoing matches).
+// feed is {stream: url} for the live score server's Server-Sent Events, or {poll: url, interval: seconds}
+// to poll /matches/live/poll. Either stops once every followed match has finished.
+function subscribeLiveScores(feed) {
+    if (!feed || !document.querySelector('[data-live-match]')) return null;
+
+    function followedIds() {
+        var ids = [];
+        document.querySelectorAll('[data-live-match]:not([data-live-done])').forEach(function(element) {
+            if (ids.indexOf(element.dataset.liveMatch) === -1) ids.push(element.dataset.liveMatch);
+        });
+        return ids;
+    }
+
+    function apply(update) {
+        document.querySelectorAll('[data-live-match="' + update.match_id + '"]').forEach(function(element) {
+            var home = element.querySelector('[data-live-home]');
+            var away = element.querySelector('[data-live-away]');
+            var status = element.querySelector('[data-live-status]');
+            var score = element.querySelector('[data-live-score]');
+            if (home && update.home_score !== null) home.textContent = update.home_score;
+            if (away && update.away_score !== null) away.textContent = update.away_score;
+            if (status) status.textContent = update.status;
+            if (score && update.home_score !== null) score.classList.remove('d-none');
+            if (update.status === 'Completed' || update.status === 'Cancelled') element.dataset.liveDone = '1';
+        });
+    }
+
+    if (feed.stream) {
+        if (typeof EventSource === 'undefined') return null;
+        var source = new EventSource(feed.stream);
+        source.addEventListener('score', function(event) {
+            apply(JSON.parse(event.data));
+            if (!followedIds().length) source.close();
+        });
+        return source;
+    }
+
+    var since = 0;
+    var interval = (feed.interval || 15) * 1000;
+    function poll() {
+        var ids = followedIds();
+        if (!ids.length) return;
+        var url = feed.poll + '?match_ids=' + ids.join(',') + '&since=' + since;
+        fetch(url, { credentials: 'same-origin', headers: { 'Accept': 'application/json' } })
+            .then(function(response) { return response.ok ? response.json() : null; })
+            .then(function(data) {
+                if (data) {
+                    since = data.last_id;
+                    data.updates.forEach(apply);
+                }
+                setTimeout(poll, interval);
+            })
+            .catch(function() {
+                setTimeout(poll, interval * 2);
+            });
+    }
+    setTimeout(poll, interval);
+    return feed;
 }
\ No newline at end of file
@@ -0,0 +1,613 @@
+"""
+Search over players, teams, venues and matches
+An in-process inverted index for the typeahead. Each entity's names are split
+into normalized terms held in one sorted array of postings per kind, so a
+prefix lookup is two bisects and a short scan of the best ranked postings.
+Every word is also indexed by trigram, so a query word that no term starts
+with is corrected to the nearest indexed word and searched again. The
+index is saved to SEARCH_INDEX_PATH, so a warm start loads it and only reads
+the rows added since. The write events keep it current, and a background
+thread rebuilds it every SEARCH_REBUILD_SECONDS to pick up edits made by other
+processes.
+
+Usage:
+    python search_index.py rebuild
+    python search_index.py stats
+    python search_index.py "<query>" [kind,kind]
+"""
+
+import gc
+import os
+import re
+import sys
+import math
+import time
+import atexit
+import heapq
+import pickle
+import logging
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left, insort
+from datetime import datetime
+from collections import Counter, namedtuple
+
+import events
+from db_pool import get_pool
+from queries import register
+from reference_cache import get_teams, get_venues, team_name, venue
+from season_archive import get_archive
+
+logger = logging.getLogger('search')
+
+SEARCH_INDEX_PATH = os.environ.get('SEARCH_INDEX_PATH', './search_index.pickle')
+SEARCH_REBUILD_SECONDS = float(os.environ.get('SEARCH_REBUILD_SECONDS', 3600))
+SEARCH_SAVE_SECONDS = float(os.environ.get('SEARCH_SAVE_SECONDS', 300))
+SEARCH_LIMIT = 10
+MAX_SEARCH_LIMIT = 50
+# Postings looked at per kind and query, so a one-letter prefix costs the same as a name
+SEARCH_SCAN_LIMIT = int(os.environ.get('SEARCH_SCAN_LIMIT', 4000))
+# Share of a misspelt word's trigrams the corrected word must share
+SEARCH_FUZZY_MIN = 0.5
+MAX_QUERY_TERMS = 6
+SNAPSHOT_VERSION = 1
+
+# Kinds in the order they rank when everything else is equal
+KINDS = ('team', 'player', 'venue', 'match', 'user')
+KIND_RANK = {kind: rank for rank, kind in enumerate(KINDS)}
+
+# Live matches start at the archive's boundary; this when nothing is archived
+_NO_BOUNDARY = datetime(1900, 1, 1)
+
+_PLAYERS_SQL = register('search.players', '''
+    SELECT PlayerID, FullName, Position, TeamID
+    FROM PLAYERS
+    WHERE PlayerID > ?
+    ORDER BY PlayerID
+''')
+_USERS_SQL = register('search.users', '''
+    SELECT UserID, Username, Role
+    FROM USERS
+    WHERE UserID > ?
+    ORDER BY UserID
+''')
+_MATCHES_SQL = register('search.matches', '''
+    SELECT MatchID, HomeTeamID, AwayTeamID, MatchDateTime, VenueID
+    FROM MATCHES
+    WHERE MatchID > ? AND MatchDateTime >= ?
+    ORDER BY MatchID
+''')
+
+_WORD_RE = re.compile(r'[a-z0-9]+')
+
+# terms starts with the label's own terms; names says how many there are
+Entry = namedtuple('Entry', 'kind id label detail terms names')
+
+
+def normalize(text):
+    """Lower-case ASCII words of text ('Müller-Wohlfahrt' -> ['muller', 'wohlfahrt'])"""
+    text = unicodedata.normalize('NFKD', str(text or '')).encode('ascii', 'ignore').decode()
+    return _WORD_RE.findall(text.lower())
+
+
+def _entry(kind, entity_id, label, detail, *texts):
+    # The label's terms first, then those of texts that are not already there
+    terms = list(dict.fromkeys(normalize(label)))
+    names = len(terms)
+    for text in texts:
+        for term in normalize(text):
+            if term not in terms:
+                terms.append(term)
+    return Entry(kind, entity_id, label, detail, tuple(terms), names)
+
+
+def _trigrams(terms):
+    # Padded at the front, so a word's first letters count and two-letter words have a trigram
+    return {padded[i:i + 3] for padded in (' ' + term for term in terms) for i in range(len(padded) - 2)}
+
+
+def _text(terms):
+    # ' ' + token is in this exactly when one of the terms starts with token
+    return ' ' + ' '.join(terms)
+
+
+def _rank(entry, term):
+    # Within a term, entries named by it come before those that only mention it, then shorter labels
+    return (0 if term in entry.terms[:entry.names] else 1000) + min(len(entry.label), 999)
+
+
+def team_entry(team_id, name):
+    return _entry('team', team_id, name, '')
+
+
+def venue_entry(venue_id, name, location):
+    return _entry('venue', venue_id, name, location or '', location)
+
+
+def player_entry(player_id, full_name, position, team_id):
+    team = team_name(team_id) if team_id is not None else None
+    return _entry('player', player_id, full_name, ', '.join(filter(None, (position, team))), position, team)
+
+
+def user_entry(user_id, username, role):
+    return _entry('user', user_id, username, role or '')
+
+
+def match_entry(match_id, home_team_id, away_team_id, match_datetime, venue_id):
+    home, away = team_name(home_team_id) or '', team_name(away_team_id) or ''
+    venue_row = venue(venue_id) if venue_id is not None else None
+    venue_name = venue_row[1] if venue_row else ''
+    when = ''
+    if isinstance(match_datetime, datetime):
+        # Searchable by date, month and year as well as by the teams and the ground
+        when = match_datetime.strftime('%Y-%m-%d %b %B %Y')
+    detail = ', '.join(filter(None, (match_datetime.strftime('%d %b %Y %H:%M')
+                                     if isinstance(match_datetime, datetime) else None, venue_name)))
+    return _entry('match', match_id, f"{home} vs {away}", detail, venue_name, when)
+
+
+class KindIndex:
+    """Sorted (term, rank, entry number) postings for the entries of one kind"""
+
+    def __init__(self, postings=None):
+        self.postings = postings if postings is not None else []
+
+    def __len__(self):
+        return len(self.postings)
+
+    def add(self, number, entry):
+        for term in entry.terms:
+            insort(self.postings, (term, _rank(entry, term), number))
+
+    def add_many(self, items):
+        """Add (number, entry) pairs with one sort rather than an insert per term"""
+        self.postings += [(term, _rank(entry, term), number) for number, entry in items for term in entry.terms]
+        self.postings.sort()
+
+    def remove(self, number, entry):
+        for term in entry.terms:
+            posting = (term, _rank(entry, term), number)
+            pos = bisect_left(self.postings, posting)
+            if pos < len(self.postings) and self.postings[pos] == posting:
+                del self.postings[pos]
+
+    def prefix(self, token):
+        """[lo, hi) of the postings whose term starts with token"""
+        # Terms are [a-z0-9]+, so (token + '{',) sorts after every posting of a term starting with token
+        return bisect_left(self.postings, (token,)), bisect_left(self.postings, (token + '{',))
+
+
+class Vocabulary:
+    """Every indexed word by trigram, to correct misspelt query words"""
+
+    def __init__(self, grams=None):
+        self.grams = grams if grams is not None else {}  # trigram -> list of words
+        self.words = {word for words in self.grams.values() for word in words}
+
+    def __len__(self):
+        return len(self.words)
+
+    def learn(self, terms):
+        for term in terms:
+            # Numbers and short words are left alone; a typo there is as likely another real value
+            if len(term) >= 3 and not term.isdigit() and term not in self.words:
+                self.words.add(term)
+                for gram in _trigrams((term,)):
+                    self.grams.setdefault(gram, []).append(term)
+
+    def correct(self, token):
+        """The word sharing the most of token's trigrams (at least SEARCH_FUZZY_MIN of them), or None"""
+        if len(token) < 3 or token.isdigit():
+            return None
+        grams = _trigrams((token,))
+        need = max(2, math.ceil(len(grams) * SEARCH_FUZZY_MIN))
+        counts = Counter()
+        for gram in grams:
+            counts.update(self.grams.get(gram, ()))
+        best = None
+        for word, hits in counts.items():
+            if hits >= need:
+                key = (-hits, abs(len(word) - len(token)), word)
+                if best is None or key < best:
+                    best = key
+        return best[2] if best else None
+
+
+class IndexContents:
+    """The entries and postings of one build; a rebuild fills a new one and swaps it in"""
+
+    def __init__(self):
+        self.entries = []  # entry number -> Entry; an updated entity keeps its number
+        self.numbers = {}  # (kind, id) -> entry number
+        self.texts = []  # entry number -> its terms as one string, for checking further query words
+        self.kinds = {kind: KindIndex() for kind in KINDS}
+        self.vocabulary = Vocabulary()
+        self.high = {'player': 0, 'user': 0, 'match': 0}  # highest id read, for catching up
+
+    def add_many(self, entries):
+        added = {kind: [] for kind in KINDS}
+        for entry in entries:
+            number = self.replace(entry)
+            if number is not None:
+                added[entry.kind].append((number, entry))
+        for kind, items in added.items():
+            if len(items) > 64:
+                self.kinds[kind].add_many(items)
+            else:
+                for number, entry in items:
+                    self.kinds[kind].add(number, entry)
+            for _, entry in items:
+                self.vocabulary.learn(entry.terms)
+
+    def put(self, entry):
+        """Add or update one entry; False when it was already indexed as it is"""
+        number = self.replace(entry)
+        if number is None:
+            return False
+        self.kinds[entry.kind].add(number, entry)
+        self.vocabulary.learn(entry.terms)
+        if entry.kind in self.high:
+            self.high[entry.kind] = max(self.high[entry.kind], entry.id)
+        return True
+
+    def replace(self, entry):
+        # Drops the entity's old entry; returns the new entry's number, or None if nothing changed
+        key = (entry.kind, entry.id)
+        number = self.numbers.get(key)
+        if number is not None:
+            old = self.entries[number]
+            if old == entry:
+                return None
+            self.kinds[entry.kind].remove(number, old)
+            self.entries[number] = entry
+            self.texts[number] = _text(entry.terms)
+            return number
+        self.entries.append(entry)
+        self.texts.append(_text(entry.terms))
+        number = self.numbers[key] = len(self.entries) - 1
+        return number
+
+    def dump(self):
+        # Plain tuples, lists and dicts only, so the snapshot loads whichever module wrote it. The
+        # postings are stored as columns: integer arrays load far faster than tuples
+        return {'entries': [tuple(entry) for entry in self.entries],
+                'postings': {kind: ([posting[0] for posting in index.postings],
+                                    array('i', [posting[1] for posting in index.postings]),
+                                    array('i', [posting[2] for posting in index.postings]))
+                             for kind, index in self.kinds.items()},
+                'vocabulary': self.vocabulary.grams, 'high': self.high}
+
+    @classmethod
+    def restore(cls, state):
+        contents = cls()
+        contents.entries = list(map(Entry._make, state['entries']))
+        contents.numbers = {(entry.kind, entry.id): number for number, entry in enumerate(contents.entries)}
+        contents.texts = [_text(entry.terms) for entry in contents.entries]
+        contents.kinds = {kind: KindIndex(list(zip(*columns))) for kind, columns in state['postings'].items()}
+        contents.vocabulary = Vocabulary(state['vocabulary'])
+        contents.high = state['high']
+        return contents
+
+
+def _without_gc(func, *args):
+    # Building or loading allocates a few hundred thousand tuples and no cycles; the
+    # collector's passes over them would take longer than the build itself
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return func(*args)
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class SearchIndex:
+    """Prefix search over every searchable entity, with typo correction by trigram"""
+
+    def __init__(self, path=SEARCH_INDEX_PATH, rebuild_seconds=SEARCH_REBUILD_SECONDS,
+                 save_seconds=SEARCH_SAVE_SECONDS):
+        self.path = path
+        self.rebuild_seconds = rebuild_seconds
+        self.save_seconds = save_seconds
+        self._lock = threading.RLock()
+        self._contents = IndexContents()
+        self._built = False
+        self._unsaved = False
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._rebuild_requested = False
+        self.built_at = None
+        self.loaded_from = None
+        self.searches = 0
+        self.search_time = 0.0
+
+    def __len__(self):
+        return len(self._contents.numbers)
+
+    # Building
+    def rebuild(self):
+        """Index every entity from scratch; searches keep using the old contents until it is done"""
+        started = time.perf_counter()
+        contents = IndexContents()
+        entries, contents.high = self._read(dict(contents.high), boundary=get_archive().boundary())
+        # Matches before the boundary come from the season archive (they may be pruned from MATCHES)
+        for snapshot in get_archive().snapshots():
+            entries += [match_entry(*snapshot.row(i)[:5]) for i in range(len(snapshot))]
+        _without_gc(contents.add_many, entries)
+        with self._lock:
+            self._contents = contents
+            self._built = True
+            self._unsaved = True
+            self.built_at = datetime.now()
+            self.loaded_from = 'database'
+        # Rows written while the database was being read
+        self.catch_up()
+        logger.info(f"Search index built with {len(entries)} entries in "
+                    f"{(time.perf_counter() - started) * 1000:.1f} ms")
+        return len(entries)
+
+    def catch_up(self):
+        """Index the players, users and matches added since the last build or catch-up"""
+        with self._lock:
+            since = dict(self._contents.high)
+        # Teams and venues are a handful of rows from the reference cache; they are read again in full
+        entries, high = self._read(since)
+        with self._lock:
+            contents = self._contents
+            contents.add_many(entries)
+            contents.high = {kind: max(high[kind], contents.high[kind]) for kind in high}
+            if high != since:
+                self._unsaved = True
+        return len(entries)
+
+    def _read(self, since, boundary=None):
+        entries = [team_entry(*row) for row in get_teams()] + [venue_entry(*row) for row in get_venues()]
+        high = dict(since)
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            for kind, sql, params, build in (
+                    ('player', _PLAYERS_SQL, (since['player'],), player_entry),
+                    ('user', _USERS_SQL, (since['user'],), user_entry),
+                    ('match', _MATCHES_SQL, (since['match'], boundary or _NO_BOUNDARY), match_entry)):
+                cursor.execute(sql, params)
+                rows = cursor.fetchall()
+                entries += [build(*row) for row in rows]
+                if rows:
+                    high[kind] = max(high[kind], rows[-1][0])
+        return entries, high
+
+    def put(self, entry):
+        """Add or update one entity (from the write events)"""
+        if not self._built:
+            return
+        with self._lock:
+            if self._contents.put(entry):
+                self._unsaved = True
+
+    # Snapshots
+    def save(self):
+        """Write the index to self.path, replacing the previous snapshot in one rename"""
+        with self._lock:
+            state = dict(self._contents.dump(), version=SNAPSHOT_VERSION, built_at=self.built_at)
+            data = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+            self._unsaved = False
+        scratch = f"{self.path}.{os.getpid()}.tmp"
+        with open(scratch, 'wb') as f:
+            f.write(data)
+        os.replace(scratch, self.path)
+        logger.info(f"Search index saved to {self.path} ({len(data) // 1024} KB)")
+
+    def load(self):
+        """Load the snapshot at self.path; False when there is none or it is unusable or too old"""
+        try:
+            with open(self.path, 'rb') as f:
+                state = _without_gc(pickle.load, f)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.warning(f"Search index snapshot {self.path} could not be read: {str(e)}")
+            return False
+        if not isinstance(state, dict) or state.get('version') != SNAPSHOT_VERSION:
+            return False
+        if (datetime.now() - state['built_at']).total_seconds() > self.rebuild_seconds:
+            return False
+        contents = _without_gc(IndexContents.restore, state)
+        with self._lock:
+            self._contents = contents
+            self.built_at = state['built_at']
+            self.loaded_from = self.path
+            self._built = True
+        return True
+
+    def _ensure_built(self):
+        if not self._built:
+            with self._lock:
+                if not self._built:
+                    started = time.perf_counter()
+                    if self.load():
+                        added = self.catch_up()
+                        logger.info(f"Search index loaded from {self.path} in "
+                                    f"{(time.perf_counter() - started) * 1000:.1f} ms, {added} entries read since")
+                    else:
+                        self.rebuild()
+                    self._start()
+
+    # Background thread: periodic rebuild and snapshot
+    def start(self):
+        """Load or build the index on a background thread now, instead of on the first search"""
+        self._start()
+
+    def _start(self):
+        if self._thread is None:
+            with self._thread_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='search-index', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        try:
+            self._ensure_built()
+        except Exception as e:
+            logger.error(f"Search index build failed: {str(e)}")
+        while True:
+            self._wakeup.wait(self.save_seconds)
+            self._wakeup.clear()
+            try:
+                due = self.built_at is None or \
+                    (datetime.now() - self.built_at).total_seconds() > self.rebuild_seconds
+                if self._rebuild_requested or due:
+                    self._rebuild_requested = False
+                    self.rebuild()
+                if self._unsaved:
+                    self.save()
+            except Exception as e:
+                logger.error(f"Search index upkeep failed: {str(e)}")
+
+    def request_rebuild(self):
+        """Rebuild on the background thread now rather than at the next interval"""
+        self._rebuild_requested = True
+        self._wakeup.set()
+
+    def save_if_changed(self):
+        if self._built and self._unsaved:
+            self.save()
+
+    # Searching
+    def search(self, query, kinds=KINDS, limit=SEARCH_LIMIT):
+        """Best entries for a typed query: every word a prefix of a term, then with misspelt words corrected"""
+        tokens = list(dict.fromkeys(normalize(query)))[:MAX_QUERY_TERMS]
+        if not tokens:
+            return []
+        self._ensure_built()
+        started = time.perf_counter()
+        with self._lock:
+            contents = self._contents
+            indexes = [contents.kinds[kind] for kind in kinds]
+            scored = {}
+            for index in indexes:
+                self._prefix_matches(contents, index, tokens, limit, 0, scored)
+            if len(scored) < limit:
+                # A word no term starts with, in any of the kinds, is taken for a typo of the nearest word
+                corrected = [token if any(self._has_prefix(index, token) for index in indexes)
+                             else contents.vocabulary.correct(token) for token in tokens]
+                if corrected != tokens and None not in corrected:
+                    for index in indexes:
+                        self._prefix_matches(contents, index, corrected, limit, 1, scored)
+            best = heapq.nsmallest(limit, scored.items(), key=lambda item: item[1])
+            results = [contents.entries[number] for number, _ in best]
+        self.searches += 1
+        self.search_time += time.perf_counter() - started
+        return results
+
+    @staticmethod
+    def _has_prefix(index, token):
+        lo = bisect_left(index.postings, (token,))
+        return lo < len(index.postings) and index.postings[lo][0].startswith(token)
+
+    @staticmethod
+    def _prefix_matches(contents, index, tokens, limit, fuzzy, scored):
+        # Walk the narrowest token's postings, best ranked first within each term, keeping the
+        # entries whose terms the other tokens start too; stop at limit hits
+        ranges = [index.prefix(token) for token in tokens]
+        if any(lo == hi for lo, hi in ranges):
+            return
+        order = sorted(range(len(tokens)), key=lambda i: ranges[i][1] - ranges[i][0])
+        lo, hi = ranges[order[0]]
+        needles = [' ' + tokens[i] for i in order[1:]]
+        entries, texts = contents.entries, contents.texts
+        found = 0
+        for posting in index.postings[lo:min(hi, lo + SEARCH_SCAN_LIMIT)]:
+            number = posting[2]
+            if number in scored:
+                continue
+            text = texts[number]
+            for needle in needles:
+                if needle not in text:
+                    break
+            else:
+                # Words found in the name beat words found in the details; whole words beat prefixes
+                entry = entries[number]
+                terms = entry.terms
+                names = terms[:entry.names]
+                named = sum(any(term.startswith(token) for term in names) for token in tokens)
+                exact = sum(token in terms for token in tokens)
+                scored[number] = (fuzzy, -named, -exact, KIND_RANK[entry.kind], len(entry.label), entry.label)
+                found += 1
+                if found >= limit:
+                    break
+
+    def stats(self):
+        with self._lock:
+            contents = self._contents
+            counts = {kind: 0 for kind in KINDS}
+            for kind, _ in contents.numbers:
+                counts[kind] += 1
+            return {'built': self._built, 'entries': len(contents.numbers), 'by_kind': counts,
+                    'postings': sum(len(index) for index in contents.kinds.values()),
+                    'words': len(contents.vocabulary),
+                    'built_at': self.built_at.isoformat(' ', 'seconds') if self.built_at else None,
+                    'loaded_from': self.loaded_from, 'searches': self.searches,
+                    'mean_ms': round(self.search_time * 1000 / self.searches, 3) if self.searches else 0.0}
+
+
+_index = SearchIndex()
+
+
+def get_search_index():
+    return _index
+
+
+def _on_player_written(player_id, team_id, full_name, position, **payload):
+    _index.put(player_entry(player_id, full_name, position, team_id))
+
+
+def _on_user_registered(user_id, username, role, **payload):
+    _index.put(user_entry(user_id, username, role))
+
+
+def _on_user_role_changed(user_id, username, role, **payload):
+    _index.put(user_entry(user_id, username, role))
+
+
+def _on_match_created(match_id, home_team_id, away_team_id, match_datetime, venue_id, **payload):
+    _index.put(match_entry(match_id, home_team_id, away_team_id, match_datetime, venue_id))
+
+
+def _on_season_scheduled(**payload):
+    # The event carries counts, not IDs; the new matches are the ones above the highest indexed
+    if _index._built:
+        _index.catch_up()
+
+
+def _on_reference_written(**payload):
+    # A renamed team or venue appears in player and match entries too
+    _index.request_rebuild()
+
+
+events.subscribe(events.PLAYER_WRITTEN, _on_player_written)
+events.subscribe(events.USER_REGISTERED, _on_user_registered)
+events.subscribe(events.USER_ROLE_CHANGED, _on_user_role_changed)
+events.subscribe(events.MATCH_CREATED, _on_match_created)
+events.subscribe(events.SEASON_SCHEDULED, _on_season_scheduled)
+events.subscribe(events.TEAM_WRITTEN, _on_reference_written)
+events.subscribe(events.VENUE_WRITTEN, _on_reference_written)
+atexit.register(_index.save_if_changed)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or len(sys.argv) > 3:
+        print('Usage: python search_index.py rebuild | stats | "<query>" [kind,kind]')
+        sys.exit(1)
+    if sys.argv[1] == 'rebuild':
+        _index.rebuild()
+        _index.save()
+    elif sys.argv[1] != 'stats':
+        kinds = sys.argv[2].split(',') if len(sys.argv) > 2 else KINDS
+        for entry in _index.search(sys.argv[1], kinds=[kind for kind in kinds if kind in KIND_RANK]):
+            print(f"{entry.kind:<7} {entry.id:>7}  {entry.label:<40} {entry.detail}")
+    else:
+        _index._ensure_built()
+    for key, value in _index.stats().items():
+        print(f"{key:<12} {value}")
@@ -0,0 +1,600 @@
+"""
+Season archive for Sports Management System
+Completed seasons are frozen into read-only snapshots under SEASON_ARCHIVE_DIR:
+one directory per season holding a NumPy .npy file per column of its MATCHES
+and PLAYER_STATS rows and of the FAN_ENGAGEMENT rows on its matches, plus a
+manifest. Snapshots are opened memory-mapped, so the past match listings, the
+standings, the player analytics and the reports read archived seasons straight
+from the files instead of querying MATCHES. Seasons are archived oldest first,
+so everything before the archive's boundary is in the snapshots; pruning then
+deletes the MATCHES and PLAYER_STATS rows from the live tables, which keep
+only the seasons still being played. FAN_ENGAGEMENT keeps its rows (the match
+feeds and fan histories show their comments) and readers look their matches
+up in the archive.
+
+Usage:
+    python season_archive.py list
+    python season_archive.py archive [--prune]
+    python season_archive.py prune
+    python season_archive.py verify
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import tempfile
+import threading
+from datetime import datetime
+from collections import OrderedDict
+
+import numpy as np
+
+import events
+from db_pool import get_pool
+from queries import register
+from standings import get_standings
+from fan_engagement import ENGAGEMENT_TYPES
+from player_analytics import SEASON_START_MONTH, get_analytics, season_for
+
+logger = logging.getLogger('archive')
+
+ARCHIVE_DIR = os.environ.get('SEASON_ARCHIVE_DIR', './archive')
+ARCHIVE_RESCAN_SECONDS = float(os.environ.get('ARCHIVE_RESCAN_SECONDS', 60))
+MANIFEST = 'manifest.json'
+
+# Status codes stored in the status column (the manifest keeps this table too)
+MATCH_STATUSES = ('Scheduled', 'Ongoing', 'Completed', 'Cancelled')
+FINAL_STATUSES = ('Completed', 'Cancelled')
+
+# Column -> dtype; NULL ids and scores are stored as -1
+MATCH_DTYPES = OrderedDict([('match_id', 'int64'), ('home_team_id', 'int32'), ('away_team_id', 'int32'),
+                            ('match_time', 'datetime64[s]'), ('venue_id', 'int32'), ('status', 'uint8'),
+                            ('home_score', 'int16'), ('away_score', 'int16')])
+# The same columns the analytics store loads from PLAYER_STATS
+STAT_DTYPES = OrderedDict([('stat_id', 'int64'), ('player_id', 'int64'), ('match_id', 'int64'),
+                           ('team_id', 'int64'), ('match_time', 'datetime64[s]'), ('goals', 'int16'),
+                           ('assists', 'int16'), ('yellow_cards', 'int16'), ('red_cards', 'int16'),
+                           ('minutes', 'int16'), ('rating', 'float64'), ('season', 'int16')])
+# Engagement types are stored as codes into the manifest's engagement_types
+ENGAGEMENT_DTYPES = OrderedDict([('engagement_id', 'int64'), ('fan_id', 'int64'), ('match_id', 'int64'),
+                                 ('match_time', 'datetime64[s]'), ('type', 'uint8')])
+
+_SEASON_MATCHES_SQL = register('archive.season_matches', '''
+    SELECT MatchID, HomeTeamID, AwayTeamID, MatchDateTime, VenueID, Status, HomeScore, AwayScore
+    FROM MATCHES
+    WHERE MatchDateTime >= ? AND MatchDateTime < ?
+    ORDER BY MatchDateTime, MatchID
+''')
+_SEASON_STATS_SQL = register('archive.season_stats', '''
+    SELECT PS.StatID, PS.PlayerID, PS.MatchID, P.TeamID, M.MatchDateTime,
+           PS.Goals, PS.Assists, PS.YellowCards, PS.RedCards, PS.MinutesPlayed, PS.PerformanceRating
+    FROM (PLAYER_STATS PS
+    INNER JOIN MATCHES M ON PS.MatchID = M.MatchID)
+    INNER JOIN PLAYERS P ON PS.PlayerID = P.PlayerID
+    WHERE M.MatchDateTime >= ? AND M.MatchDateTime < ?
+    ORDER BY PS.MatchID, PS.StatID
+''')
+_SEASON_ENGAGEMENT_SQL = register('archive.season_engagement', '''
+    SELECT FE.EngagementID, FE.FanID, FE.MatchID, M.MatchDateTime, FE.EngagementType
+    FROM FAN_ENGAGEMENT FE
+    INNER JOIN MATCHES M ON FE.MatchID = M.MatchID
+    WHERE M.MatchDateTime >= ? AND M.MatchDateTime < ?
+    ORDER BY FE.MatchID, FE.EngagementID
+''')
+# Matches of a season still in MATCHES, and how many of them are not final
+_LIVE_COUNTS_SQL = register('archive.live_counts', '''
+    SELECT COUNT(*), SUM(IIF(Status IN ('Completed', 'Cancelled'), 0, 1))
+    FROM MATCHES
+    WHERE MatchDateTime >= ? AND MatchDateTime < ?
+''', sqlite='''
+    SELECT COUNT(*), SUM(CASE WHEN Status IN ('Completed', 'Cancelled') THEN 0 ELSE 1 END)
+    FROM MATCHES
+    WHERE MatchDateTime >= ? AND MatchDateTime < ?
+''')
+_LIVE_STATS_COUNT_SQL = register('archive.live_stats_count', '''
+    SELECT COUNT(*)
+    FROM PLAYER_STATS PS
+    INNER JOIN MATCHES M ON PS.MatchID = M.MatchID
+    WHERE M.MatchDateTime >= ? AND M.MatchDateTime < ?
+''')
+_LIVE_ENGAGEMENT_COUNT_SQL = register('archive.live_engagement_count', '''
+    SELECT COUNT(*)
+    FROM FAN_ENGAGEMENT FE
+    INNER JOIN MATCHES M ON FE.MatchID = M.MatchID
+    WHERE M.MatchDateTime >= ? AND M.MatchDateTime < ?
+''')
+# Not MIN(): the driver only converts the column itself to a datetime
+_OLDEST_MATCH_SQL = register('archive.oldest_match', 'SELECT MatchDateTime FROM MATCHES ORDER BY MatchDateTime LIMIT 1')
+_PRUNE_STATS_SQL = register('archive.prune_stats', '''
+    DELETE FROM PLAYER_STATS
+    WHERE MatchID IN (SELECT MatchID FROM MATCHES WHERE MatchDateTime >= ? AND MatchDateTime < ?)
+''')
+_PRUNE_MATCHES_SQL = register('archive.prune_matches', '''
+    DELETE FROM MATCHES WHERE MatchDateTime >= ? AND MatchDateTime < ?
+''')
+
+
+class ArchiveError(Exception):
+    """A season that cannot be archived or pruned (yet)"""
+
+
+def season_bounds(season):
+    """[start, end) of a season as datetimes"""
+    return datetime(season, SEASON_START_MONTH, 1), datetime(season + 1, SEASON_START_MONTH, 1)
+
+
+def _null(value):
+    return -1 if value is None else value
+
+
+def _value(value):
+    return None if value < 0 else int(value)
+
+
+def _load(path, count):
+    # Zero-length files cannot be mapped on every platform; an empty season is tiny anyway
+    return np.load(path, mmap_mode='r' if count else None)
+
+
+class SeasonSnapshot:
+    """One archived season: its manifest and its memory-mapped columns"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST), encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        self.season = self.manifest['season']
+        self.start, self.end = season_bounds(self.season)
+        self.statuses = tuple(self.manifest['statuses'])
+        counts = self.manifest['matches'], self.manifest['stats']
+        self.matches = {name: _load(os.path.join(path, f'matches.{name}.npy'), counts[0]) for name in MATCH_DTYPES}
+        self.stats = {name: _load(os.path.join(path, f'stats.{name}.npy'), counts[1]) for name in STAT_DTYPES}
+        # Rows are sorted by (match_time, match_id); by_id orders them by match_id for lookups
+        self.by_id = _load(os.path.join(path, 'matches.by_id.npy'), counts[0])
+        # Snapshots written before engagement was archived have none
+        self.engagement_types = tuple(self.manifest.get('engagement_types', ENGAGEMENT_TYPES))
+        if 'engagement' in self.manifest:
+            self.engagement = {name: _load(os.path.join(path, f'engagement.{name}.npy'), self.manifest['engagement'])
+                               for name in ENGAGEMENT_DTYPES}
+        else:
+            self.engagement = {name: np.zeros(0, dtype=dtype) for name, dtype in ENGAGEMENT_DTYPES.items()}
+        self._sorted_ids = self.matches['match_id'][self.by_id]
+        self._times = self.matches['match_time'].view(np.int64)
+
+    def __len__(self):
+        return len(self.matches['match_id'])
+
+    def row(self, i):
+        """Match i as a MATCHES row (records.MATCH_COLUMNS order)"""
+        m = self.matches
+        return (int(m['match_id'][i]), int(m['home_team_id'][i]), int(m['away_team_id'][i]),
+                m['match_time'][i].astype(datetime), _value(m['venue_id'][i]), self.statuses[m['status'][i]],
+                _value(m['home_score'][i]), _value(m['away_score'][i]))
+
+    def find(self, match_id):
+        """Index of match_id in the season, or None"""
+        pos = int(np.searchsorted(self._sorted_ids, match_id))
+        if pos < len(self) and self._sorted_ids[pos] == match_id:
+            return int(self.by_id[pos])
+        return None
+
+    def stat_rows(self, match_id):
+        """slice of the stats columns holding match_id's rows (they are sorted by match_id)"""
+        lo, hi = np.searchsorted(self.stats['match_id'], [match_id, match_id + 1])
+        return slice(int(lo), int(hi))
+
+    def player_totals(self):
+        """player_id -> [appearances, goals, assists, yellow, red, minutes, rating total, rated matches]"""
+        s = self.stats
+        ids, inverse = np.unique(s['player_id'], return_inverse=True)
+        n = len(ids)
+        columns = [np.bincount(inverse, minlength=n)]
+        for name in ('goals', 'assists', 'yellow_cards', 'red_cards', 'minutes'):
+            columns.append(np.bincount(inverse, weights=s[name], minlength=n))
+        rated = ~np.isnan(s['rating'])
+        columns.append(np.bincount(inverse[rated], weights=s['rating'][rated], minlength=n))
+        columns.append(np.bincount(inverse[rated], minlength=n))
+        return {int(player_id): [int(column[i]) for column in columns[:6]] + [float(columns[6][i]), int(columns[7][i])]
+                for i, player_id in enumerate(ids.tolist())}
+
+    def player_lines(self, player_id):
+        """(kick-off, match_id, home, away, home score, away score, goals, assists, yellow, red, minutes,
+        rating) of each of player_id's matches, in kick-off order"""
+        s = self.stats
+        rows = np.flatnonzero(s['player_id'] == player_id)
+        rows = rows[np.argsort(s['match_time'][rows], kind='stable')]
+        for i in rows.tolist():
+            match = self.row(self.find(int(s['match_id'][i])))
+            rating = float(s['rating'][i])
+            yield (match[3], match[0], match[1], match[2], match[6], match[7],
+                   *(int(s[name][i]) for name in ('goals', 'assists', 'yellow_cards', 'red_cards', 'minutes')),
+                   None if np.isnan(rating) else rating)
+
+    def engagement_counts(self, column=None):
+        """Engagements by type, or by (column value, type) for column 'fan_id' or 'match_id'"""
+        e = self.engagement
+        if column is None:
+            counts = np.bincount(e['type'], minlength=len(self.engagement_types))
+            return {self.engagement_types[code]: int(count) for code, count in enumerate(counts.tolist()) if count}
+        keys, counts = np.unique(np.stack([e[column], e['type'].astype(np.int64)], axis=1), axis=0,
+                                 return_counts=True)
+        return {(int(key[0]), self.engagement_types[key[1]]): int(count) for key, count in zip(keys, counts.tolist())}
+
+    def page(self, descending, key, filters, limit):
+        """Up to limit match indexes past key ((MatchDateTime, MatchID) or None), in page order"""
+        n = len(self)
+        lo, hi = 0, n
+        if key is not None:
+            when = np.datetime64(key[0], 's').astype(np.int64)
+            first, last = np.searchsorted(self._times, [when, when + 1])
+            ids = self.matches['match_id'][first:last]
+            if descending:
+                hi = int(first + np.searchsorted(ids, key[1], side='left'))
+            else:
+                lo = int(first + np.searchsorted(ids, key[1], side='right'))
+        if lo >= hi:
+            return []
+
+        m = self.matches
+        keep = np.ones(hi - lo, dtype=bool)
+        if 'team_id' in filters:
+            team_id = filters['team_id']
+            keep &= (m['home_team_id'][lo:hi] == team_id) | (m['away_team_id'][lo:hi] == team_id)
+        if 'venue_id' in filters:
+            keep &= m['venue_id'][lo:hi] == filters['venue_id']
+        if 'status' in filters:
+            if filters['status'] not in self.statuses:
+                return []
+            keep &= m['status'][lo:hi] == self.statuses.index(filters['status'])
+        rows = np.flatnonzero(keep) + lo
+        rows = rows[::-1][:limit] if descending else rows[:limit]
+        return rows.tolist()
+
+    def completed(self):
+        """(match_id, home, away, kickoff, home_score, away_score) of every completed match"""
+        code = self.statuses.index('Completed')
+        m = self.matches
+        for i in np.flatnonzero(m['status'] == code).tolist():
+            row = self.row(i)
+            yield row[0], row[1], row[2], row[3], row[6], row[7]
+
+    def summary(self):
+        return {'season': self.season, 'start': self.start.isoformat(' '), 'end': self.end.isoformat(' '),
+                'matches': self.manifest['matches'], 'stats': self.manifest['stats'],
+                'engagement': self.manifest.get('engagement'), 'created': self.manifest['created'],
+                'path': self.path}
+
+
+class SeasonArchive:
+    """The archived seasons under a directory, oldest first"""
+
+    def __init__(self, directory=ARCHIVE_DIR, rescan_seconds=ARCHIVE_RESCAN_SECONDS):
+        self.directory = directory
+        self.rescan_seconds = rescan_seconds
+        self._lock = threading.RLock()
+        self._snapshots = []
+        self._scanned_at = None
+
+    def rescan(self):
+        """Pick up snapshots written since the last scan (e.g. by another process)"""
+        with self._lock:
+            known = {snapshot.season: snapshot for snapshot in self._snapshots}
+            snapshots = []
+            if os.path.isdir(self.directory):
+                for name in sorted(os.listdir(self.directory)):
+                    path = os.path.join(self.directory, name)
+                    if not name.startswith('season-') or not os.path.isfile(os.path.join(path, MANIFEST)):
+                        continue
+                    season = int(name[len('season-'):])
+                    snapshots.append(known.get(season) or SeasonSnapshot(path))
+            snapshots.sort(key=lambda snapshot: snapshot.season)
+            self._snapshots = snapshots
+            self._scanned_at = time.monotonic()
+            return snapshots
+
+    def snapshots(self):
+        if self._scanned_at is None or time.monotonic() - self._scanned_at > self.rescan_seconds:
+            return self.rescan()
+        return self._snapshots
+
+    def seasons(self):
+        return [snapshot.season for snapshot in self.snapshots()]
+
+    def snapshot(self, season):
+        for snapshot in self.snapshots():
+            if snapshot.season == season:
+                return snapshot
+        return None
+
+    def boundary(self):
+        """Kick-off time before which every match is archived, or None"""
+        snapshots = self.snapshots()
+        return snapshots[-1].end if snapshots else None
+
+    def covers(self, when):
+        boundary = self.boundary()
+        return boundary is not None and when is not None and when < boundary
+
+    def match_count(self):
+        return sum(len(snapshot) for snapshot in self.snapshots())
+
+    def match(self, match_id):
+        """An archived match as a MATCHES row, or None"""
+        for snapshot in self.snapshots():
+            i = snapshot.find(match_id)
+            if i is not None:
+                return snapshot.row(i)
+        return None
+
+    def match_stats(self, match_id):
+        """(stats columns, rows) of an archived match's stats, or None"""
+        for snapshot in self.snapshots():
+            if snapshot.find(match_id) is not None:
+                return snapshot.stats, snapshot.stat_rows(match_id)
+        return None
+
+    def page(self, descending=True, key=None, filters=None, limit=25):
+        """Archived MATCHES rows past key, in (MatchDateTime, MatchID) order, at most limit"""
+        filters = filters or {}
+        rows = []
+        snapshots = self.snapshots()
+        for snapshot in (reversed(snapshots) if descending else snapshots):
+            if key is not None and (snapshot.end <= key[0] if not descending else snapshot.start > key[0]):
+                continue
+            rows += [snapshot.row(i) for i in snapshot.page(descending, key, filters, limit - len(rows))]
+            if len(rows) >= limit:
+                break
+        return rows
+
+    def completed_matches(self):
+        for snapshot in self.snapshots():
+            yield from snapshot.completed()
+
+    def pending(self, now=None):
+        """Seasons that could be archived now, oldest first: over, and every match in them final"""
+        now = now or datetime.now()
+        seasons = []
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            boundary = self.boundary()
+            if boundary is None:
+                cursor.execute(_OLDEST_MATCH_SQL)
+                oldest = cursor.fetchone()
+                if oldest is None:
+                    return []
+                season = season_for(oldest[0])
+            else:
+                season = season_for(boundary)
+            while season_bounds(season)[1] <= now:
+                cursor.execute(_LIVE_COUNTS_SQL, season_bounds(season))
+                _, still_open = cursor.fetchone()
+                if still_open:
+                    break
+                seasons.append(season)
+                season += 1
+        return seasons
+
+    def archive(self, prune=False, now=None):
+        """Archive every pending season (and prune them if asked); returns their summaries"""
+        archived = []
+        for season in self.pending(now):
+            snapshot = self.archive_season(season)
+            if prune:
+                self.prune(season)
+            archived.append(snapshot.summary())
+        return archived
+
+    def archive_season(self, season):
+        """Write season's snapshot; it must be the next season after the archive's boundary"""
+        with self._lock:
+            self.rescan()
+            start, end = season_bounds(season)
+            boundary = self.boundary()
+            if boundary is not None and start != boundary:
+                raise ArchiveError(f"Season {season} is not the next season to archive "
+                                   f"(the archive ends at {boundary:%d %b %Y})")
+            if end > datetime.now():
+                raise ArchiveError(f"Season {season} has not finished")
+
+            started = time.perf_counter()
+            with get_pool().connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(_LIVE_COUNTS_SQL, (start, end))
+                _, still_open = cursor.fetchone()
+                if still_open:
+                    raise ArchiveError(f"Season {season} has {still_open} matches that are not final")
+                if boundary is None:
+                    cursor.execute(_OLDEST_MATCH_SQL)
+                    oldest = cursor.fetchone()
+                    if oldest is not None and oldest[0] < start:
+                        raise ArchiveError(f"Season {season_for(oldest[0])} must be archived first")
+                cursor.execute(_SEASON_MATCHES_SQL, (start, end))
+                matches = cursor.fetchall()
+                cursor.execute(_SEASON_STATS_SQL, (start, end))
+                stats = cursor.fetchall()
+                cursor.execute(_SEASON_ENGAGEMENT_SQL, (start, end))
+                engagement = cursor.fetchall()
+
+            path = self._write(season, matches, stats, engagement)
+            snapshot = SeasonSnapshot(path)
+            self.rescan()
+
+        logger.info(f"Archived season {season}: {len(matches)} matches, {len(stats)} stats rows, "
+                    f"{len(engagement)} engagements in {(time.perf_counter() - started) * 1000:.1f} ms")
+        events.publish(events.SEASON_ARCHIVED, season=season, start=start, end=end,
+                       matches=len(matches), stats=len(stats))
+        return snapshot
+
+    def _write(self, season, matches, stats, engagement):
+        final = os.path.join(self.directory, f'season-{season}')
+        if os.path.exists(final):
+            raise ArchiveError(f"Season {season} is already archived")
+        os.makedirs(self.directory, exist_ok=True)
+
+        columns = {
+            'match_id': [row[0] for row in matches],
+            'home_team_id': [row[1] for row in matches],
+            'away_team_id': [row[2] for row in matches],
+            'match_time': [row[3] for row in matches],
+            'venue_id': [_null(row[4]) for row in matches],
+            'status': [MATCH_STATUSES.index(row[5]) for row in matches],
+            'home_score': [_null(row[6]) for row in matches],
+            'away_score': [_null(row[7]) for row in matches],
+        }
+        match_columns = {name: np.array(columns[name], dtype=dtype) for name, dtype in MATCH_DTYPES.items()}
+        stat_columns = {}
+        for i, name in enumerate(('stat_id', 'player_id', 'match_id', 'team_id')):
+            stat_columns[name] = np.array([_null(row[i]) for row in stats], dtype=STAT_DTYPES[name])
+        stat_columns['match_time'] = np.array([row[4] for row in stats], dtype='datetime64[s]')
+        for i, name in enumerate(('goals', 'assists', 'yellow_cards', 'red_cards', 'minutes'), start=5):
+            stat_columns[name] = np.array([row[i] or 0 for row in stats], dtype=STAT_DTYPES[name])
+        stat_columns['rating'] = np.array([np.nan if row[10] is None else row[10] for row in stats],
+                                          dtype=np.float64)
+        stat_columns['season'] = np.full(len(stats), season, dtype=STAT_DTYPES['season'])
+        engagement_types = list(ENGAGEMENT_TYPES)
+        engagement_types += sorted({str(row[4]) for row in engagement} - set(engagement_types))
+        engagement_columns = {name: np.array([row[i] for row in engagement], dtype=ENGAGEMENT_DTYPES[name])
+                              for i, name in enumerate(('engagement_id', 'fan_id', 'match_id', 'match_time'))}
+        engagement_columns['type'] = np.array([engagement_types.index(str(row[4])) for row in engagement],
+                                              dtype=ENGAGEMENT_DTYPES['type'])
+
+        # Written to a scratch directory and renamed into place, so readers never see half a season
+        scratch = tempfile.mkdtemp(prefix=f'.season-{season}-', dir=self.directory)
+        try:
+            for name, values in match_columns.items():
+                np.save(os.path.join(scratch, f'matches.{name}.npy'), values)
+            np.save(os.path.join(scratch, 'matches.by_id.npy'),
+                    np.argsort(match_columns['match_id'], kind='stable'))
+            for name, values in stat_columns.items():
+                np.save(os.path.join(scratch, f'stats.{name}.npy'), values)
+            for name, values in engagement_columns.items():
+                np.save(os.path.join(scratch, f'engagement.{name}.npy'), values)
+            start, end = season_bounds(season)
+            manifest = {'season': season, 'start': start.isoformat(' '), 'end': end.isoformat(' '),
+                        'matches': len(matches), 'stats': len(stats), 'engagement': len(engagement),
+                        'statuses': list(MATCH_STATUSES), 'engagement_types': engagement_types,
+                        'created': datetime.now().isoformat(' ', 'seconds')}
+            with open(os.path.join(scratch, MANIFEST), 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, indent=2)
+            for name in os.listdir(scratch):
+                os.chmod(os.path.join(scratch, name), 0o444)
+            os.chmod(scratch, 0o755)
+            os.rename(scratch, final)
+        except Exception:
+            shutil.rmtree(scratch, ignore_errors=True)
+            raise
+        return final
+
+    def live_counts(self, season):
+        """(matches, stats rows) of season still in the live tables"""
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(_LIVE_COUNTS_SQL, season_bounds(season))
+            matches = cursor.fetchone()[0]
+            cursor.execute(_LIVE_STATS_COUNT_SQL, season_bounds(season))
+            return matches, cursor.fetchone()[0]
+
+    def prune(self, season):
+        """Delete an archived season's rows from MATCHES and PLAYER_STATS; returns how many"""
+        snapshot = self.snapshot(season)
+        if snapshot is None:
+            raise ArchiveError(f"Season {season} is not archived")
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(_LIVE_COUNTS_SQL, season_bounds(season))
+            matches = cursor.fetchone()[0]
+            cursor.execute(_LIVE_STATS_COUNT_SQL, season_bounds(season))
+            stats = cursor.fetchone()[0]
+            if not matches and not stats:
+                return 0, 0
+            # Only rows the snapshot holds may go; anything else means the season changed after archiving
+            if matches != len(snapshot) or stats != snapshot.manifest['stats']:
+                raise ArchiveError(f"Season {season} has {matches} matches and {stats} stats rows live, the "
+                                   f"snapshot {len(snapshot)} and {snapshot.manifest['stats']}; not pruning")
+            # The reports count the season's engagement from the snapshot once its matches are gone
+            cursor.execute(_LIVE_ENGAGEMENT_COUNT_SQL, season_bounds(season))
+            engagement = cursor.fetchone()[0]
+            if engagement != snapshot.manifest.get('engagement', 0):
+                raise ArchiveError(f"Season {season} has {engagement} engagements live, the snapshot "
+                                   f"{snapshot.manifest.get('engagement', 'none')}; archive it again "
+                                   f"(remove {snapshot.path}) before pruning")
+            try:
+                cursor.execute(_PRUNE_STATS_SQL, season_bounds(season))
+                cursor.execute(_PRUNE_MATCHES_SQL, season_bounds(season))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        logger.info(f"Pruned season {season}: {matches} matches, {stats} stats rows")
+        return matches, stats
+
+    def prune_archived(self):
+        return {season: self.prune(season) for season in self.seasons()}
+
+    def verify(self):
+        """Problems found in the snapshots (an empty list when all is well)"""
+        problems = []
+        for snapshot in self.rescan():
+            label = f"season {snapshot.season}"
+            if len(snapshot) != snapshot.manifest['matches'] or \
+                    len(snapshot.stats['stat_id']) != snapshot.manifest['stats'] or \
+                    len(snapshot.engagement['fan_id']) != snapshot.manifest.get('engagement', 0):
+                problems.append(f"{label}: row counts differ from the manifest")
+            times = snapshot.matches['match_time']
+            if len(times) and (times[0] < np.datetime64(snapshot.start) or times[-1] >= np.datetime64(snapshot.end)):
+                problems.append(f"{label}: matches outside the season")
+            if np.any(np.diff(snapshot._times) < 0) or np.any(np.diff(snapshot.stats['match_id']) < 0):
+                problems.append(f"{label}: rows out of order")
+            matches, stats = self.live_counts(snapshot.season)
+            if (matches or stats) and (matches, stats) != (len(snapshot), snapshot.manifest['stats']):
+                problems.append(f"{label}: live tables hold {matches} matches and {stats} stats rows, "
+                                f"the snapshot {len(snapshot)} and {snapshot.manifest['stats']}")
+        return problems
+
+
+_archive = SeasonArchive()
+
+
+def get_archive():
+    return _archive
+
+
+# The analytics store and the standings read archived seasons from the snapshots
+get_analytics().use_archive(_archive)
+get_standings().use_archive(_archive)
+
+
+if __name__ == "__main__":
+    commands = ('list', 'archive', 'prune', 'verify')
+    if len(sys.argv) < 2 or sys.argv[1] not in commands or (len(sys.argv) > 2 and sys.argv[2:] != ['--prune']):
+        print("Usage: python season_archive.py list | archive [--prune] | prune | verify")
+        sys.exit(1)
+    command = sys.argv[1]
+    try:
+        if command == 'archive':
+            archived = _archive.archive(prune='--prune' in sys.argv)
+            print(f"Archived {len(archived)} seasons" + (f": {', '.join(str(s['season']) for s in archived)}"
+                                                         if archived else ''))
+        elif command == 'prune':
+            for season, (matches, stats) in _archive.prune_archived().items():
+                print(f"Season {season}: pruned {matches} matches, {stats} stats rows")
+        elif command == 'verify':
+            problems = _archive.verify()
+            for problem in problems:
+                print(problem)
+            print(f"{len(_archive.seasons())} seasons checked, {len(problems)} problems")
+            sys.exit(1 if problems else 0)
+    except ArchiveError as e:
+        print(str(e))
+        sys.exit(1)
+    for snapshot in _archive.rescan():
+        summary = snapshot.summary()
+        live = _archive.live_counts(snapshot.season)
+        print(f"{summary['season']}/{(summary['season'] + 1) % 100:02d}  {summary['matches']:>6} matches "
+              f"{summary['stats']:>7} stats rows  {'live copy' if any(live) else 'pruned':<9}  {summary['created']}")
+    pending = _archive.pending()
+    if pending:
+        print(f"Ready to archive: {', '.join(str(season) for season in pending)}")
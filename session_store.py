@@ -0,0 +1,314 @@
+"""
+Server-side sessions for Sports Management System
+The session cookie carries only a random session ID; the session itself is
+kept in a local SQLite file (SESSION_DB) that every worker process shares, so
+sessions survive restarts and do not depend on each process's secret key.
+Sessions expire after SESSION_LIFETIME_SECONDS without a request (sliding
+expiry), expired rows are deleted in bulk on a background thread, and hot
+sessions are kept decoded in an in-process LRU that is checked against the
+row's version on every request. The role lives in its own column; changing a
+user's role updates it in all their stored sessions, so role_required sees
+the new role on their next request in every process.
+
+Usage:
+    python session_store.py stats
+    python session_store.py evict
+    python session_store.py revoke <user_id>
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import secrets
+import logging
+import threading
+from datetime import datetime, timedelta
+from collections import OrderedDict
+
+from flask.sessions import SessionInterface, SessionMixin
+from flask.json.tag import TaggedJSONSerializer
+from werkzeug.datastructures import CallbackDict
+
+import events
+
+logger = logging.getLogger('sessions')
+
+# Session settings (can be overridden from the environment)
+SESSION_DB = os.environ.get('SESSION_DB', './sessions.db')
+SESSION_LIFETIME_SECONDS = int(os.environ.get('SESSION_LIFETIME_SECONDS', 8 * 3600))
+SESSION_TOUCH_SECONDS = int(os.environ.get('SESSION_TOUCH_SECONDS', 60))
+SESSION_EVICT_SECONDS = float(os.environ.get('SESSION_EVICT_SECONDS', 300))
+SESSION_CACHE_SIZE = int(os.environ.get('SESSION_CACHE_SIZE', 2048))
+
+SESSION_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS SESSIONS (
+        SessionID TEXT PRIMARY KEY,
+        UserID INTEGER,
+        Role TEXT,
+        Data TEXT NOT NULL,
+        Version INTEGER NOT NULL,
+        Expires REAL NOT NULL
+    )''',
+    'CREATE INDEX IF NOT EXISTS IX_SESSIONS_UserID ON SESSIONS (UserID)',
+    'CREATE INDEX IF NOT EXISTS IX_SESSIONS_Expires ON SESSIONS (Expires)',
+]
+
+
+class SessionStore:
+    """SQLite-backed sessions shared by every process, with an LRU of decoded sessions"""
+
+    def __init__(self, path=SESSION_DB, lifetime=SESSION_LIFETIME_SECONDS, touch=SESSION_TOUCH_SECONDS,
+                 evict_seconds=SESSION_EVICT_SECONDS, cache_size=SESSION_CACHE_SIZE):
+        self.path = path
+        self.lifetime = lifetime
+        self.touch_seconds = touch
+        self.evict_seconds = evict_seconds
+        self.cache_size = cache_size
+        self.serializer = TaggedJSONSerializer()
+        self._local = threading.local()
+        self._cache = OrderedDict()  # SessionID -> (version, data)
+        self._lock = threading.Lock()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+        self._thread = None
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evicted = 0
+
+    def _conn(self):
+        # One connection per thread; autocommit, each statement is its own transaction
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=30000')
+            if not self._initialized:
+                with self._init_lock:
+                    if not self._initialized:
+                        for statement in SESSION_SCHEMA:
+                            conn.execute(statement)
+                        self._initialized = True
+                        self._start()
+            self._local.conn = conn
+        return conn
+
+    def _start(self):
+        if self._thread is None and self.evict_seconds > 0:
+            self._thread = threading.Thread(target=self._run, name='session-evict', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.evict_seconds)
+            try:
+                self.evict_expired()
+            except Exception as e:
+                logger.error(f"Session eviction failed: {str(e)}")
+
+    @staticmethod
+    def new_id():
+        return secrets.token_urlsafe(32)
+
+    def _remember(self, sid, version, data):
+        with self._lock:
+            self._cache[sid] = (version, data)
+            self._cache.move_to_end(sid)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _forget(self, sids):
+        with self._lock:
+            for sid in sids:
+                self._cache.pop(sid, None)
+
+    def load(self, sid):
+        """(data, version, expires) for a live session, or None"""
+        conn = self._conn()
+        # The version check is one primary key lookup; the decoded data comes from the LRU
+        row = conn.execute('SELECT Version, Expires FROM SESSIONS WHERE SessionID = ?', (sid,)).fetchone()
+        if row is None or row[1] < time.time():
+            self._forget([sid])
+            return None
+        version, expires = row
+        with self._lock:
+            cached = self._cache.get(sid)
+            if cached and cached[0] == version:
+                self._cache.move_to_end(sid)
+                self.hits += 1
+                return dict(cached[1]), version, expires
+        self.misses += 1
+        row = conn.execute('SELECT Data, Role, Version FROM SESSIONS WHERE SessionID = ?', (sid,)).fetchone()
+        if row is None:
+            return None
+        data = self._decode(row[0], row[1])
+        self._remember(sid, row[2], data)
+        return dict(data), row[2], expires
+
+    def _decode(self, data, role):
+        data = self.serializer.loads(data)
+        if role is not None:
+            data['role'] = role
+        return data
+
+    def save(self, sid, data, role_changed=False):
+        """Write a session; returns its new version. The stored role is kept unless role_changed."""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                '''INSERT INTO SESSIONS (SessionID, UserID, Role, Data, Version, Expires) VALUES (?, ?, ?, ?, 1, ?)
+                   ON CONFLICT (SessionID) DO UPDATE SET UserID = excluded.UserID,
+                   Role = CASE WHEN ? THEN excluded.Role ELSE SESSIONS.Role END,
+                   Data = excluded.Data, Version = SESSIONS.Version + 1, Expires = excluded.Expires''',
+                (sid, data.get('user_id'), data.get('role'), self.serializer.dumps(data),
+                 time.time() + self.lifetime, role_changed))
+            version, role = conn.execute('SELECT Version, Role FROM SESSIONS WHERE SessionID = ?', (sid,)).fetchone()
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        data = dict(data)
+        if role is not None:
+            data['role'] = role
+        self._remember(sid, version, data)
+        self.writes += 1
+        return version
+
+    def touch(self, sid):
+        """Push back a session's expiry without rewriting it"""
+        self._conn().execute('UPDATE SESSIONS SET Expires = ? WHERE SessionID = ?',
+                             (time.time() + self.lifetime, sid))
+        self.writes += 1
+
+    def needs_touch(self, expires):
+        return expires - time.time() < self.lifetime - self.touch_seconds
+
+    def delete(self, sid):
+        self._conn().execute('DELETE FROM SESSIONS WHERE SessionID = ?', (sid,))
+        self._forget([sid])
+
+    def evict_expired(self):
+        """Delete every expired session in one statement; returns how many"""
+        deleted = self._conn().execute('DELETE FROM SESSIONS WHERE Expires < ?', (time.time(),)).rowcount
+        if deleted:
+            self.evicted += deleted
+            logger.info(f"Evicted {deleted} expired sessions")
+        return deleted
+
+    def set_user_role(self, user_id, role):
+        """Change the role in every session of user_id; returns how many were changed"""
+        conn = self._conn()
+        sids = [row[0] for row in conn.execute('SELECT SessionID FROM SESSIONS WHERE UserID = ?', (user_id,))]
+        # The version bump makes every process reload the session on its next request
+        conn.execute('UPDATE SESSIONS SET Role = ?, Version = Version + 1 WHERE UserID = ?', (role, user_id))
+        self._forget(sids)
+        return len(sids)
+
+    def revoke_user(self, user_id):
+        """Sign user_id out everywhere; returns how many sessions were deleted"""
+        conn = self._conn()
+        sids = [row[0] for row in conn.execute('SELECT SessionID FROM SESSIONS WHERE UserID = ?', (user_id,))]
+        conn.execute('DELETE FROM SESSIONS WHERE UserID = ?', (user_id,))
+        self._forget(sids)
+        return len(sids)
+
+    def stats(self):
+        conn = self._conn()
+        total, live = conn.execute('SELECT COUNT(*), SUM(Expires >= ?) FROM SESSIONS', (time.time(),)).fetchone()
+        with self._lock:
+            cached = len(self._cache)
+        return {'path': self.path, 'sessions': total, 'live': live or 0, 'cached': cached,
+                'hits': self.hits, 'misses': self.misses, 'writes': self.writes, 'evicted': self.evicted}
+
+
+class StoredSession(CallbackDict, SessionMixin):
+    """A session loaded from (and saved back to) the SessionStore"""
+
+    def __init__(self, initial=None, sid=None, version=0, expires=None, new=False):
+        def on_update(session):
+            session.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.version = version
+        self.expires = expires
+        self.new = new
+        self.modified = False
+        self.loaded_user_id = (initial or {}).get('user_id')
+        self.loaded_role = (initial or {}).get('role')
+
+
+class StoredSessionInterface(SessionInterface):
+    """Flask session interface over a SessionStore; the cookie holds only the session ID"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            loaded = self.store.load(sid)
+            if loaded:
+                data, version, expires = loaded
+                return StoredSession(data, sid, version, expires)
+        return StoredSession(sid=self.store.new_id(), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if session.modified or session.new:
+            if not session.new and session.get('user_id') != session.loaded_user_id:
+                # Signing in or out starts a new session ID, so an old cookie cannot be reused
+                self.store.delete(session.sid)
+                session.sid = self.store.new_id()
+            session.version = self.store.save(session.sid, dict(session),
+                                              role_changed=session.get('role') != session.loaded_role)
+        elif self.store.needs_touch(session.expires):
+            self.store.touch(session.sid)
+        else:
+            return
+
+        response.set_cookie(name, session.sid,
+                            expires=datetime.now() + timedelta(seconds=self.store.lifetime),
+                            httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                            secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+
+
+_store = SessionStore()
+
+
+def get_session_store():
+    return _store
+
+
+def _on_user_role_changed(user_id, role, **payload):
+    _store.set_user_role(user_id, role)
+
+
+events.subscribe(events.USER_ROLE_CHANGED, _on_user_role_changed)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ('stats', 'evict', 'revoke') or \
+            (sys.argv[1] == 'revoke' and len(sys.argv) < 3):
+        print("Usage: python session_store.py stats | evict | revoke <user_id>")
+        sys.exit(1)
+    if sys.argv[1] == 'evict':
+        print(f"Evicted {_store.evict_expired()} expired sessions")
+    elif sys.argv[1] == 'revoke':
+        print(f"Revoked {_store.revoke_user(int(sys.argv[2]))} sessions")
+    for key, value in _store.stats().items():
+        print(f"{key:<10} {value}")
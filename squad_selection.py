@@ -0,0 +1,367 @@
+"""
+Squad selection for Sports Management System
+A coach names a matchday squad (a starting XI and substitutes) for each of
+their team's fixtures. Everything the page needs is read in one batch: the
+roster and injuries come from the availability index, judged on the match
+day, and the team's recent PLAYER_STATS rows come from one query and are
+grouped by player in memory. A proposed lineup is checked against the
+position and fitness rules without going back to the database, and the best
+XI for a formation is picked from each player's recent ratings. A selection
+replaces the team's previous one for the match in one transaction.
+
+A player's form is the mean of their last FORM_MATCHES ratings, with recent
+matches and longer appearances weighted more. It is pulled towards
+PRIOR_RATING, so one good match does not outrank a steady season. Their
+score is that form scaled by their fitness.
+
+Usage:
+    python squad_selection.py init                                  - create MATCH_SQUADS if missing
+    python squad_selection.py suggest <match_id> <team_id> [formation]
+    python squad_selection.py show <match_id> <team_id>
+"""
+
+import os
+import sys
+import logging
+from datetime import datetime, timedelta
+from collections import OrderedDict, namedtuple
+
+import events
+from availability import SquadMember, get_availability
+from db_backends import get_backend
+from db_pool import get_pool
+from queries import MATCH_BY_ID, register
+from records import match_record
+from reference_cache import team_name
+
+logger = logging.getLogger('squads')
+
+# Selection rules (can be overridden from the environment)
+FORM_MATCHES = int(os.environ.get('SQUAD_FORM_MATCHES', 5))
+FORM_DAYS = int(os.environ.get('SQUAD_FORM_DAYS', 180))
+MIN_STARTER_FITNESS = int(os.environ.get('SQUAD_MIN_STARTER_FITNESS', 75))
+MAX_SUBSTITUTES = int(os.environ.get('SQUAD_MAX_SUBSTITUTES', 9))
+STARTERS = 11
+# Rating assumed for a player without recent matches, and how many full matches it counts for. It is
+# a little below an average match, so untried players rank behind regulars in average form
+PRIOR_RATING = 5.5
+PRIOR_WEIGHT = 1.0
+# Weight of each older match relative to the one after it
+FORM_DECAY = 0.8
+# Share of a player's score they bring to a position that is not their own
+OUT_OF_POSITION = 0.8
+
+STARTER, SUBSTITUTE = 'Starter', 'Substitute'
+GOALKEEPER = 'Goalkeeper'
+POSITIONS = (GOALKEEPER, 'Defender', 'Midfielder', 'Forward')
+# Outfield shapes: defenders-midfielders-forwards, behind one goalkeeper
+FORMATIONS = OrderedDict((name, dict(zip(POSITIONS, (1,) + tuple(int(n) for n in name.split('-')))))
+                         for name in ('4-4-2', '4-3-3', '4-5-1', '3-5-2', '3-4-3', '5-3-2', '5-4-1'))
+
+# Created by SQLiteBackend.initialize on SQLite; `python squad_selection.py init` on Access
+ACCESS_TABLE_SQL = '''
+    CREATE TABLE MATCH_SQUADS (
+        SelectionID COUNTER PRIMARY KEY,
+        MatchID LONG NOT NULL,
+        TeamID LONG NOT NULL,
+        PlayerID LONG NOT NULL,
+        Role TEXT(20),
+        Position TEXT(50),
+        Formation TEXT(10),
+        SelectedBy LONG,
+        SelectedAt DATETIME
+    )
+'''
+# Every appearance of the team's current players in the window, newest first
+RECENT_STATS_SQL = register('squads.recent_stats', '''
+    SELECT PS.PlayerID, PS.MinutesPlayed, PS.PerformanceRating
+    FROM PLAYER_STATS PS
+    INNER JOIN MATCHES M ON PS.MatchID = M.MatchID
+    WHERE PS.PlayerID IN (SELECT PlayerID FROM PLAYERS WHERE TeamID = ?)
+      AND M.MatchDateTime >= ? AND M.MatchDateTime < ?
+    ORDER BY M.MatchDateTime DESC
+''')
+SELECTION_SQL = register('squads.by_match', '''
+    SELECT PlayerID, Role, Formation, SelectedBy, SelectedAt
+    FROM MATCH_SQUADS
+    WHERE MatchID = ? AND TeamID = ?
+    ORDER BY SelectionID
+''')
+DELETE_SELECTION_SQL = register('squads.delete', 'DELETE FROM MATCH_SQUADS WHERE MatchID = ? AND TeamID = ?')
+INSERT_SELECTION_SQL = register('squads.insert', '''
+    INSERT INTO MATCH_SQUADS (MatchID, TeamID, PlayerID, Role, Position, Formation, SelectedBy, SelectedAt)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+''')
+
+# A squad member with their recent form; form is None without rated matches in the window
+Candidate = namedtuple('Candidate', SquadMember._fields + ('form', 'appearances', 'score'))
+
+
+class SquadError(Exception):
+    """Raised when a squad cannot be loaded or saved (unknown match, another team's match, ...)"""
+
+
+def form_rating(appearances):
+    """Weighted recent rating from (minutes, rating) pairs, newest first"""
+    total = PRIOR_WEIGHT * PRIOR_RATING
+    weight = PRIOR_WEIGHT
+    step = 1.0
+    for minutes, rating in appearances[:FORM_MATCHES]:
+        share = min(minutes, 90) / 90 if minutes else 1.0
+        total += step * share * rating
+        weight += step * share
+        step *= FORM_DECAY
+    return total / weight
+
+
+class Lineup:
+    """A formation, starters and substitutes, with what the rules say about them"""
+
+    def __init__(self, formation, starters, substitutes, errors, warnings, out_of_position=()):
+        self.formation = formation
+        self.starters = starters          # Candidates (or None for players not in the squad)
+        self.substitutes = substitutes
+        self.errors = errors
+        self.warnings = warnings
+        self.out_of_position = frozenset(out_of_position)
+
+    @property
+    def valid(self):
+        return not self.errors
+
+    @property
+    def score(self):
+        return sum(candidate.score * (OUT_OF_POSITION if candidate.id in self.out_of_position else 1.0)
+                   for candidate in self.starters if candidate is not None)
+
+    def player_ids(self, role):
+        return [candidate.id for candidate in (self.starters if role == STARTER else self.substitutes)
+                if candidate is not None]
+
+
+class SquadBoard:
+    """A team's players for one match, with their availability on the day and their recent form"""
+
+    def __init__(self, match, team_id, candidates, saved=None):
+        self.match = match
+        self.team_id = team_id
+        self.team_name = team_name(team_id)
+        self.candidates = candidates      # PlayerID -> Candidate, by name
+        self.saved = saved                # Lineup last saved for the match, or None
+
+    @property
+    def opponent(self):
+        return self.match.away_team if self.match.home_team_id == self.team_id else self.match.home_team
+
+    @property
+    def locked(self):
+        """True once the match is under way or over; the squad can then only be viewed"""
+        return self.match.status != 'Scheduled' or self.match.match_datetime <= datetime.now()
+
+    def validate(self, formation, starters, substitutes):
+        """Check a lineup (lists of PlayerIDs) against the squad, positions and fitness"""
+        errors, warnings = [], []
+        shape = FORMATIONS.get(formation)
+        if shape is None:
+            errors.append(f"Unknown formation {formation}." if formation else 'Choose a formation.')
+        if len(starters) != STARTERS:
+            errors.append(f"Pick {STARTERS} starters ({len(starters)} picked).")
+        if len(substitutes) > MAX_SUBSTITUTES:
+            errors.append(f"At most {MAX_SUBSTITUTES} substitutes ({len(substitutes)} picked).")
+
+        seen = set()
+        picked = {STARTER: [], SUBSTITUTE: []}
+        for role, player_ids in ((STARTER, starters), (SUBSTITUTE, substitutes)):
+            for player_id in player_ids:
+                candidate = self.candidates.get(player_id)
+                picked[role].append(candidate)
+                if candidate is None:
+                    errors.append(f"Player #{player_id} is not in the {self.team_name} squad.")
+                    continue
+                if player_id in seen:
+                    errors.append(f"{candidate.name} is picked twice.")
+                    continue
+                seen.add(player_id)
+                if not candidate.available:
+                    back = f", expected back {candidate.expected_return:%d %b}" if candidate.expected_return else ''
+                    errors.append(f"{candidate.name} is {candidate.reason}{back}.")
+                elif role == STARTER and candidate.fitness < MIN_STARTER_FITNESS:
+                    errors.append(f"{candidate.name} is {candidate.fitness}% fit; starters need "
+                                  f"{MIN_STARTER_FITNESS}%.")
+
+        # Positions: one goalkeeper, and outfield players beyond the formation's count play out of position
+        starting = [candidate for candidate in picked[STARTER] if candidate is not None]
+        by_position = {}
+        for candidate in starting:
+            by_position.setdefault(candidate.position, []).append(candidate)
+        keepers = len(by_position.get(GOALKEEPER, ()))
+        if keepers != 1:
+            errors.append(f"The starting XI needs exactly one goalkeeper ({keepers} picked).")
+        out_of_position = []
+        if shape is not None:
+            for position, players in by_position.items():
+                if position == GOALKEEPER:
+                    continue
+                extra = len(players) - shape.get(position, 0)
+                if extra > 0:
+                    players = sorted(players, key=lambda candidate: candidate.score)
+                    out_of_position += [candidate.id for candidate in players[:extra]]
+            for position in POSITIONS[1:]:
+                count = len(by_position.get(position, ()))
+                if count < shape[position]:
+                    warnings.append(f"{formation} plays {shape[position]} {position.lower()}s; "
+                                    f"{count} picked, the rest play out of position.")
+        if substitutes and not any(candidate is not None and candidate.position == GOALKEEPER
+                                   for candidate in picked[SUBSTITUTE]):
+            warnings.append('There is no goalkeeper among the substitutes.')
+        return Lineup(formation, picked[STARTER], picked[SUBSTITUTE], errors, warnings, out_of_position)
+
+    def suggest(self, formation=None):
+        """The highest scoring valid XI and bench for formation (default: whichever formation scores best)"""
+        formations = [formation] if formation in FORMATIONS else list(FORMATIONS)
+        return max((self._pick(name) for name in formations),
+                   key=lambda lineup: (lineup.valid, lineup.score))
+
+    def _pick(self, formation):
+        # Positions do not overlap, so the best players of each position, then the best of the
+        # rest for any position that is short, is the best XI for the formation
+        ranked = sorted((candidate for candidate in self.candidates.values() if candidate.available),
+                        key=lambda candidate: -candidate.score)
+        fit = [candidate for candidate in ranked if candidate.fitness >= MIN_STARTER_FITNESS]
+        starters, short = [], 0
+        for position, count in FORMATIONS[formation].items():
+            players = [candidate for candidate in fit if candidate.position == position][:count]
+            starters += players
+            if position != GOALKEEPER:
+                short += count - len(players)
+        chosen = {candidate.id for candidate in starters}
+        spare = [candidate for candidate in fit if candidate.id not in chosen and candidate.position != GOALKEEPER]
+        starters += spare[:short]
+        chosen.update(candidate.id for candidate in spare[:short])
+
+        # Bench: a second goalkeeper first, then the best of the rest
+        bench = [candidate for candidate in ranked if candidate.id not in chosen]
+        bench.sort(key=lambda candidate: candidate.position != GOALKEEPER)
+        substitutes = bench[:1] + sorted(bench[1:], key=lambda candidate: -candidate.score)
+        return self.validate(formation, [candidate.id for candidate in starters],
+                             [candidate.id for candidate in substitutes[:MAX_SUBSTITUTES]])
+
+
+def _ensure_table(conn):
+    # SQLite creates MATCH_SQUADS with the rest of the schema; an Access database may predate it
+    backend = get_backend()
+    if backend.name == 'access' and 'MATCH_SQUADS' not in backend.list_tables(conn):
+        conn.cursor().execute(ACCESS_TABLE_SQL)
+        conn.commit()
+        logger.info('Created MATCH_SQUADS')
+
+
+_table_checked = False
+
+
+def load_board(match_id, team_id):
+    """Match, roster, availability, recent form and saved selection for one team, in one batch"""
+    global _table_checked
+    with get_pool().connection() as conn:
+        if not _table_checked:
+            _ensure_table(conn)
+            _table_checked = True
+        cursor = conn.cursor()
+        cursor.execute(MATCH_BY_ID, (match_id,))
+        row = cursor.fetchone()
+        if not row:
+            raise SquadError('Match not found!')
+        match = match_record(row)
+        if team_id not in (match.home_team_id, match.away_team_id):
+            raise SquadError(f"{team_name(team_id)} are not playing in this match.")
+        cursor.execute(RECENT_STATS_SQL, (team_id, match.match_datetime - timedelta(days=FORM_DAYS),
+                                          match.match_datetime))
+        stats = cursor.fetchall()
+        cursor.execute(SELECTION_SQL, (match_id, team_id))
+        selection = cursor.fetchall()
+
+    appearances = {}
+    for player_id, minutes, rating in stats:
+        if rating is not None:
+            appearances.setdefault(player_id, []).append((minutes, rating))
+    candidates = OrderedDict()
+    for member in get_availability().squad(team_id, match.match_datetime):
+        played = appearances.get(member.id, [])
+        form = form_rating(played)
+        candidates[member.id] = Candidate(*member, form=round(form, 2) if played else None,
+                                          appearances=len(played), score=round(form * member.fitness / 100, 3))
+
+    board = SquadBoard(match, team_id, candidates)
+    if selection:
+        board.saved = board.validate(selection[0][2],
+                                     [row[0] for row in selection if row[1] == STARTER],
+                                     [row[0] for row in selection if row[1] == SUBSTITUTE])
+    return board
+
+
+def save_selection(board, lineup, user_id):
+    """Replace the team's squad for the match with lineup, in one transaction"""
+    if board.locked:
+        raise SquadError('The match has started; its squads can no longer be changed.')
+    if not lineup.valid:
+        raise SquadError(' '.join(lineup.errors))
+    selected_at = datetime.now()
+    rows = [(board.match.match_id, board.team_id, candidate.id, role, candidate.position, lineup.formation,
+             user_id, selected_at)
+            for role, players in ((STARTER, lineup.starters), (SUBSTITUTE, lineup.substitutes))
+            for candidate in players]
+    with get_pool().connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(DELETE_SELECTION_SQL, (board.match.match_id, board.team_id))
+            cursor.executemany(INSERT_SELECTION_SQL, rows)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    board.saved = lineup
+    events.publish(events.SQUAD_SELECTED, match_id=board.match.match_id, team_id=board.team_id,
+                   formation=lineup.formation, starters=lineup.player_ids(STARTER),
+                   substitutes=lineup.player_ids(SUBSTITUTE))
+
+
+def _print_lineup(board, lineup):
+    print(f"{board.team_name} vs {board.opponent}, {board.match.match_datetime:%d %b %Y %H:%M} "
+          f"({lineup.formation}, score {lineup.score:.2f})")
+    for role, players in ((STARTER, lineup.starters), (SUBSTITUTE, lineup.substitutes)):
+        for candidate in players:
+            if candidate is None:
+                continue
+            form = f"{candidate.form:.2f}" if candidate.form is not None else '  - '
+            note = ' (out of position)' if candidate.id in lineup.out_of_position else ''
+            print(f"  {role:<11} {candidate.name:<30} {candidate.position or '':<11} {candidate.fitness:>3}%  "
+                  f"form {form} in {candidate.appearances}{note}")
+    for message in lineup.errors:
+        print(f"  error: {message}")
+    for message in lineup.warnings:
+        print(f"  warning: {message}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ('init', 'suggest', 'show') or \
+            (sys.argv[1] != 'init' and len(sys.argv) < 4):
+        print("Usage: python squad_selection.py init | suggest <match_id> <team_id> [formation] | "
+              "show <match_id> <team_id>")
+        sys.exit(1)
+    if sys.argv[1] == 'init':
+        with get_pool().connection() as conn:
+            _ensure_table(conn)
+        print('MATCH_SQUADS is ready')
+        sys.exit(0)
+    try:
+        board = load_board(int(sys.argv[2]), int(sys.argv[3]))
+    except SquadError as e:
+        print(e)
+        sys.exit(1)
+    if sys.argv[1] == 'show':
+        if board.saved is None:
+            print('No squad saved for this match')
+            sys.exit(1)
+        _print_lineup(board, board.saved)
+    else:
+        _print_lineup(board, board.suggest(sys.argv[4] if len(sys.argv) > 4 else None))
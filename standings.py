@@ -0,0 +1,260 @@
+"""
+League standings and team form engine
+Keeps per-team aggregates (W/D/L, goals, points, recent form) for each season
+in memory and updates them from match results instead of scanning MATCHES on
+every request. The table and team records are served for the current season
+unless another is asked for. A rebuild reads archived seasons from the season
+archive's snapshots.
+"""
+
+import os
+import sys
+import bisect
+import logging
+import threading
+from datetime import datetime
+
+import events
+from db_pool import get_pool
+from player_analytics import season_for
+from queries import register
+from reference_cache import team_name
+
+logger = logging.getLogger('standings')
+
+POINTS_WIN = 3
+POINTS_DRAW = 1
+FORM_LENGTH = int(os.environ.get('STANDINGS_FORM_LENGTH', 5))
+_NO_BOUNDARY = datetime(1900, 1, 1)
+
+# Completed matches not in the season archive (boundary is the archive's, or _NO_BOUNDARY)
+_COMPLETED_SQL = register('standings.completed', '''
+    SELECT MatchID, HomeTeamID, AwayTeamID, MatchDateTime, HomeScore, AwayScore, Status
+    FROM MATCHES
+    WHERE Status = 'Completed' AND MatchDateTime >= ?
+''')
+
+
+class TeamRecord:
+    """Aggregates for one team"""
+
+    __slots__ = ('team_id', 'played', 'wins', 'draws', 'losses',
+                 'goals_for', 'goals_against', 'results')
+
+    def __init__(self, team_id):
+        self.team_id = team_id
+        self.played = 0
+        self.wins = 0
+        self.draws = 0
+        self.losses = 0
+        self.goals_for = 0
+        self.goals_against = 0
+        self.results = []  # sorted (MatchDateTime, MatchID, 'W'/'D'/'L')
+
+    @property
+    def points(self):
+        return self.wins * POINTS_WIN + self.draws * POINTS_DRAW
+
+    @property
+    def goal_difference(self):
+        return self.goals_for - self.goals_against
+
+    @property
+    def form(self):
+        """Most recent results first, e.g. 'WWDLW'"""
+        return ''.join(result for _, _, result in reversed(self.results[-FORM_LENGTH:]))
+
+    def _add(self, match_datetime, match_id, scored, conceded, sign):
+        result = 'W' if scored > conceded else 'L' if scored < conceded else 'D'
+        self.played += sign
+        self.goals_for += sign * scored
+        self.goals_against += sign * conceded
+        if result == 'W':
+            self.wins += sign
+        elif result == 'L':
+            self.losses += sign
+        else:
+            self.draws += sign
+
+        entry = (match_datetime, match_id, result)
+        if sign > 0:
+            bisect.insort(self.results, entry)
+        else:
+            index = bisect.bisect_left(self.results, entry)
+            if index < len(self.results) and self.results[index] == entry:
+                del self.results[index]
+
+    def as_dict(self):
+        played = self.played or 1
+        return {
+            'team_id': self.team_id,
+            'team_name': team_name(self.team_id),
+            'played': self.played,
+            'wins': self.wins,
+            'draws': self.draws,
+            'losses': self.losses,
+            'goals_scored': self.goals_for,
+            'goals_conceded': self.goals_against,
+            'goal_difference': self.goal_difference,
+            'points': self.points,
+            'win_percentage': round(100.0 * self.wins / played, 1),
+            'avg_goals': f"{self.goals_for / played:.1f}",
+            'avg_conceded': f"{self.goals_against / played:.1f}",
+            'form': self.form,
+        }
+
+
+class StandingsEngine:
+    """Materialized standings per season, updated one match at a time"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._seasons = {}  # season -> {TeamID: TeamRecord}
+        self._applied = {}  # MatchID -> counted result, so corrections can be undone
+        self._tables = {}  # season -> sorted table, dropped when the season changes
+        self._built = False
+        self._archive = None
+        self._rebuild_lock = threading.Lock()
+        self._pending = None  # matches applied while a rebuild reads the database, replayed after it
+
+    @property
+    def rebuilding(self):
+        return self._pending is not None
+
+    def use_archive(self, archive):
+        """Read completed matches before archive.boundary() from the archive's snapshots"""
+        self._archive = archive
+
+    def _record(self, season, team_id):
+        teams = self._seasons.setdefault(season, {})
+        record = teams.get(team_id)
+        if record is None:
+            record = teams[team_id] = TeamRecord(team_id)
+        return record
+
+    def apply_match(self, match_id, home_team_id, away_team_id, match_datetime,
+                    home_score, away_score, status):
+        """Bring the aggregates in line with the current state of one match"""
+        with self._lock:
+            if self._pending is not None:
+                # The rebuild may have read this match before the change; apply it again after the swap
+                self._pending.append((match_id, home_team_id, away_team_id, match_datetime,
+                                      home_score, away_score, status))
+            self._apply(match_id, home_team_id, away_team_id, match_datetime, home_score, away_score, status)
+
+    def _apply(self, match_id, home_team_id, away_team_id, match_datetime,
+               home_score, away_score, status):
+        with self._lock:
+            previous = self._applied.pop(match_id, None)
+            if previous:
+                self._count(*previous, sign=-1)
+
+            if status == 'Completed' and home_score is not None and away_score is not None:
+                current = (match_id, home_team_id, away_team_id, match_datetime,
+                           int(home_score), int(away_score))
+                self._count(*current, sign=1)
+                self._applied[match_id] = current
+
+    def _count(self, match_id, home_team_id, away_team_id, match_datetime,
+               home_score, away_score, sign):
+        season = season_for(match_datetime)
+        self._record(season, home_team_id)._add(match_datetime, match_id, home_score, away_score, sign)
+        self._record(season, away_team_id)._add(match_datetime, match_id, away_score, home_score, sign)
+        self._tables.pop(season, None)
+
+    def rebuild(self):
+        """Recompute every team from the completed matches in the archive and the database"""
+        with self._rebuild_lock:
+            with self._lock:
+                self._pending = []
+            try:
+                boundary = self._archive.boundary() if self._archive is not None else None
+                rows = [row + ('Completed',) for row in self._archive.completed_matches()] if boundary else []
+                with get_pool().connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute(_COMPLETED_SQL, (boundary or _NO_BOUNDARY,))
+                    rows += cursor.fetchall()
+
+                with self._lock:
+                    self._seasons = {}
+                    self._applied = {}
+                    self._tables = {}
+                    for row in rows:
+                        self._apply(*row)
+                    # Updates published while the database was read; _applied undoes any already counted
+                    for match in self._pending:
+                        self._apply(*match)
+                    self._built = True
+            finally:
+                with self._lock:
+                    self._pending = None
+        logger.info(f"Standings rebuilt from {len(rows)} completed matches")
+
+    def _ensure_built(self):
+        if not self._built:
+            with self._lock:
+                if not self._built:
+                    self.rebuild()
+
+    def seasons(self):
+        """Seasons with at least one completed match, newest first"""
+        self._ensure_built()
+        with self._lock:
+            return sorted((season for season, teams in self._seasons.items()
+                           if any(record.played for record in teams.values())), reverse=True)
+
+    def team(self, team_id, season=None):
+        """A team's aggregates for a season (default: current season) as a dict (constant time)"""
+        self._ensure_built()
+        if season is None:
+            season = season_for(datetime.now())
+        with self._lock:
+            record = self._seasons.get(season, {}).get(team_id) or TeamRecord(team_id)
+            return record.as_dict()
+
+    def table(self, limit=None, season=None):
+        """A season's teams (default: current season) ordered by points, goal difference and goals scored"""
+        self._ensure_built()
+        if season is None:
+            season = season_for(datetime.now())
+        with self._lock:
+            table = self._tables.get(season)
+            if table is None:
+                records = sorted((record for record in self._seasons.get(season, {}).values() if record.played),
+                                 key=lambda r: (-r.points, -r.goal_difference, -r.goals_for))
+                table = self._tables[season] = [record.as_dict() for record in records]
+            return table[:limit] if limit else list(table)
+
+
+_engine = StandingsEngine()
+
+
+def get_standings():
+    return _engine
+
+
+def _on_match_updated(match_id, home_team_id, away_team_id, match_datetime,
+                      home_score, away_score, status, **payload):
+    # Only worth applying once the engine is built or being built; a later build reads the DB anyway
+    if _engine._built or _engine.rebuilding:
+        _engine.apply_match(match_id, home_team_id, away_team_id, match_datetime,
+                            home_score, away_score, status)
+
+
+events.subscribe(events.MATCH_UPDATED, _on_match_updated)
+
+
+if __name__ == "__main__":
+    # python standings.py rebuild [season]  - recompute and print a season's league table
+    if len(sys.argv) < 2 or sys.argv[1] != 'rebuild':
+        print("Usage: python standings.py rebuild [season]")
+        sys.exit(1)
+    from season_archive import get_archive
+    _engine.use_archive(get_archive())
+    _engine.rebuild()
+    season = int(sys.argv[2]) if len(sys.argv) > 2 else season_for(datetime.now())
+    print(f"Season {season}/{(season + 1) % 100:02d} (seasons: {', '.join(map(str, _engine.seasons()))})")
+    for position, row in enumerate(_engine.table(season=season), 1):
+        print(f"{position:>3}. {row['team_name'] or row['team_id']:<30} "
+              f"P{row['played']:>3} W{row['wins']:>3} D{row['draws']:>3} L{row['losses']:>3} "
+              f"GD{row['goal_difference']:>4} Pts{row['points']:>4}  {row['form']}")
@@ -0,0 +1,480 @@
+"""
+Bulk ingestion of PLAYER_STATS rows and match results
+Streams CSV or JSON input, validates each row, resolves player and match IDs
+through an in-memory index and writes in batched executemany transactions.
+JSON arrays are parsed incrementally, one row at a time, like CSV and JSON
+Lines. A batch that fails is rolled back and quarantined; the load carries on.
+Input that cannot be decoded or parsed stops the load at that point. Rows
+for a player and match that already have stats are rejected, so loading a
+file again does not count the matches twice. Rejected rows go to --quarantine,
+or to a timestamped file under QUARANTINE_DIR.
+
+Usage:
+    python stats_ingest.py stats box_scores.csv [--batch-size 500] [--quarantine bad.jsonl]
+    python stats_ingest.py results results.json
+"""
+
+import io
+import os
+import csv
+import sys
+import json
+import time
+import logging
+import argparse
+from datetime import datetime
+
+import events
+from db_pool import get_pool
+from queries import register
+from season_archive import get_archive
+
+logger = logging.getLogger('ingest')
+
+BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', 500))
+QUARANTINE_DIR = os.environ.get('QUARANTINE_DIR', './quarantine')
+MAX_REPORTED_ERRORS = 100
+# Characters read from a JSON stream at a time, and the longest single row accepted
+JSON_CHUNK = 64 * 1024
+MAX_JSON_ROW = 1024 * 1024
+
+INSERT_STATS_SQL = register('stats_ingest.insert_stats', '''
+    INSERT INTO PLAYER_STATS
+    (PlayerID, MatchID, Goals, Assists, YellowCards, RedCards, MinutesPlayed, PerformanceRating)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+''')
+# Stats already in the live seasons, so loading a file twice does not count a match twice
+LOADED_STATS_SQL = register('stats_ingest.loaded_stats', '''
+    SELECT PS.PlayerID, PS.MatchID
+    FROM PLAYER_STATS PS
+    INNER JOIN MATCHES M ON PS.MatchID = M.MatchID
+    WHERE M.MatchDateTime >= ?
+''')
+UPDATE_RESULT_SQL = register('stats_ingest.update_result', '''
+    UPDATE MATCHES SET HomeScore = ?, AwayScore = ?, Status = ? WHERE MatchID = ?
+''')
+MATCH_STATUSES = ('Scheduled', 'Ongoing', 'Completed', 'Cancelled')
+_END = object()
+
+
+class InvalidRow(ValueError):
+    """A row that fails validation; it is quarantined, not written"""
+
+
+class UnreadableInput(ValueError):
+    """Input that is not valid text in its format; the load stops where it was found"""
+
+
+class IngestReport:
+    """Counters and errors collected during one load"""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.rows_read = 0
+        self.rows_written = 0
+        self.rows_invalid = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.errors = []
+        self.match_ids = set()
+        self.results = []
+        self.quarantine_path = None
+        self.input_error = None
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def error(self, message):
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(message)
+
+    @property
+    def rows_per_second(self):
+        return self.rows_written / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            'kind': self.kind,
+            'rows_read': self.rows_read,
+            'rows_written': self.rows_written,
+            'rows_invalid': self.rows_invalid,
+            'batches': self.batches,
+            'failed_batches': self.failed_batches,
+            'elapsed_seconds': round(self.elapsed, 3),
+            'rows_per_second': round(self.rows_per_second, 1),
+            'quarantine_path': self.quarantine_path,
+            'input_error': self.input_error,
+            'errors': self.errors,
+        }
+
+
+class ReferenceIndex:
+    """In-memory lookup of players and matches, loaded once per ingest"""
+
+    def __init__(self, cursor):
+        cursor.execute('SELECT PlayerID, FullName FROM PLAYERS')
+        self.player_ids = set()
+        self.players_by_name = {}
+        for player_id, full_name in cursor.fetchall():
+            self.player_ids.add(player_id)
+            if full_name:
+                self.players_by_name.setdefault(full_name.strip().lower(), []).append(player_id)
+
+        cursor.execute('SELECT TeamID, TeamName FROM TEAMS')
+        team_ids = {name.strip().lower(): team_id for team_id, name in cursor.fetchall() if name}
+
+        cursor.execute('SELECT MatchID, HomeTeamID, AwayTeamID, MatchDateTime FROM MATCHES')
+        self.matches = {}
+        self.matches_by_fixture = {}
+        for match_id, home_id, away_id, match_datetime in cursor.fetchall():
+            self.matches[match_id] = (home_id, away_id, match_datetime)
+            if isinstance(match_datetime, datetime):
+                self.matches_by_fixture[(match_datetime.date(), home_id, away_id)] = match_id
+        self.team_ids = team_ids
+        self.loaded_stats = set()
+
+    def load_stats(self, cursor):
+        """(PlayerID, MatchID) of the stats rows already written for matches not archived"""
+        cursor.execute(LOADED_STATS_SQL, (get_archive().boundary() or datetime(1900, 1, 1),))
+        self.loaded_stats = {(player_id, match_id) for player_id, match_id in cursor.fetchall()}
+
+    def player(self, row):
+        if row.get('player_id') not in (None, ''):
+            player_id = _int(row, 'player_id')
+            if player_id not in self.player_ids:
+                raise InvalidRow(f"unknown player_id {player_id}")
+            return player_id
+        name = str(row.get('player_name') or '').strip().lower()
+        matches = self.players_by_name.get(name)
+        if not matches:
+            raise InvalidRow(f"unknown player '{row.get('player_name')}'")
+        if len(matches) > 1:
+            raise InvalidRow(f"ambiguous player name '{row.get('player_name')}', use player_id")
+        return matches[0]
+
+    def match(self, row):
+        if row.get('match_id') not in (None, ''):
+            match_id = _int(row, 'match_id')
+            if match_id not in self.matches:
+                raise InvalidRow(f"unknown match_id {match_id}")
+            return self._live(match_id)
+        try:
+            match_date = datetime.fromisoformat(str(row['match_date'])).date()
+            home_id = self.team_ids[str(row['home_team']).strip().lower()]
+            away_id = self.team_ids[str(row['away_team']).strip().lower()]
+        except (KeyError, ValueError):
+            raise InvalidRow("row needs match_id or match_date, home_team and away_team")
+        match_id = self.matches_by_fixture.get((match_date, home_id, away_id))
+        if match_id is None:
+            raise InvalidRow(f"no match {row['home_team']} vs {row['away_team']} on {match_date}")
+        return self._live(match_id)
+
+    def _live(self, match_id):
+        # Archived seasons are frozen; their stats and results are read from the snapshots
+        if get_archive().covers(self.matches[match_id][2]):
+            raise InvalidRow(f"match {match_id} is in an archived season")
+        return match_id
+
+
+def _int(row, field, default=None, low=None, high=None):
+    value = row.get(field)
+    if value in (None, ''):
+        if default is None:
+            raise InvalidRow(f"missing {field}")
+        return default
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise InvalidRow(f"{field} must be a whole number, got {value!r}")
+    if (low is not None and number < low) or (high is not None and number > high):
+        raise InvalidRow(f"{field} out of range: {number}")
+    return number
+
+
+def _rating(row):
+    value = row.get('rating', row.get('performance_rating'))
+    if value in (None, ''):
+        return None
+    try:
+        rating = float(value)
+    except (TypeError, ValueError):
+        raise InvalidRow(f"rating must be a number, got {value!r}")
+    if not 0 <= rating <= 10:
+        raise InvalidRow(f"rating out of range: {rating}")
+    return rating
+
+
+class JSONArrayReader:
+    """
+    Yields the items of a JSON array ([...] or {"rows": [...]}) read from a text
+    stream in chunks, so only the current row is held in memory
+    """
+
+    def __init__(self, stream, chunk_size=JSON_CHUNK):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.consumed = 0  # characters dropped from the front of buffer
+        self.eof = False
+
+    def _fill(self):
+        # Append the next chunk, dropping what has been consumed; False at the end of the stream
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.consumed += self.pos
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        # Next character after whitespace, or '' at the end
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self._fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def _expect(self, char):
+        found = self._peek()
+        if found != char:
+            raise UnreadableInput(f"invalid JSON: expected {char!r}, found {found or 'end of input'!r}")
+        self.pos += 1
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A value ending with the buffer may be a number cut off by the chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    raise UnreadableInput(f"invalid JSON: {e.msg} at character {self.consumed + e.pos}")
+            if len(self.buffer) - self.pos > MAX_JSON_ROW:
+                raise UnreadableInput(f"invalid JSON: a value is longer than {MAX_JSON_ROW} characters")
+            self._fill()
+
+    def _array(self):
+        self._expect('[')
+        if self._peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self._value()
+            char = self._peek()
+            self.pos += 1
+            if char == ']':
+                return
+            if char != ',':
+                raise UnreadableInput(f"invalid JSON: expected ',' or ']' between rows, found {char or 'end of input'!r}")
+
+    def __iter__(self):
+        char = self._peek()
+        if char == '[':
+            yield from self._array()
+            return
+        if char != '{':
+            raise UnreadableInput('JSON input must be an array of rows or an object with a "rows" array')
+        self.pos += 1
+        while self._peek() != '}':
+            key = self._value()
+            self._expect(':')
+            if key == 'rows':
+                yield from self._array()
+                return
+            self._value()
+            if self._peek() == ',':
+                self.pos += 1
+        raise UnreadableInput('JSON input must be an array of rows or an object with a "rows" array')
+
+
+def _parse_rows(stream, fmt):
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+    elif fmt == 'jsonl':
+        for number, line in enumerate(stream, 1):
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise UnreadableInput(f"invalid JSON on line {number}: {e}")
+    elif fmt == 'json':
+        yield from JSONArrayReader(stream)
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+
+def read_rows(stream, fmt):
+    """Yield rows from a text stream in 'csv', 'json' (array) or 'jsonl' format; raises UnreadableInput"""
+    try:
+        yield from _parse_rows(stream, fmt)
+    except UnicodeDecodeError as e:
+        raise UnreadableInput(f"input is not UTF-8 text: {e.reason}")
+    except csv.Error as e:
+        raise UnreadableInput(f"invalid CSV: {e}")
+
+
+def format_for(filename):
+    extension = os.path.splitext(filename)[1].lower().lstrip('.')
+    return {'csv': 'csv', 'json': 'json', 'jsonl': 'jsonl', 'ndjson': 'jsonl'}.get(extension, 'csv')
+
+
+class StatsIngest:
+    """Validates and writes rows in batches of batch_size"""
+
+    def __init__(self, kind='stats', batch_size=BATCH_SIZE, quarantine_path=None):
+        if kind not in ('stats', 'results'):
+            raise ValueError(f"Unknown ingest kind: {kind}")
+        self.kind = kind
+        self.batch_size = batch_size
+        self.quarantine_path = quarantine_path or \
+            os.path.join(QUARANTINE_DIR, f"quarantine_{kind}_{datetime.now():%Y%m%d_%H%M%S}.jsonl")
+        self._quarantine = None
+
+    def run(self, rows):
+        report = IngestReport(self.kind)
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            index = ReferenceIndex(cursor)
+            if self.kind == 'stats':
+                index.load_stats(cursor)
+            seen = set()
+            batch = []
+            rows = iter(rows)
+            while True:
+                try:
+                    row = next(rows, _END)
+                except UnreadableInput as e:
+                    # Rows before the fault are written; nothing after it can be read
+                    report.input_error = f"after row {report.rows_read}: {e}"
+                    report.error(report.input_error)
+                    break
+                if row is _END:
+                    break
+                report.rows_read += 1
+                try:
+                    params = self._validate(row, index, seen)
+                except InvalidRow as e:
+                    report.rows_invalid += 1
+                    report.error(f"row {report.rows_read}: {e}")
+                    self._quarantine_rows([row], str(e))
+                    continue
+                batch.append((row, params))
+                if len(batch) >= self.batch_size:
+                    self._write_batch(conn, cursor, batch, report)
+                    batch = []
+            if batch:
+                self._write_batch(conn, cursor, batch, report)
+
+        if self._quarantine:
+            self._quarantine.close()
+            self._quarantine = None
+            report.quarantine_path = self.quarantine_path
+        report.elapsed = time.perf_counter() - report.started
+        self._publish(report, index)
+        logger.info(f"Ingested {report.rows_written}/{report.rows_read} {self.kind} rows "
+                    f"({report.rows_per_second:.0f} rows/s, {report.failed_batches} failed batches)")
+        return report
+
+    def _validate(self, row, index, seen):
+        if not isinstance(row, dict):
+            raise InvalidRow(f"row must be an object with named fields, got {type(row).__name__}")
+        match_id = index.match(row)
+        if self.kind == 'results':
+            status = row.get('status') or 'Completed'
+            if status not in MATCH_STATUSES:
+                raise InvalidRow(f"unknown status {status!r}")
+            if match_id in seen:
+                raise InvalidRow(f"duplicate result for match {match_id}")
+            seen.add(match_id)
+            return (_int(row, 'home_score', low=0), _int(row, 'away_score', low=0), status, match_id)
+
+        player_id = index.player(row)
+        if (player_id, match_id) in index.loaded_stats:
+            raise InvalidRow(f"stats already loaded for player {player_id} in match {match_id}")
+        if (player_id, match_id) in seen:
+            raise InvalidRow(f"duplicate stats for player {player_id} in match {match_id}")
+        seen.add((player_id, match_id))
+        return (player_id, match_id,
+                _int(row, 'goals', 0, low=0),
+                _int(row, 'assists', 0, low=0),
+                _int(row, 'yellow_cards', 0, low=0, high=2),
+                _int(row, 'red_cards', 0, low=0, high=1),
+                _int(row, 'minutes', 0, low=0, high=130),
+                _rating(row))
+
+    def _write_batch(self, conn, cursor, batch, report):
+        report.batches += 1
+        sql = UPDATE_RESULT_SQL if self.kind == 'results' else INSERT_STATS_SQL
+        try:
+            cursor.executemany(sql, [params for _, params in batch])
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            report.failed_batches += 1
+            report.error(f"batch {report.batches} ({len(batch)} rows) failed: {e}")
+            logger.error(f"Ingest batch {report.batches} failed and was quarantined: {str(e)}")
+            self._quarantine_rows([row for row, _ in batch], f"batch failed: {e}")
+            return
+        report.rows_written += len(batch)
+        for _, params in batch:
+            report.match_ids.add(params[3] if self.kind == 'results' else params[1])
+        if self.kind == 'results':
+            report.results.extend(params for _, params in batch)
+
+    def _quarantine_rows(self, rows, reason):
+        if self._quarantine is None:
+            os.makedirs(os.path.dirname(self.quarantine_path) or '.', exist_ok=True)
+            self._quarantine = open(self.quarantine_path, 'a', encoding='utf-8')
+        for row in rows:
+            self._quarantine.write(json.dumps({'reason': reason, 'row': row}, default=str) + '\n')
+
+    def _publish(self, report, index):
+        if not report.rows_written:
+            return
+        if self.kind == 'stats':
+            events.publish(events.PLAYER_STATS_WRITTEN, match_ids=sorted(report.match_ids))
+            return
+        for home_score, away_score, status, match_id in report.results:
+            home_id, away_id, match_datetime = index.matches[match_id]
+            events.publish(events.MATCH_UPDATED, match_id=match_id,
+                           home_team_id=home_id, away_team_id=away_id, match_datetime=match_datetime,
+                           home_score=home_score, away_score=away_score, status=status)
+
+
+def ingest_stream(stream, fmt, kind='stats', batch_size=BATCH_SIZE, quarantine_path=None):
+    """Ingest a text stream; returns the IngestReport"""
+    return StatsIngest(kind, batch_size, quarantine_path).run(read_rows(stream, fmt))
+
+
+def ingest_upload(file_storage, kind='stats', batch_size=BATCH_SIZE):
+    """Ingest a Flask/Werkzeug uploaded file without reading it into memory"""
+    stream = io.TextIOWrapper(file_storage.stream, encoding='utf-8-sig', newline='')
+    return ingest_stream(stream, format_for(file_storage.filename or ''), kind, batch_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk load player stats or match results')
+    parser.add_argument('kind', choices=['stats', 'results'])
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=['csv', 'json', 'jsonl'])
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--quarantine')
+    args = parser.parse_args()
+
+    fmt = args.format or format_for(args.path)
+    with open(args.path, encoding='utf-8-sig', newline='') as stream:
+        report = ingest_stream(stream, fmt, args.kind, args.batch_size, args.quarantine)
+    print(json.dumps(report.as_dict(), indent=2))
+    return 0 if not report.failed_batches and not report.rows_invalid and not report.input_error else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
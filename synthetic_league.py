@@ -0,0 +1,371 @@
+"""
+Synthetic league generator for Sports Management System
+Builds a realistic, reproducible league (users, teams, venues, multi-season
+fixtures with results, player stats, physio records and fan engagement) and
+loads it into a local SQLite database for benchmarking.
+
+Usage:
+    python synthetic_league.py bench.db [--teams 20] [--seasons 3] [--seed 42]
+
+100 teams over 5 seasons gives roughly 50k matches.
+"""
+
+import os
+import sys
+import json
+import math
+import random
+import logging
+import argparse
+from itertools import islice
+from datetime import date, datetime, timedelta
+
+from db_backends import SQLiteBackend
+from password_hashing import get_hasher
+from player_analytics import SEASON_START_MONTH
+
+logger = logging.getLogger('synthetic_league')
+
+INSERT_BATCH = 5000
+SEASON_DAYS = 290
+KICKOFF_HOURS = (13, 15, 17, 20)
+
+CITIES = ['Riverside', 'Northport', 'Eastfield', 'Westbrook', 'Southgate', 'Kingsbridge',
+          'Ashford', 'Millbrook', 'Oakridge', 'Stonehaven', 'Fairview', 'Lakeside',
+          'Redcliff', 'Highbury', 'Greenwich', 'Harborview', 'Brookdale', 'Cedar Falls',
+          'Silverton', 'Ironbridge']
+SUFFIXES = ['United', 'City', 'Rovers', 'Athletic', 'Wanderers', 'Town', 'Albion', 'FC']
+FIRST_NAMES = ['James', 'Lucas', 'Mateo', 'Noah', 'Oliver', 'Ethan', 'Leo', 'Adam', 'Samuel',
+               'Daniel', 'Kofi', 'Yusuf', 'Luca', 'Marco', 'Hugo', 'Ivan', 'Kenji', 'Tomas',
+               'Diego', 'Rafael', 'Ali', 'Omar', 'Felix', 'Jonas']
+LAST_NAMES = ['Smith', 'Silva', 'Müller', 'Rossi', 'Garcia', 'Mensah', 'Kowalski', 'Novak',
+              'Jensen', 'Tanaka', 'Okafor', 'Dubois', 'Costa', 'Petrov', 'Haddad', 'Walker',
+              'Moreno', 'Berg', 'Ahmed', 'Kim', 'Fischer', 'Santos', 'Lindqvist', 'Byrne']
+# Squad shape: position -> share of a squad, weight as goal scorer, weight as provider
+POSITIONS = {
+    'Goalkeeper': (0.12, 0, 1),
+    'Defender': (0.33, 1, 2),
+    'Midfielder': (0.33, 3, 5),
+    'Forward': (0.22, 6, 3),
+}
+INJURIES = [('Hamstring strain', 'Grade 1 muscle tear', 'Rest and physiotherapy', 14),
+            ('Ankle sprain', 'Lateral ligament sprain', 'Strapping and mobility work', 10),
+            ('Knee ligament', 'MCL sprain', 'Brace and strengthening programme', 35),
+            ('Concussion', 'Mild concussion', 'Graduated return to play protocol', 7),
+            ('Groin strain', 'Adductor strain', 'Rest and progressive loading', 12),
+            ('Calf strain', 'Gastrocnemius strain', 'Physiotherapy', 18),
+            ('Fractured metatarsal', 'Stress fracture', 'Immobilisation', 60)]
+SPECIALIZATIONS = ['Physiotherapy', 'Sports Medicine', 'Orthopaedics', 'Rehabilitation']
+MEMBERSHIPS = ['Basic', 'Silver', 'Gold', 'Platinum']
+ENGAGEMENT_TYPES = ['Prediction', 'Comment', 'Attendance']
+COMMENTS = ['What a game!', 'Great defending today.', 'The referee had a shocker.',
+            'Best performance of the season.', 'We need a new striker.', None]
+
+INSERT_MATCHES_SQL = 'INSERT INTO MATCHES VALUES (?, ?, ?, ?, ?, ?, ?, ?)'
+INSERT_STATS_SQL = '''
+    INSERT INTO PLAYER_STATS
+    (PlayerID, MatchID, TeamID, Goals, Assists, YellowCards, RedCards, MinutesPlayed, PerformanceRating, Notes)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+INSERT_ENGAGEMENT_SQL = '''
+    INSERT INTO FAN_ENGAGEMENT (FanID, MatchID, Prediction, EngagementDate, EngagementType, Comment)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+INSERT_PHYSIO_SQL = '''
+    INSERT INTO PHYSIO_RECORDS
+    (PlayerID, RecordDate, InjuryType, Diagnosis, Treatment, ExpectedRecovery, Status, StaffID)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+class LeagueSpec:
+    """Size and shape of the generated league"""
+
+    def __init__(self, teams=20, seasons=3, players_per_team=25, medical_staff=10,
+                 fans=2000, match_squad=14, engagements_per_match=5, injury_rate=0.3,
+                 password='benchmark', seed=42):
+        if teams < 2:
+            raise ValueError("A league needs at least two teams")
+        self.teams = teams
+        self.seasons = seasons
+        self.players_per_team = players_per_team
+        self.medical_staff = medical_staff
+        self.fans = fans
+        self.match_squad = min(match_squad, players_per_team)
+        self.engagements_per_match = engagements_per_match
+        self.injury_rate = injury_rate
+        self.password = password
+        self.seed = seed
+
+    @property
+    def matches(self):
+        return self.teams * (self.teams - 1) * self.seasons
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in
+                ('teams', 'seasons', 'players_per_team', 'medical_staff', 'fans', 'match_squad',
+                 'engagements_per_match', 'injury_rate', 'seed')} | {'matches': self.matches}
+
+
+def _poisson(rng, lam):
+    # Knuth's method; lam stays small (goals per match)
+    limit, k, p = math.exp(-lam), 0, 1.0
+    while True:
+        p *= rng.random()
+        if p <= limit:
+            return k
+        k += 1
+
+
+def _round_robin(team_ids):
+    """Double round-robin rounds of (home, away) pairs using the circle method"""
+    teams = list(team_ids)
+    if len(teams) % 2:
+        teams.append(None)
+    n = len(teams)
+    rounds = []
+    for r in range(n - 1):
+        pairs = []
+        for i in range(n // 2):
+            home, away = teams[i], teams[n - 1 - i]
+            if home is not None and away is not None:
+                pairs.append((home, away) if (r + i) % 2 else (away, home))
+        rounds.append(pairs)
+        teams.insert(1, teams.pop())
+    return rounds + [[(away, home) for home, away in pairs] for pairs in rounds]
+
+
+def _batched(rows, size=INSERT_BATCH):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+class LeagueGenerator:
+    """Generates the rows for a LeagueSpec; IDs are assigned explicitly"""
+
+    def __init__(self, spec, now=None):
+        self.spec = spec
+        self.rng = random.Random(spec.seed)
+        self.now = (now or datetime.now()).replace(microsecond=0)
+        self.password_hash = get_hasher().hash_password(spec.password)
+        self.users = []
+        self.teams = []
+        self.venues = []
+        self.players = []
+        self.medical = []
+        self.fans = []
+        self.squads = {}
+        self.strength = {}
+        self._user_id = 0
+
+    def _user(self, username, role, registered):
+        self._user_id += 1
+        self.users.append((self._user_id, username, self.password_hash, f"{username}@example.com",
+                           f"07{self.rng.randrange(10**8, 10**9)}", registered, role))
+        return self._user_id
+
+    def _name(self):
+        return f"{self.rng.choice(FIRST_NAMES)} {self.rng.choice(LAST_NAMES)}"
+
+    def _registered(self):
+        return self.first_season_start - timedelta(days=self.rng.randrange(1, 365))
+
+    @property
+    def first_season_start(self):
+        start_year = self.now.year if self.now.month >= SEASON_START_MONTH else self.now.year - 1
+        return datetime(start_year - self.spec.seasons + 1, SEASON_START_MONTH, 1)
+
+    def build_people(self):
+        spec, rng = self.spec, self.rng
+        self._user('admin', 'admin', self._registered())
+
+        for team_id in range(1, spec.teams + 1):
+            city = CITIES[(team_id - 1) % len(CITIES)]
+            suffix = SUFFIXES[((team_id - 1) // len(CITIES)) % len(SUFFIXES)]
+            cycle = (team_id - 1) // (len(CITIES) * len(SUFFIXES))
+            name = f"{city} {suffix}" + (f" {cycle + 1}" if cycle else '')
+            coach_id = self._user(f"coach{team_id}", 'coach', self._registered())
+            self.teams.append((team_id, name, 'Synthetic League', coach_id))
+            self.venues.append((team_id, f"{city} Stadium", city, rng.randrange(8, 80) * 1000))
+            self.strength[team_id] = rng.uniform(0.7, 1.4)
+
+        player_id = 0
+        for team_id in range(1, spec.teams + 1):
+            squad = []
+            for position, (share, _, _) in POSITIONS.items():
+                for _ in range(max(1, round(spec.players_per_team * share))):
+                    player_id += 1
+                    user_id = self._user(f"player{player_id}", 'player', self._registered())
+                    born = date(self.now.year - rng.randrange(17, 36), rng.randrange(1, 13), rng.randrange(1, 29))
+                    self.players.append((player_id, user_id, self._name(), born, position, team_id, 'Active'))
+                    squad.append((player_id, position))
+            self.squads[team_id] = squad
+
+        for staff_id in range(1, spec.medical_staff + 1):
+            user_id = self._user(f"medic{staff_id}", 'medical', self._registered())
+            self.medical.append((staff_id, user_id, rng.choice(SPECIALIZATIONS), 'MSc'))
+
+        for fan_id in range(1, spec.fans + 1):
+            joined = self._registered()
+            user_id = self._user(f"fan{fan_id}", 'fan', joined)
+            self.fans.append((fan_id, user_id, rng.choice(MEMBERSHIPS), joined, rng.randrange(0, 5000)))
+
+    def matches(self):
+        """Yield MATCHES rows season by season; results only for matches before now"""
+        rounds = _round_robin(range(1, self.spec.teams + 1))
+        match_id = 0
+        for season in range(self.spec.seasons):
+            start = self.first_season_start.replace(year=self.first_season_start.year + season)
+            step = SEASON_DAYS / len(rounds)
+            for number, pairs in enumerate(rounds):
+                day = start + timedelta(days=int(number * step))
+                for home, away in pairs:
+                    match_id += 1
+                    kickoff = day.replace(hour=self.rng.choice(KICKOFF_HOURS))
+                    if kickoff < self.now:
+                        home_score = _poisson(self.rng, 1.45 * self.strength[home] / self.strength[away] ** 0.5)
+                        away_score = _poisson(self.rng, 1.1 * self.strength[away] / self.strength[home] ** 0.5)
+                        yield (match_id, home, away, kickoff, home, 'Completed', home_score, away_score)
+                    else:
+                        yield (match_id, home, away, kickoff, home, 'Scheduled', None, None)
+
+    def _lineup(self, team_id):
+        squad = self.squads[team_id]
+        keepers = [p for p in squad if p[1] == 'Goalkeeper']
+        outfield = [p for p in squad if p[1] != 'Goalkeeper']
+        chosen = keepers[:1] + self.rng.sample(outfield, min(len(outfield), self.spec.match_squad - 1))
+        return chosen
+
+    def _pick(self, lineup, column):
+        weights = [POSITIONS[position][column] for _, position in lineup]
+        return self.rng.choices(range(len(lineup)), weights=weights)[0] if any(weights) else None
+
+    def player_stats(self, match):
+        """PLAYER_STATS rows (without StatID) for one completed match"""
+        match_id, home, away, kickoff, _, _, home_score, away_score = match
+        rng = self.rng
+        for team_id, scored, conceded in ((home, home_score, away_score), (away, away_score, home_score)):
+            lineup = self._lineup(team_id)
+            goals = [0] * len(lineup)
+            assists = [0] * len(lineup)
+            for _ in range(scored):
+                scorer = self._pick(lineup, 1)
+                goals[scorer] += 1
+                if rng.random() < 0.7:
+                    provider = self._pick(lineup, 2)
+                    if provider != scorer:
+                        assists[provider] += 1
+            for index, (player_id, position) in enumerate(lineup):
+                starter = index < 11
+                minutes = rng.randrange(60, 91) if starter else rng.randrange(1, 31)
+                yellow = 1 if rng.random() < 0.12 else 0
+                red = 1 if rng.random() < 0.01 else 0
+                rating = 6.0 + goals[index] * 0.8 + assists[index] * 0.5 + (scored - conceded) * 0.2
+                rating = round(min(10.0, max(3.0, rating + rng.gauss(0, 0.6))), 1)
+                yield (player_id, match_id, team_id, goals[index], assists[index], yellow, red,
+                       minutes, rating, None)
+
+    def physio_records(self):
+        rng, spec = self.rng, self.spec
+        for season in range(spec.seasons):
+            start = self.first_season_start.replace(year=self.first_season_start.year + season)
+            for player_id, *_ in self.players:
+                if rng.random() >= spec.injury_rate or not self.medical:
+                    continue
+                recorded = start + timedelta(days=rng.randrange(0, SEASON_DAYS), hours=rng.randrange(9, 18))
+                if recorded > self.now:
+                    continue
+                injury, diagnosis, treatment, days = rng.choice(INJURIES)
+                recovery = (recorded + timedelta(days=days)).date()
+                status = 'Recovered' if recovery < self.now.date() else rng.choice(['Ongoing', 'Monitoring'])
+                yield (player_id, recorded, injury, diagnosis, treatment, recovery, status,
+                       rng.choice(self.medical)[0])
+
+    def engagements(self, match):
+        match_id, _, _, kickoff, _, status, home_score, away_score = match
+        rng = self.rng
+        for _ in range(self.spec.engagements_per_match if self.fans else 0):
+            kind = rng.choice(ENGAGEMENT_TYPES)
+            when = kickoff - timedelta(hours=rng.randrange(1, 72)) if kind == 'Prediction' \
+                else kickoff + timedelta(hours=rng.randrange(2, 24))
+            if when > self.now:
+                continue
+            prediction = f"{rng.randrange(0, 4)}-{rng.randrange(0, 4)}" if kind == 'Prediction' else None
+            comment = rng.choice(COMMENTS) if kind == 'Comment' else None
+            yield (rng.choice(self.fans)[0], match_id, prediction, when, kind, comment)
+
+
+def generate(db_path, spec=None, now=None):
+    """Create db_path from scratch and fill it; returns a summary dict"""
+    spec = spec or LeagueSpec()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+
+    generator = LeagueGenerator(spec, now)
+    generator.build_people()
+    conn = SQLiteBackend(db_path).connect()
+    conn.execute('PRAGMA synchronous=OFF')
+    cursor = conn.cursor()
+
+    def insert(sql, rows):
+        count = 0
+        for batch in _batched(rows):
+            cursor.executemany(sql, batch)
+            count += len(batch)
+        conn.commit()
+        return count
+
+    counts = {
+        'users': insert('INSERT INTO USERS VALUES (?, ?, ?, ?, ?, ?, ?)', generator.users),
+        'teams': insert('INSERT INTO TEAMS VALUES (?, ?, ?, ?)', generator.teams),
+        'venues': insert('INSERT INTO VENUES VALUES (?, ?, ?, ?)', generator.venues),
+        'players': insert('INSERT INTO PLAYERS VALUES (?, ?, ?, ?, ?, ?, ?)', generator.players),
+        'medical_staff': insert('INSERT INTO MEDICAL_STAFF VALUES (?, ?, ?, ?)', generator.medical),
+        'fans': insert('INSERT INTO FANS VALUES (?, ?, ?, ?, ?)', generator.fans),
+        'matches': 0,
+        'player_stats': 0,
+        'fan_engagement': 0,
+    }
+
+    # Matches are written a batch at a time, each followed by its stats and engagement rows
+    for matches in _batched(generator.matches()):
+        counts['matches'] += insert(INSERT_MATCHES_SQL, matches)
+        counts['player_stats'] += insert(INSERT_STATS_SQL, (
+            row for match in matches if match[5] == 'Completed' for row in generator.player_stats(match)))
+        counts['fan_engagement'] += insert(INSERT_ENGAGEMENT_SQL, (
+            row for match in matches for row in generator.engagements(match)))
+    counts['physio_records'] = insert(INSERT_PHYSIO_SQL, generator.physio_records())
+
+    conn.execute('ANALYZE')
+    conn.commit()
+    conn.close()
+    logger.info(f"Synthetic league written to {db_path}: {counts}")
+    return {'db_path': db_path, 'spec': spec.as_dict(), 'rows': counts}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic league database')
+    parser.add_argument('db_path')
+    parser.add_argument('--teams', type=int, default=20)
+    parser.add_argument('--seasons', type=int, default=3)
+    parser.add_argument('--players-per-team', type=int, default=25)
+    parser.add_argument('--medical-staff', type=int, default=10)
+    parser.add_argument('--fans', type=int, default=2000)
+    parser.add_argument('--engagements-per-match', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    spec = LeagueSpec(teams=args.teams, seasons=args.seasons, players_per_team=args.players_per_team,
+                      medical_staff=args.medical_staff, fans=args.fans,
+                      engagements_per_match=args.engagements_per_match, seed=args.seed)
+    print(json.dumps(generate(args.db_path, spec), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())